@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from databasehandler import DatabaseHandler
+
+try:
+    import tracemalloc
+except ImportError: # Python 2
+    tracemalloc = None
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+"""Cyborg Navigation DatabaseHandler Benchmark
+
+Runs without ROS. Builds a synthetic database with N locations spread over
+several maps, M events and K responses, then times every DatabaseHandler
+query path cold (new handler, empty cache) and warm, and writes p50/p99
+latency and memory use to a JSON file that can be compared across commits.
+
+    $ python databasebenchmark.py --locations 10000 --events 100000 --output bench.json"""
+
+WARM_UP_RUNS = 100
+EMOTIONS = ["neutral", "happy", "angry", "sad", "curious", "bored", "elated", "fear"]
+MAP_SIZE = 200.0 # (m) Width and height of every synthetic map
+
+
+# Fills a new database file with synthetic data, returns the names of the maps
+def create_dataset(path, locations, events, responses, maps, seed):
+    generator = random.Random(seed)
+    map_names = ["building" + str(i) + ".map" for i in range(maps)]
+    database_handler = DatabaseHandler(filename=path)
+    database_handler.create()
+    database_handler.import_records("Location", ({
+        "location_name": "location " + str(i),
+        "robot_map_name": map_names[i % maps],
+        "x": generator.uniform(-MAP_SIZE / 2, MAP_SIZE / 2),
+        "y": generator.uniform(-MAP_SIZE / 2, MAP_SIZE / 2),
+        "r": generator.uniform(-3.14, 3.14),
+        "threshold": generator.uniform(1.0, 4.0),
+        "crowded": generator.random() < 0.5,
+        "enviorment": generator.uniform(-0.2, 0.2)} for i in range(locations)))
+    start = datetime.datetime(2017, 1, 1)
+    database_handler.import_records("Event", ({
+        "event_name": "event " + str(i),
+        "location_name": "location " + str(generator.randrange(locations)),
+        "start_date": start + datetime.timedelta(minutes=i * 5),
+        "end_date": start + datetime.timedelta(minutes=i * 5 + generator.randint(1, 240)),
+        "ignore": generator.random() < 0.05} for i in range(events)))
+    database_handler.import_records("Response", ({
+        "message": "Response " + str(i) + " about LOCATION",
+        "response_type": "navigation_response",
+        "emotion": EMOTIONS[i % len(EMOTIONS)]} for i in range(responses)))
+    database_handler.close()
+    return map_names
+
+
+# Returns (name, function) for every query path, the functions take a handler and a random generator
+def query_paths(map_names, events):
+    start = datetime.datetime(2017, 1, 1)
+    def date(generator):
+        return start + datetime.timedelta(minutes=generator.uniform(0, max(events, 1) * 5))
+    def position(generator):
+        return generator.uniform(-MAP_SIZE / 2, MAP_SIZE / 2)
+    return [
+        ("find_location", lambda handler, generator: handler.find_location(robot_map_name=generator.choice(map_names), location_x=position(generator), location_y=position(generator))),
+        ("search_ongoing_events", lambda handler, generator: handler.search_ongoing_events(robot_map_name=generator.choice(map_names), current_date=date(generator))),
+        ("next_event_boundary", lambda handler, generator: handler.next_event_boundary(robot_map_name=generator.choice(map_names), current_date=date(generator))),
+        ("search_for_crowded_locations", lambda handler, generator: handler.search_for_crowded_locations(robot_map_name=generator.choice(map_names), crowded=generator.random() < 0.5)),
+        ("plan_tour", lambda handler, generator: handler.plan_tour(robot_map_name=generator.choice(map_names), location_x=position(generator), location_y=position(generator), crowded=generator.random() < 0.5, count=5)),
+        ("get_all_locations", lambda handler, generator: handler.get_all_locations()),
+        ("search_for_response", lambda handler, generator: handler.search_for_response(response_type="navigation_response", emotion=generator.choice(EMOTIONS))),
+        ("find_location_mentions", lambda handler, generator: handler.find_location_mentions(text="please go to location " + str(generator.randrange(1000)) + " now")),
+    ]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summary(samples):
+    return {"count": len(samples), "p50_us": percentile(samples, 0.50) * 1e6, "p99_us": percentile(samples, 0.99) * 1e6, "max_us": max(samples) * 1e6, "mean_us": sum(samples) / len(samples) * 1e6}
+
+
+def max_rss_kb():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == "darwin" else usage # bytes on macOS, kB elsewhere
+
+
+def run_path(path, name, query, iterations, cold_runs, seed, warm_up_runs=WARM_UP_RUNS):
+    generator = random.Random(seed)
+    cold = []
+    for i in range(cold_runs): # New handler every time: connection, snapshot and indexes are built inside the timed call
+        database_handler = DatabaseHandler(filename=path)
+        started = time.time()
+        query(database_handler, generator)
+        cold.append(time.time() - started)
+        database_handler.close()
+
+    database_handler = DatabaseHandler(filename=path)
+    for i in range(warm_up_runs): # Build the snapshot and the per-map indexes of every map
+        query(database_handler, generator)
+    gc.collect()
+    warm = []
+    for i in range(iterations):
+        started = time.time()
+        query(database_handler, generator)
+        warm.append(time.time() - started)
+    result = {"cold": summary(cold), "warm": summary(warm)}
+    if tracemalloc is not None: # Separate pass, tracing slows down every allocation
+        tracemalloc.start()
+        for i in range(min(iterations, 100)):
+            query(database_handler, generator)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["warm_peak_allocated_kb"] = peak / 1024.0
+    database_handler.close()
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.STDOUT).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DatabaseHandler query paths on a synthetic dataset.")
+    parser.add_argument("--locations", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--responses", type=int, default=100)
+    parser.add_argument("--maps", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=2000, help="warm calls per query path")
+    parser.add_argument("--cold-runs", type=int, default=5, help="calls on a new handler per query path")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database", default=None, help="reuse or keep this database file instead of a temporary one")
+    parser.add_argument("--output", default="databasebenchmark.json", help="JSON result file, - for standard output")
+    options = parser.parse_args(arguments)
+
+    path = options.database
+    temporary = path is None
+    if temporary:
+        handle, path = tempfile.mkstemp(suffix=".db", prefix="navigation_benchmark_")
+        os.close(handle)
+        os.remove(path)
+    try:
+        started = time.time()
+        if not os.path.exists(path):
+            map_names = create_dataset(path, options.locations, options.events, options.responses, options.maps, options.seed)
+        else:
+            map_names = ["building" + str(i) + ".map" for i in range(options.maps)]
+        setup_seconds = time.time() - started
+        sys.stderr.write("Cyborg Navigation: Dataset ready in " + str(round(setup_seconds, 2)) + " s...\n")
+
+        results = {}
+        for name, query in query_paths(map_names, options.events):
+            results[name] = run_path(path, name, query, options.iterations, options.cold_runs, options.seed)
+            sys.stderr.write("%-30s cold p50 %10.1f us   warm p50 %8.1f us   p99 %8.1f us\n" % (name, results[name]["cold"]["p50_us"], results[name]["warm"]["p50_us"], results[name]["warm"]["p99_us"]))
+
+        report = {
+            "revision": git_revision(),
+            "date": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": {"locations": options.locations, "events": options.events, "responses": options.responses, "maps": options.maps, "iterations": options.iterations, "cold_runs": options.cold_runs, "seed": options.seed},
+            "setup_seconds": setup_seconds,
+            "database_bytes": os.path.getsize(path),
+            "max_rss_kb": max_rss_kb(),
+            "results": results,
+        }
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if options.output == "-":
+            sys.stdout.write(text + "\n")
+        else:
+            with open(options.output, "w") as output:
+                output.write(text + "\n")
+        return 0
+    finally:
+        if temporary:
+            for suffix in ["", "-wal", "-shm"]:
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from navigationmetrics import DEADLINES_TOTAL
+
+try:
+    import Queue as queue
+except ImportError: # Python 3
+    import queue
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+
+class DatabaseTimeout(Exception):
+    """DatabaseTimeout
+
+    The deadline of a database call passed before it ran, or before its
+    result was ready."""
+    pass
+
+
+class DatabaseFuture(object):
+    """DatabaseFuture
+
+    The result of a call submitted to the DatabaseExecutor."""
+
+    def __init__(self, name=""):
+        self.name = name
+        self.condition = threading.Condition()
+        self.finished = False
+        self.value = None
+        self.error = None
+        self.callbacks = []
+
+    def done(self):
+        return self.finished
+
+    # Returns the result, raises the exception of the call, or DatabaseTimeout if it is not done within timeout (s)
+    def result(self, timeout=None):
+        with self.condition:
+            if not self.finished:
+                self.condition.wait(timeout)
+            if not self.finished:
+                raise DatabaseTimeout("DatabaseExecutor: " + self.name + " did not finish within " + str(timeout) + " s")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def exception(self, timeout=None):
+        try:
+            self.result(timeout)
+        except DatabaseTimeout:
+            if not self.finished:
+                raise
+            return self.error
+        except Exception as e:
+            return e
+        return None
+
+    # The callback is called with the future when it is done, on the thread that finished it (or now if already done)
+    def add_done_callback(self, callback):
+        with self.condition:
+            if not self.finished:
+                self.callbacks.append(callback)
+                return
+        self.call(callback)
+
+    def set_result(self, value):
+        self.finish(value, None)
+
+    def set_exception(self, error):
+        self.finish(None, error)
+
+    def finish(self, value, error):
+        with self.condition:
+            if self.finished:
+                return
+            self.value = value
+            self.error = error
+            self.finished = True
+            callbacks = self.callbacks
+            self.callbacks = []
+            self.condition.notify_all()
+        for callback in callbacks:
+            self.call(callback)
+
+    def call(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            sys.stderr.write("DatabaseExecutor: Exception in done callback of " + self.name + "...\n" + traceback.format_exc())
+
+
+class DatabaseExecutor(object):
+    """DatabaseExecutor
+
+    Runs DatabaseHandler work off the ROS callback threads. Reads (any
+    callable, e.g. a DatabaseHandler method) go to a small pool of reader
+    threads, writes (SQL statements) to one writer thread that commits every
+    statement waiting in its queue in one transaction. Both return a
+    DatabaseFuture. A call whose deadline (s from submission) has passed
+    when a thread picks it up fails with DatabaseTimeout without running.
+
+    While the executor runs, the handler checks its snapshot against the
+    database here instead of on the calling thread, so a reader only ever
+    waits for the very first load."""
+
+    reader_threads = 2
+    write_batch_size = 100 # Statements committed in one transaction at most
+
+    def __init__(self, database_handler):
+        self.database_handler = database_handler
+        self.reads = queue.Queue()
+        self.writes = queue.Queue()
+        self.threads = []
+        self.is_running = False
+        self.refresh_lock = threading.Lock()
+        self.refresh_pending = False
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        for i in range(self.reader_threads):
+            self.threads.append(threading.Thread(target=self.read_loop, name="DatabaseExecutor reader " + str(i)))
+        self.threads.append(threading.Thread(target=self.write_loop, name="DatabaseExecutor writer"))
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+        self.database_handler.background_refresh = self.refresh
+        self.refresh()
+
+    # Stops the threads after the queued work is done, work submitted afterwards fails at once
+    def shutdown(self, wait=True):
+        if not self.is_running:
+            return
+        self.is_running = False
+        self.database_handler.background_refresh = None
+        for i in range(self.reader_threads):
+            self.reads.put(None)
+        self.writes.put(None)
+        if wait:
+            for thread in self.threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+        self.threads = []
+
+    # Runs function(*arguments, **keywords) on a reader thread and returns a DatabaseFuture, deadline (s) may be None
+    def submit(self, deadline, function, *arguments, **keywords):
+        future = DatabaseFuture(getattr(function, "__name__", "call"))
+        if not self.is_running:
+            future.set_exception(sqlite3.ProgrammingError("DatabaseExecutor: Executor is not running..."))
+            return future
+        self.reads.put((future, time.time() + deadline if deadline is not None else None, function, arguments, keywords))
+        return future
+
+    # Queues a write statement for the writer thread and returns a DatabaseFuture of the rowid, deadline (s) may be None
+    def execute(self, deadline, sql, parameters=()):
+        future = DatabaseFuture(sql.split(" ", 1)[0])
+        if not self.is_running:
+            future.set_exception(sqlite3.ProgrammingError("DatabaseExecutor: Executor is not running..."))
+            return future
+        self.writes.put((future, time.time() + deadline if deadline is not None else None, sql, parameters))
+        return future
+
+    # Schedules one snapshot check on a reader thread, unless one is already waiting
+    def refresh(self):
+        with self.refresh_lock:
+            if self.refresh_pending:
+                return
+            self.refresh_pending = True
+        self.submit(None, self.refresh_snapshot)
+
+    def refresh_snapshot(self):
+        with self.refresh_lock:
+            self.refresh_pending = False
+        try:
+            self.database_handler.check_snapshot()
+        except sqlite3.Error as e:
+            print("DatabaseExecutor: Unable to check_snapshot() - " + str(e) + "...")
+
+    # Fails the future if its deadline has passed, returns True if it did
+    def expired(self, future, expires):
+        if expires is None or time.time() <= expires:
+            return False
+        if self.database_handler.metrics is not None:
+            self.database_handler.metrics.increment(DEADLINES_TOTAL, future.name)
+        future.set_exception(DatabaseTimeout("DatabaseExecutor: Deadline of " + future.name + " passed before it ran"))
+        return True
+
+    def read_loop(self): # Threaded
+        while True:
+            work = self.reads.get()
+            if work is None:
+                return
+            future, expires, function, arguments, keywords = work
+            if self.expired(future, expires):
+                continue
+            try:
+                future.set_result(function(*arguments, **keywords))
+            except Exception as e:
+                future.set_exception(e)
+
+    def write_loop(self): # Threaded
+        stopping = False
+        while not stopping:
+            work = self.writes.get()
+            if work is None:
+                return
+            batch = [work]
+            while len(batch) < self.write_batch_size: # Everything already waiting goes in the same transaction
+                try:
+                    work = self.writes.get_nowait()
+                except queue.Empty:
+                    break
+                if work is None:
+                    stopping = True
+                    break
+                batch.append(work)
+            self.write_batch([(future, sql, parameters) for future, expires, sql, parameters in batch if not self.expired(future, expires)])
+
+    def write_batch(self, batch):
+        if len(batch) == 0:
+            return
+        results = []
+        try:
+            connection = self.database_handler.connect()
+            with connection:
+                for future, sql, parameters in batch:
+                    try:
+                        cursor = connection.execute(sql, parameters)
+                        results.append((future, cursor.lastrowid, None))
+                        cursor.close()
+                    except sqlite3.IntegrityError as e: # Only this statement fails, the rest of the batch is committed
+                        results.append((future, None, e))
+        except sqlite3.Error as e:
+            print("DatabaseExecutor: Unable to write " + str(len(batch)) + " statements - " + str(e) + "...")
+            for future, sql, parameters in batch:
+                future.set_exception(e)
+            return
+        try:
+            self.database_handler.check_snapshot() # Reads made after a write future is done see the write
+        except sqlite3.Error as e:
+            print("DatabaseExecutor: Unable to check_snapshot() - " + str(e) + "...")
+        for future, value, error in results:
+            if error is None:
+                future.set_result(value)
+            else:
+                future.set_exception(error)
@@ -6,8 +6,17 @@ import sqlite3
 import datetime
 import collections
 import random
-import math
+import threading
+import time
 from collections import namedtuple
+from spatialindex import SpatialIndex
+from distancematrix import DistanceMatrix
+from locationcolumns import LocationColumns, LocationSequence
+from intervalindex import IntervalIndex, parse_date
+from eventschedule import ScheduleIndex, EventIndex
+from locationmatcher import LocationMatcher
+from responsetemplate import ResponseTemplate
+from navigationmetrics import timed, QUERY_SECONDS
 
 __author__ = "Thomas Rostrup Andersen"
 __copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
@@ -17,41 +26,632 @@ __all__ = []
 
 LocationRecord = collections.namedtuple('LocationRecord', 'location_name robot_map_name x y z p j r threshold crowded enviorment')
 EventRecord = collections.namedtuple('EventRecord', ["event_id", 'event_name', "location_name", "start_date", "end_date", "ignore", "robot_map_name", 'x', "y", "z", "p", "j", "r", "threshold", "crowded", "enviorment"])
+ScheduleRecord = collections.namedtuple('ScheduleRecord', ["schedule_id", "event_name", "location_name", "rule", "duration", "first_date", "last_date", "exceptions", "ignore", "robot_map_name", 'x', "y", "z", "p", "j", "r", "threshold", "crowded", "enviorment"])
 ResponseRecord = collections.namedtuple('ResponseRecord', ["response_id", 'message', "response_type", "emotion"])
 
+# The SQL text is the key of sqlite3's per connection statement cache, so every query is kept as a constant
+SQL_ADD_RESPONSE = "INSERT INTO Response (message, response_type, emotion) VALUES (?,?,?)"
+SQL_GET_ALL_LOCATIONS = "SELECT * from Location"
+SQL_ADD_LOCATION = "INSERT INTO Location (location_name, robot_map_name, x, y, z, p, j, r, threshold, crowded, enviorment) VALUES (?,?,?,?,?,?,?,?,?,?,?)"
+SQL_ADD_EVENT = "INSERT INTO Event (event_name, location_name, start_date, end_date, ignore) VALUES (?,?,?,?,?)"
+SQL_GET_ALL_RESPONSES = "SELECT * from Response"
+SQL_GET_LOCATION_MAPS = "SELECT location_name, robot_map_name from Location"
+SQL_GET_MAP_LOCATIONS = "SELECT * from Location WHERE robot_map_name = ?"
+SQL_GET_MAP_EVENTS = "SELECT * from Event natural join Location WHERE robot_map_name = ? AND ignore = 0"
+SQL_ADD_SCHEDULE = "INSERT INTO Schedule (event_name, location_name, rule, duration, first_date, last_date, exceptions, ignore) VALUES (?,?,?,?,?,?,?,?)"
+SQL_GET_MAP_SCHEDULES = "SELECT * from Schedule natural join Location WHERE robot_map_name = ? AND ignore = 0"
+SQL_CREATE_TRAVEL = "CREATE TABLE IF NOT EXISTS Travel(travel_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, robot_map_name TEXT, from_location TEXT, to_location TEXT, start_date DATETIME, duration REAL, outcome TEXT)"
+SQL_ADD_TRAVEL = "INSERT INTO Travel (robot_map_name, from_location, to_location, start_date, duration, outcome) VALUES (?,?,?,?,?,?)"
+SQL_GET_TRAVEL_TIMES = "SELECT from_location, to_location, duration from Travel WHERE outcome = 'succeeded'"
+SQL_GET_LOCATION_REVISION = "SELECT revision from Revision WHERE table_name = 'Location'"
+SQL_GET_REVISIONS = "SELECT table_name, revision from Revision"
+REVISION_TABLES = ["Location", "Event", "Schedule", "Response"] # The tables a DatabaseSnapshot is made from
+
+# Schema migrations, applied in order by DatabaseHandler.migrate(). The schema version (PRAGMA user_version) is the number
+# of migrations applied. Statements are idempotent, so a database created before the versioning starts at 0 and is upgraded in place
+SCHEMA_MIGRATIONS = [
+    [ # 1: The original tables
+        "CREATE TABLE IF NOT EXISTS Location(location_name TEXT PRIMARY KEY NOT NULL, robot_map_name TEXT, x REAL, y REAL, z REAL, p REAL, j REAL, r REAL, threshold REAL, crowded BOOLEAN, enviorment REAL)",
+        "CREATE TABLE IF NOT EXISTS Event(event_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, event_name TEXT, location_name TEXT, start_date DATETIME, end_date DATETIME, ignore BOOLEAN, FOREIGN KEY(location_name) REFERENCES Location(location_name))",
+        "CREATE TABLE IF NOT EXISTS Response(response_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, message TEXT, response_type TEXT, emotion TEXT)",
+    ],
+    [ # 2: Append-only record of every move, see TravelTimes
+        SQL_CREATE_TRAVEL,
+    ],
+    [ # 3: Indexes for the query paths in QUERY_PLANS
+        "CREATE INDEX IF NOT EXISTS Location_map ON Location(robot_map_name, crowded, location_name)", # Also covers SQL_GET_LOCATION_MAPS
+        "CREATE INDEX IF NOT EXISTS Event_location ON Event(location_name, ignore)",
+        "CREATE INDEX IF NOT EXISTS Travel_outcome ON Travel(outcome, from_location, to_location, duration)", # Covers SQL_GET_TRAVEL_TIMES
+    ],
+    [ # 4: A revision counted up by every change to the Location table, tells whether a LocationColumns file is current
+        "CREATE TABLE IF NOT EXISTS Revision(table_name TEXT PRIMARY KEY NOT NULL, revision INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO Revision (table_name, revision) VALUES ('Location', 1)",
+        "CREATE TRIGGER IF NOT EXISTS Location_insert AFTER INSERT ON Location BEGIN UPDATE Revision SET revision = revision + 1 WHERE table_name = 'Location'; END",
+        "CREATE TRIGGER IF NOT EXISTS Location_update AFTER UPDATE ON Location BEGIN UPDATE Revision SET revision = revision + 1 WHERE table_name = 'Location'; END",
+        "CREATE TRIGGER IF NOT EXISTS Location_delete AFTER DELETE ON Location BEGIN UPDATE Revision SET revision = revision + 1 WHERE table_name = 'Location'; END",
+    ],
+    [ # 5: Recurring events, a cron rule (see CronRule) and the duration (s) of each occurrence instead of one row per occurrence
+        "CREATE TABLE IF NOT EXISTS Schedule(schedule_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, event_name TEXT, location_name TEXT, rule TEXT, duration REAL, first_date DATETIME, last_date DATETIME, exceptions TEXT, ignore BOOLEAN, FOREIGN KEY(location_name) REFERENCES Location(location_name))",
+        "CREATE INDEX IF NOT EXISTS Schedule_location ON Schedule(location_name, ignore)",
+    ],
+    [ # 6: Revisions of the other tables a snapshot is made from, so a commit to Travel alone does not reload the snapshot
+        "INSERT OR IGNORE INTO Revision (table_name, revision) VALUES ('" + table + "', 1)" for table in REVISION_TABLES[1:]
+    ] + [
+        "CREATE TRIGGER IF NOT EXISTS " + table + "_" + action.lower() + " AFTER " + action + " ON " + table + " BEGIN UPDATE Revision SET revision = revision + 1 WHERE table_name = '" + table + "'; END" for table in REVISION_TABLES[1:] for action in ["INSERT", "UPDATE", "DELETE"]
+    ],
+]
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
+
+# Every read query with example parameters for DatabaseHandler.check_query_plans(). Full reads load every row on purpose and may scan the table
+QUERY_PLANS = [
+    ("location_maps", SQL_GET_LOCATION_MAPS, (), False),
+    ("map_locations", SQL_GET_MAP_LOCATIONS, ("ntnu2.map", ), False),
+    ("map_events", SQL_GET_MAP_EVENTS, ("ntnu2.map", ), False),
+    ("map_schedules", SQL_GET_MAP_SCHEDULES, ("ntnu2.map", ), False),
+    ("travel_times", SQL_GET_TRAVEL_TIMES, (), False),
+    ("location_revision", SQL_GET_LOCATION_REVISION, (), False),
+    ("all_locations", SQL_GET_ALL_LOCATIONS, (), True),
+    ("all_responses", SQL_GET_ALL_RESPONSES, (), True),
+    ("revisions", SQL_GET_REVISIONS, (), True),
+]
+
+# Columns of each table in table order, the first column is the key. Used by the bulk import and export
+TABLE_COLUMNS = collections.OrderedDict([
+    ("Location", ["location_name", "robot_map_name", "x", "y", "z", "p", "j", "r", "threshold", "crowded", "enviorment"]),
+    ("Event", ["event_id", "event_name", "location_name", "start_date", "end_date", "ignore"]),
+    ("Response", ["response_id", "message", "response_type", "emotion"]),
+    ("Travel", ["travel_id", "robot_map_name", "from_location", "to_location", "start_date", "duration", "outcome"]),
+    ("Schedule", ["schedule_id", "event_name", "location_name", "rule", "duration", "first_date", "last_date", "exceptions", "ignore"]),
+])
+REAL_COLUMNS = set(["x", "y", "z", "p", "j", "r", "threshold", "enviorment", "duration"])
+BOOLEAN_COLUMNS = set(["crowded", "ignore"])
+DATE_COLUMNS = set(["start_date", "end_date", "first_date", "last_date"])
+COLUMN_DEFAULTS = {"robot_map_name": "ntnu.map", "x": 0.0, "y": 0.0, "z": 0.0, "p": 0.0, "j": 0.0, "r": 0.0, "threshold": 0.0, "crowded": False, "enviorment": 0.0, "ignore": False}
+
+
+# The EventRecord of one occurrence of a schedule, it has no event_id
+def schedule_occurrence(schedule, start_date, end_date):
+    return EventRecord(None, schedule.event_name, schedule.location_name, start_date, end_date, False, schedule.robot_map_name, schedule.x, schedule.y, schedule.z, schedule.p, schedule.j, schedule.r, schedule.threshold, schedule.crowded, schedule.enviorment)
+
+
+class MapPartition(object):
+    """MapPartition
+
+    The locations of one map, its events once an event query needs them, and
+    the indexes built from them on first use. The locations are either a
+    list of LocationRecord or a LocationSequence of a memory-mapped
+    LocationColumns, which is searched as it is."""
+
+    def __init__(self, robot_map_name, locations):
+        self.robot_map_name = robot_map_name
+        self.locations = locations
+        self.locations_by_name = None # location_name -> LocationRecord, None for a LocationSequence
+        self.locations_by_crowded = {} # crowded -> [LocationRecord] or LocationSequence
+        if isinstance(locations, LocationSequence):
+            for crowded in [False, True]:
+                self.locations_by_crowded[crowded] = locations.where_crowded(crowded)
+        else:
+            self.locations_by_name = {}
+            for location in locations:
+                self.locations_by_name[location.location_name] = location
+                self.locations_by_crowded.setdefault(bool(location.crowded), []).append(location)
+        self.events = None # [EventRecord] that are not ignored, loaded on first use
+        self.schedules = None # [ScheduleRecord] that are not ignored, loaded with the events
+        self.spatial = None # SpatialIndex, built on first use
+        self.distances = None # DistanceMatrix, built on first use
+        self.intervals = None # EventIndex of the events and schedules, built on first use
+
+    # Number of records held, what the partition budget of the snapshot counts. Memory-mapped locations are not held
+    def size(self):
+        return (0 if self.locations_by_name is None else len(self.locations)) + (len(self.events) + len(self.schedules) if self.events is not None else 0)
+
+    # Returns the location with the name, or None
+    def location(self, location_name):
+        if self.locations_by_name is None:
+            return self.locations.find(location_name)
+        return self.locations_by_name.get(location_name)
+
+
+class DatabaseSnapshot(object):
+    """In-memory copy of the Response table and of the location names, with the
+    locations and events split in one MapPartition per map. A partition is
+    loaded on first use and the least recently used ones are evicted when
+    the partitions hold more than partition_budget records, so switching
+    between maps already in use does not touch the database.
+    The records never change after creation, derived indexes are built on first use."""
+
+    max_rendered = 1024 # Rendered response buckets kept before the memo is cleared
+    partition_budget = 200000 # Locations and events kept in memory over all maps, the most recently used map is always kept
+
+    def __init__(self, location_maps, responses, load_locations, load_events, load_schedules, load_all_locations):
+        self.location_maps = location_maps # location_name -> robot_map_name, a dict or a LocationColumns
+        self.load_locations = load_locations # robot_map_name -> [LocationRecord] or LocationSequence
+        self.load_all_locations = load_all_locations # () -> every location, [LocationRecord] or LocationSequence
+        self.all_location_records = None # Every location, loaded on first use, see all_locations()
+        self.load_events = load_events # robot_map_name -> [EventRecord] that are not ignored
+        self.load_schedules = load_schedules # robot_map_name -> [ScheduleRecord] that are not ignored
+        self.responses = responses
+        self.responses_by_key = {} # (response_type, emotion) -> [ResponseRecord]
+        self.templates_by_key = {} # (response_type, emotion) -> [ResponseTemplate], same order as responses_by_key
+        for response in responses:
+            self.responses_by_key.setdefault((response.response_type, response.emotion), []).append(response)
+            self.templates_by_key.setdefault((response.response_type, response.emotion), []).append(ResponseTemplate(response.message or ""))
+        self.rendered = {} # (response_type, emotion, values) -> [str], see rendered_responses()
+        self.partitions = collections.OrderedDict() # robot_map_name -> MapPartition, least recently used first
+        self.lock = threading.Lock() # Guards partitions
+        self.load_lock = threading.Lock() # One partition is loaded at a time
+        self.evicted = 0 # Partitions evicted from this snapshot
+
+    def map_names(self):
+        return sorted(set(self.location_maps.values()))
+
+    # Returns the MapPartition of the map, loading it on first use
+    def partition(self, robot_map_name):
+        with self.lock:
+            partition = self.partitions.pop(robot_map_name, None)
+            if partition is not None:
+                self.partitions[robot_map_name] = partition # Most recently used
+                return partition
+        with self.load_lock:
+            with self.lock:
+                partition = self.partitions.get(robot_map_name)
+            if partition is None: # Not loaded by an other thread while waiting for the lock
+                partition = MapPartition(robot_map_name, self.load_locations(robot_map_name))
+                with self.lock:
+                    self.partitions[robot_map_name] = partition
+                self.evict()
+        return partition
+
+    # Evicts the least recently used partitions until the rest fits in partition_budget
+    def evict(self):
+        with self.lock:
+            size = sum(partition.size() for partition in self.partitions.values())
+            while size > self.partition_budget and len(self.partitions) > 1:
+                robot_map_name, partition = self.partitions.popitem(last=False)
+                size -= partition.size()
+                self.evicted += 1
+
+    # Returns every location of every map, loaded on first use
+    def all_locations(self):
+        if self.all_location_records is None:
+            with self.load_lock:
+                if self.all_location_records is None:
+                    self.all_location_records = self.load_all_locations()
+        return self.all_location_records
+
+    # Returns the LocationRecord with the name, or None
+    def location(self, location_name):
+        robot_map_name = self.location_maps.get(location_name)
+        if robot_map_name is None:
+            return None
+        return self.partition(robot_map_name).location(location_name)
+
+    def spatial_index(self, robot_map_name):
+        partition = self.partition(robot_map_name)
+        if partition.spatial is None:
+            partition.spatial = SpatialIndex(partition.locations)
+        return partition.spatial
+
+    def distance_matrix(self, robot_map_name):
+        partition = self.partition(robot_map_name)
+        if partition.distances is None:
+            partition.distances = DistanceMatrix(partition.locations)
+        return partition.distances
+
+    # Returns every response of the bucket rendered with the values, memoized for this snapshot
+    def rendered_responses(self, response_type, emotion, values):
+        key = (response_type, emotion, tuple(sorted(values.items())))
+        rendered = self.rendered.get(key)
+        if rendered is None:
+            if len(self.rendered) >= self.max_rendered:
+                self.rendered = {}
+            rendered = [template.render(values) for template in self.templates_by_key.get((response_type, emotion), [])]
+            self.rendered[key] = rendered
+        return rendered
+
+    def event_index(self, robot_map_name):
+        partition = self.partition(robot_map_name)
+        if partition.intervals is None:
+            if partition.events is None:
+                with self.load_lock:
+                    if partition.events is None:
+                        partition.schedules = self.load_schedules(robot_map_name)
+                        partition.events = self.load_events(robot_map_name)
+                self.evict()
+            intervals = []
+            for event in partition.events:
+                start_date = parse_date(event.start_date)
+                end_date = parse_date(event.end_date)
+                if start_date is not None and end_date is not None:
+                    intervals.append((start_date, end_date, event))
+            partition.intervals = EventIndex(IntervalIndex(intervals), ScheduleIndex(partition.schedules, schedule_occurrence))
+        return partition.intervals
+
+    # Loads the partitions and builds the indexes that were in use in the previous snapshot, so the first query after a reload does not pay for them
+    def warm(self, previous):
+        with previous.lock:
+            partitions = list(previous.partitions.values())
+        map_names = set(self.location_maps.values())
+        for partition in partitions: # Least recently used first, so the order is kept
+            if partition.robot_map_name not in map_names: # Its last location was removed
+                continue
+            self.partition(partition.robot_map_name)
+            if partition.spatial is not None:
+                self.spatial_index(partition.robot_map_name)
+            if partition.distances is not None:
+                self.distance_matrix(partition.robot_map_name)
+            if partition.intervals is not None:
+                self.event_index(partition.robot_map_name)
+        if previous.all_location_records is not None:
+            self.all_locations()
+
+
 class DatabaseHandler(object):
-    """DatabaseHandler"""
+    """DatabaseHandler
+
+    Keeps one long-lived connection per thread (WAL journal, cached prepared
+    statements). Call close() when the handler is no longer needed.
 
-    def __init__(self, filename):
+    Locations, events and responses are served from a DatabaseSnapshot. The snapshot is
+    reloaded when PRAGMA data_version reports a commit from any other
+    connection, including writes made by other processes, that changed the
+    revision (see SCHEMA_MIGRATIONS) of a table the snapshot is made from.
+    Commits that only append to Travel leave the snapshot as it is. The
+    locations and events of a map are only read when a query first asks for
+    that map.
+
+    With a location_file the locations are served from a LocationColumns
+    memory-mapped from that file instead, and the file is rewritten when the
+    Location table has changed since it was made. Processes given the same
+    file share one copy of the locations."""
+
+    connection_timeout = 5.0 # (s) How long a statement waits on a locked database
+    cached_statements = 64 # Prepared statements kept per connection
+    cache_check_interval = 0.5 # (s) How often the snapshot is checked against the database
+
+    def __init__(self, filename, metrics=None, location_file=""):
         self.dbfilename = filename
+        self.location_file = location_file # LocationColumns file, "" to read the locations into the snapshot
+        self.location_columns = None # LocationColumns of location_file, only used while holding cache_lock
+        self.metrics = metrics # navigationmetrics.Metrics, or None to not time the queries
+        self.local = threading.local()
+        self.connections = [] # (thread, connection) for every connection opened by this handler
+        self.connections_lock = threading.Lock()
+        self.is_closed = False
+        self.cache_lock = threading.Lock()
+        self.cache_connection = None # Only used while holding cache_lock
+        self.snapshot = None
+        self.snapshot_version = None
+        self.snapshot_revisions = None # REVISION_TABLES revisions the snapshot was read at, None before migrate() (any commit reloads it then)
+        self.snapshot_checked = 0.0
+        self.change_listeners = []
+        self.background_refresh = None # Called instead of checking the snapshot on the calling thread, see DatabaseExecutor
+        self.location_matcher = LocationMatcher() # Kept in step with the snapshot's location names
 
-    def create(self):
+    # Returns the connection owned by the calling thread, opening it on first use
+    def connect(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            return connection
+        with self.connections_lock:
+            if self.is_closed:
+                raise sqlite3.ProgrammingError("DatabaseHandler: Connection manager is closed...")
+            self.prune_connections()
+            connection = sqlite3.connect(self.dbfilename, timeout=self.connection_timeout, cached_statements=self.cached_statements, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL") # Readers do not block the writer (e.g. an admin tool) and vice versa
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.connections.append((threading.current_thread(), connection))
+            self.local.connection = connection
+        return connection
+
+    # Closes connections owned by threads that have terminated (called with connections_lock held)
+    def prune_connections(self):
+        alive = []
+        for thread, connection in self.connections:
+            if thread.is_alive():
+                alive.append((thread, connection))
+            else:
+                connection.close()
+        self.connections = alive
+
+    # Closes every connection. The handler can not be used afterwards
+    def close(self):
+        with self.connections_lock:
+            self.is_closed = True
+            for thread, connection in self.connections:
+                try:
+                    connection.close()
+                except sqlite3.ProgrammingError:
+                    pass # Connection is in use by its owner thread during interpreter shutdown
+            self.connections = []
+        with self.cache_lock:
+            if self.cache_connection is not None:
+                self.cache_connection.close()
+                self.cache_connection = None
+            self.snapshot = None
+        self.local = threading.local()
+
+    # Returns the current DatabaseSnapshot, reloading it if the database has changed since it was read
+    # With a background_refresh the check runs elsewhere and the current snapshot is returned at once
+    def get_snapshot(self):
+        snapshot = self.snapshot
+        if snapshot is not None and time.time() - self.snapshot_checked < self.cache_check_interval:
+            return snapshot
+        background_refresh = self.background_refresh
+        if snapshot is not None and background_refresh is not None:
+            self.snapshot_checked = time.time() # One refresh per interval
+            background_refresh()
+            return snapshot
+        return self.check_snapshot()
+
+    # Reloads the snapshot if the database has changed since it was read, and returns it
+    def check_snapshot(self):
+        changed = False
+        with self.cache_lock:
+            if self.is_closed:
+                raise sqlite3.ProgrammingError("DatabaseHandler: Connection manager is closed...")
+            if self.snapshot is not None and time.time() - self.snapshot_checked < self.cache_check_interval and self.background_refresh is None:
+                return self.snapshot # Checked by an other thread while waiting for the lock
+            if self.cache_connection is None:
+                self.cache_connection = sqlite3.connect(self.dbfilename, timeout=self.connection_timeout, check_same_thread=False)
+            # data_version changes whenever an other connection commits, so it is read before the tables
+            version = self.cache_connection.execute("PRAGMA data_version").fetchone()[0]
+            revisions = None
+            if self.snapshot is not None and version != self.snapshot_version:
+                revisions = self.read_revisions(self.cache_connection)
+                changed = revisions is None or revisions != self.snapshot_revisions
+                self.snapshot_version = version # Only e.g. Travel changed when the revisions are the same
+            if self.snapshot is None or changed:
+                if revisions is None:
+                    revisions = self.read_revisions(self.cache_connection) # Read before the tables, as data_version
+                snapshot = self.load_snapshot(self.cache_connection)
+                if self.background_refresh is not None and self.snapshot is not None:
+                    snapshot.warm(self.snapshot)
+                self.snapshot = snapshot
+                self.snapshot_version = version
+                self.snapshot_revisions = revisions
+                self.location_matcher.update(self.snapshot.location_maps.keys())
+            self.snapshot_checked = time.time()
+            snapshot = self.snapshot
+        if changed:
+            self.notify_change_listeners()
+        return snapshot
+
+    # The revisions of the REVISION_TABLES as a tuple, or None if the database has no revisions of them yet (see migrate())
+    def read_revisions(self, connection):
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            cursor = connection.cursor()
-            connection.execute("CREATE TABLE Location(location_name TEXT PRIMARY KEY NOT NULL, robot_map_name TEXT, x REAL, y REAL, z REAL, p REAL, j REAL, r REAL, threshold REAL, crowded BOOLEAN, enviorment REAL)")
-            connection.commit()
-            cursor.close()
+            revisions = dict(connection.execute(SQL_GET_REVISIONS).fetchall())
         except sqlite3.OperationalError:
-            print("DatabaseHandler: Location table allready exist...")
+            return None
+        if any(table not in revisions for table in REVISION_TABLES):
+            return None
+        return tuple(revisions[table] for table in REVISION_TABLES)
 
+    @timed(QUERY_SECONDS)
+    def load_snapshot(self, connection):
+        location_columns = self.load_location_columns(connection) if self.location_file != "" else None
+        cursor = connection.cursor()
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            cursor = connection.cursor()
-            connection.execute("CREATE TABLE Event(event_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, event_name TEXT, location_name TEXT, start_date DATETIME, end_date DATETIME, ignore BOOLEAN, FOREIGN KEY(location_name) REFERENCES Location(location_name))")
-            connection.commit()
+            if location_columns is None:
+                location_maps = dict(cursor.execute(SQL_GET_LOCATION_MAPS).fetchall())
+            cursor.row_factory = self.namedtuple_factory_response_record
+            responses = cursor.execute(SQL_GET_ALL_RESPONSES).fetchall()
+        finally:
             cursor.close()
-        except sqlite3.OperationalError:
-            print("DatabaseHandler: Event table allready exist...")
+        if location_columns is not None:
+            return DatabaseSnapshot(location_maps=location_columns, responses=responses, load_locations=location_columns.map_locations, load_events=self.load_map_events, load_schedules=self.load_map_schedules, load_all_locations=location_columns.all_locations)
+        return DatabaseSnapshot(location_maps=location_maps, responses=responses, load_locations=self.load_map_locations, load_events=self.load_map_events, load_schedules=self.load_map_schedules, load_all_locations=self.load_all_locations)
 
+    # Returns the LocationColumns of location_file, rewriting the file first if it is missing or older than the Location table
+    # Returns None if the database has no Location revision yet (see migrate())
+    def load_location_columns(self, connection):
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            cursor = connection.cursor()
-            connection.execute("CREATE TABLE Response(response_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, message TEXT, response_type TEXT, emotion TEXT)")
-            connection.commit()
+            revision = connection.execute(SQL_GET_LOCATION_REVISION).fetchone()[0]
+        except (sqlite3.OperationalError, TypeError):
+            print("DatabaseHandler: Unable to load_location_columns(), the database has no Location revision...")
+            return None
+        location_columns = self.location_columns
+        if location_columns is None or location_columns.revision != revision:
+            try:
+                location_columns = LocationColumns.open(self.location_file)
+            except (IOError, OSError, ValueError, KeyError):
+                location_columns = None
+        if location_columns is None or location_columns.revision != revision:
+            location_columns = self.read_location_columns(connection, revision) # The revision is read first, a write in between only makes the file look older
+            try:
+                location_columns.write(self.location_file)
+                location_columns = LocationColumns.open(self.location_file)
+            except (IOError, OSError) as e:
+                print("DatabaseHandler: Unable to write " + self.location_file + " - " + str(e) + "...") # The columns are kept in memory instead
+        self.location_columns = location_columns
+        return location_columns
+
+    # Reads every location into a LocationColumns
+    def read_location_columns(self, connection, revision=None):
+        cursor = connection.cursor()
+        try:
+            cursor.row_factory = self.namedtuple_factory_location_record
+            return LocationColumns.from_records(cursor.execute(SQL_GET_ALL_LOCATIONS).fetchall(), revision)
+        finally:
             cursor.close()
-        except sqlite3.OperationalError:
-            print("DatabaseHandler: Response table allready exist...")
+
+    # Writes every location to a LocationColumns file at path, returns the number of locations
+    def write_location_columns(self, path):
+        connection = self.connect()
+        revision = connection.execute(SQL_GET_LOCATION_REVISION).fetchone()[0]
+        location_columns = self.read_location_columns(connection, revision)
+        location_columns.write(path)
+        return len(location_columns)
+
+    # Reads the locations of one map for a DatabaseSnapshot partition
+    @timed(QUERY_SECONDS)
+    def load_map_locations(self, robot_map_name):
+        return self.query(SQL_GET_MAP_LOCATIONS, (robot_map_name, ), row_factory=self.namedtuple_factory_location_record)
+
+    # Reads every location for DatabaseSnapshot.all_locations()
+    @timed(QUERY_SECONDS)
+    def load_all_locations(self):
+        return self.query(SQL_GET_ALL_LOCATIONS, row_factory=self.namedtuple_factory_location_record)
+
+    # Reads the events of one map that are not ignored for a DatabaseSnapshot partition
+    @timed(QUERY_SECONDS)
+    def load_map_events(self, robot_map_name):
+        return self.query(SQL_GET_MAP_EVENTS, (robot_map_name, ), row_factory=self.namedtuple_factory_event_record)
+
+    # Reads the schedules of one map that are not ignored for a DatabaseSnapshot partition
+    @timed(QUERY_SECONDS)
+    def load_map_schedules(self, robot_map_name):
+        return self.query(SQL_GET_MAP_SCHEDULES, (robot_map_name, ), row_factory=self.namedtuple_factory_schedule_record)
+
+    # Forces the next get_snapshot() to check the database (the write is seen as a change by the cache connection)
+    def invalidate_cache(self):
+        self.snapshot_checked = 0.0
+        self.notify_change_listeners()
+
+    # The listener is called without arguments after a write through this handler or when a change made elsewhere is detected
+    def add_change_listener(self, listener):
+        self.change_listeners.append(listener)
+
+    def notify_change_listeners(self):
+        for listener in list(self.change_listeners):
+            listener()
+
+    # Runs a read query on the calling thread's connection and returns all rows
+    def query(self, sql, parameters=(), row_factory=None):
+        cursor = self.connect().cursor()
+        try:
+            if row_factory is not None:
+                cursor.row_factory = row_factory
+            cursor.execute(sql, parameters)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    # Runs an insert in its own transaction and returns the new rowid
+    def insert(self, sql, parameters):
+        connection = self.connect()
+        with connection:
+            cursor = connection.execute(sql, parameters)
+            rowid = cursor.lastrowid
+            cursor.close()
+        self.invalidate_cache()
+        return rowid
+
+    # Converts a value read from a JSON or CSV file to the type stored in the column, raises ValueError if it can not
+    def import_value(self, column, value):
+        if value is None or value == "":
+            return COLUMN_DEFAULTS.get(column)
+        if column in REAL_COLUMNS:
+            return float(value)
+        if column in BOOLEAN_COLUMNS:
+            if isinstance(value, (bool, int, float)):
+                return bool(value)
+            if str(value).strip().lower() in ("1", "true", "yes"):
+                return True
+            if str(value).strip().lower() in ("0", "false", "no"):
+                return False
+            raise ValueError("Invalid boolean for " + column + ": " + repr(value))
+        if column in DATE_COLUMNS:
+            date = parse_date(value)
+            if date is None:
+                raise ValueError("Invalid date for " + column + ": " + repr(value))
+            return date
+        return value
+
+    # Inserts the records (dictionaries keyed by column name) into the table in one transaction with executemany.
+    # Records are consumed lazily, so a generator reading a large file is never held in memory.
+    # With upsert a record replaces the row with the same key, with dry_run everything is rolled back.
+    # Event and Response records without an id get a new one. Returns the number of records, or None on failure.
+    # With commit=False the transaction is left open, so the next import_records() call adds to it (several tables seeded in one transaction).
+    def import_records(self, table, records, upsert=False, dry_run=False, batch_size=1000, commit=True):
+        columns = TABLE_COLUMNS[table]
+        statements = {} # Columns present -> SQL
+        connection = self.connect()
+        count = 0
+        try:
+            batch = []
+            batch_sql = None
+            for record in records:
+                has_key = table == "Location" or record.get(columns[0]) not in (None, "")
+                row_columns = columns if has_key else columns[1:]
+                sql = statements.get(has_key)
+                if sql is None:
+                    sql = ("INSERT OR REPLACE" if upsert else "INSERT") + " INTO " + table + " (" + ", ".join(row_columns) + ") VALUES (" + ",".join(["?"] * len(row_columns)) + ")"
+                    statements[has_key] = sql
+                if (sql != batch_sql or len(batch) >= batch_size) and len(batch) > 0:
+                    connection.executemany(batch_sql, batch)
+                    batch = []
+                batch_sql = sql
+                batch.append(tuple([self.import_value(column, record.get(column)) for column in row_columns]))
+                count += 1
+            if len(batch) > 0:
+                connection.executemany(batch_sql, batch)
+            if dry_run:
+                connection.rollback()
+            elif commit:
+                connection.commit()
+                self.invalidate_cache()
+            return count
+        except ValueError as e:
+            connection.rollback()
+            print("DatabaseHandler: Unable to import_records(), record " + str(count + 1) + " - " + str(e) + "...")
+        except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
+            connection.rollback()
+            print("DatabaseHandler: Unable to import_records() - " + str(e) + "...")
+
+    # Yields every row of the table as a dictionary keyed by column name, streamed from the database
+    def export_records(self, table):
+        columns = TABLE_COLUMNS[table]
+        cursor = self.connect().cursor()
+        try:
+            cursor.execute("SELECT " + ", ".join(columns) + " from " + table)
+            for row in cursor:
+                yield collections.OrderedDict(zip(columns, row))
+        finally:
+            cursor.close()
+
+    # Creates the tables of a new database, or upgrades an existing one to the current schema
+    def create(self):
+        self.migrate()
+
+    # Applies the SCHEMA_MIGRATIONS the database has not had yet, each in one transaction with its new version. Returns the schema version
+    def migrate(self):
+        connection = self.connect()
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            print("DatabaseHandler: Database schema version " + str(version) + " is newer than " + str(SCHEMA_VERSION) + "...")
+            return version
+        for number in range(version, SCHEMA_VERSION):
+            try: # The sqlite3 module does not put CREATE statements in a transaction, so it is begun explicitly
+                connection.executescript("BEGIN;\n" + ";\n".join(SCHEMA_MIGRATIONS[number] + ["PRAGMA user_version = " + str(number + 1)]) + ";\nCOMMIT;")
+            except sqlite3.OperationalError as e:
+                try:
+                    connection.execute("ROLLBACK")
+                except sqlite3.OperationalError:
+                    pass # The failed statement ended the transaction
+                print("DatabaseHandler: Unable to migrate() to schema version " + str(number + 1) + " - " + str(e) + "...")
+                return number
+        if version < SCHEMA_VERSION:
+            self.invalidate_cache()
+        return SCHEMA_VERSION
+
+    # Runs EXPLAIN QUERY PLAN on every query in QUERY_PLANS, returns (name, detail) of each step that scans a table without an index
+    # Full reads are left out, they read every row on purpose
+    def check_query_plans(self):
+        scans = []
+        for name, sql, parameters, full_read in QUERY_PLANS:
+            if full_read:
+                continue
+            try:
+                plan = self.query("EXPLAIN QUERY PLAN " + sql, parameters)
+            except sqlite3.OperationalError as e: # E.g. a table that is missing before migrate()
+                scans.append((name, str(e)))
+                continue
+            for row in plan:
+                detail = row[-1]
+                if detail.startswith("SCAN") and " USING " not in detail: # "SCAN Location" (older SQLite: "SCAN TABLE Location") reads every row
+                    scans.append((name, detail))
+        return scans
 
     def namedtuple_factory_location_record(self, cursor, row):
         return LocationRecord(*row)
@@ -59,161 +659,240 @@ class DatabaseHandler(object):
     def namedtuple_factory_event_record(self, cursor, row):
         return EventRecord(*row)
 
+    def namedtuple_factory_schedule_record(self, cursor, row):
+        return ScheduleRecord(*row)
+
     def namedtuple_factory_response_record(self, cursor, row):
         return ResponseRecord(*row)
 
 
+    @timed(QUERY_SECONDS)
     def add_response(self, message, response_type, emotion):
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            cursor = connection.cursor()
-            cursor.execute("INSERT INTO Response (message, response_type, emotion) VALUES (?,?,?)", (message, response_type, emotion))
-            cursor.execute("SELECT last_insert_rowid();")
-            id = cursor.fetchall()
-            connection.commit()
-            cursor.close()
-            return id[0][0]
+            return self.insert(SQL_ADD_RESPONSE, (message, response_type, emotion))
         except sqlite3.OperationalError:
             print("DatabaseHandler: Unable to add_response()...")
 
 
+    @timed(QUERY_SECONDS)
     def search_for_response(self, response_type, emotion):
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            connection.row_factory = self.namedtuple_factory_response_record
-            cursor = connection.cursor()
-            cursor.execute('SELECT * from Response WHERE response_type=? AND emotion=?', (response_type, emotion ))
-            records = cursor.fetchall()
-            cursor.close()
-            if len(records) == 0: 
-                return None
-            elif len(records) == 1: 
-                return records[0]
-            else: 
-                n = random.randrange(start=0, stop=(len(records)-1))
-                return records[n]
+            records = self.get_snapshot().responses_by_key.get((response_type, emotion), [])
+            return random.choice(records) if len(records) > 0 else None
         except sqlite3.OperationalError:
             print("DatabaseHandler: Unable to search_for_response()...")
 
 
+    # Returns every response message of the type and emotion with placeholders (e.g. LOCATION) replaced by the values
+    @timed(QUERY_SECONDS)
+    def render_responses(self, response_type, emotion, values):
+        try:
+            return self.get_snapshot().rendered_responses(response_type, emotion, values)
+        except sqlite3.OperationalError:
+            print("DatabaseHandler: Unable to render_responses()...")
+
+
+    # Returns a random rendered response message of the type and emotion, or None
+    @timed(QUERY_SECONDS)
+    def render_response(self, response_type, emotion, values):
+        rendered = self.render_responses(response_type, emotion, values)
+        return random.choice(rendered) if rendered else None
+
+
+    # Returns a random response rendered from the snapshot in memory, without checking the database or waiting for a reload, or None
+    # when there is no snapshot yet or no response of the type and emotion. The snapshot memoizes the rendering, see render_responses()
+    def cached_response(self, response_type, emotion, values):
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        rendered = snapshot.rendered_responses(response_type, emotion, values)
+        return random.choice(rendered) if rendered else None
+
+
+    @timed(QUERY_SECONDS)
     def search_for_location(self, location_name):
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            connection.row_factory = self.namedtuple_factory_location_record
-            cursor = connection.cursor()
-            cursor.execute('SELECT * from Location WHERE location_name=?', (location_name, ))
-            records = cursor.fetchall()
-            cursor.close()
-            return records[0] if len(records) > 0 else None
+            return self.get_snapshot().location(location_name)
         except sqlite3.OperationalError:
             print("DatabaseHandler: Unable to search_for_location()...")
 
 
+    # Returns every location of every map from the snapshot, read once per change of the Location table (LocationViews with a location_file)
+    # The list is shared, it must not be changed
+    @timed(QUERY_SECONDS)
     def get_all_locations(self):
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            connection.row_factory = self.namedtuple_factory_location_record
-            cursor = connection.cursor()
-            cursor.execute('SELECT * from Location', ( ))
-            records = cursor.fetchall()
-            cursor.close()
-            return records
+            return self.get_snapshot().all_locations()
         except sqlite3.OperationalError:
             print("DatabaseHandler: Unable to get_all_locations()...")
 
 
+    # Returns the locations mentioned in the text (longest name wins, no overlaps) in order of appearance
+    @timed(QUERY_SECONDS)
+    def find_location_mentions(self, text):
+        try:
+            snapshot = self.get_snapshot()
+            locations = [snapshot.location(name) for name in self.location_matcher.find(text)]
+            return [location for location in locations if location is not None]
+        except sqlite3.OperationalError:
+            print("DatabaseHandler: Unable to find_location_mentions()...")
+
+
+    @timed(QUERY_SECONDS)
     def add_location(self, location_name, robot_map_name="ntnu.map", x=0, y=0, z=0, p=0, j=0, r=0, threshold=0.00, crowded=False, enviorment=0.00):
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            cursor = connection.cursor()
-            cursor.execute("INSERT INTO Location (location_name, robot_map_name, x, y, z, p, j, r, threshold, crowded, enviorment) VALUES (?,?,?,?,?,?,?,?,?,?,?)", (location_name, robot_map_name, x, y, z, p, j, r, threshold, crowded, enviorment))
-            cursor.execute("SELECT last_insert_rowid();")
-            id = cursor.fetchall()
-            connection.commit()
-            cursor.close()
-            return id[0][0]
+            return self.insert(SQL_ADD_LOCATION, (location_name, robot_map_name, x, y, z, p, j, r, threshold, crowded, enviorment))
         except sqlite3.OperationalError:
             print("DatabaseHandler: Unable to add_location()...")
 
-        
-    def add_event(self, event_name, location_name, start_date=datetime.datetime.now(), end_date=datetime.datetime.now(), ignore=False):
+
+    @timed(QUERY_SECONDS)
+    def add_event(self, event_name, location_name, start_date=None, end_date=None, ignore=False):
+        now = datetime.datetime.now() # Not a default argument, that would be the time the module was imported
+        start_date = start_date if start_date is not None else now
+        end_date = end_date if end_date is not None else now
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            cursor = connection.cursor()
-            cursor.execute("INSERT INTO Event (event_name, location_name, start_date, end_date, ignore) VALUES (?,?,?,?,?)", (event_name, location_name, start_date, end_date, ignore))
-            cursor.execute("SELECT last_insert_rowid();")
-            id = cursor.fetchall()
-            connection.commit()
-            cursor.close()
-            return id[0][0]
+            return self.insert(SQL_ADD_EVENT, (event_name, location_name, start_date, end_date, ignore))
         except sqlite3.OperationalError:
             print("DatabaseHandler: Unable to add_event()...")
 
 
-    def search_ongoing_events(self, robot_map_name, current_date=datetime.datetime.now()):
+    # Adds a recurring event: an occurrence lasting duration (s) begins at every start of the rule (cron format, see CronRule)
+    # between first_date and last_date (None for no limit), except on the dates in exceptions ("2017-12-24,2017-12-31")
+    @timed(QUERY_SECONDS)
+    def add_schedule(self, event_name, location_name, rule, duration, first_date=None, last_date=None, exceptions="", ignore=False):
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            connection.row_factory = self.namedtuple_factory_event_record
-            cursor = connection.cursor()
-            cursor.execute('SELECT * from Event natural join Location WHERE Event.start_date<? and Event.end_date>? and Location.robot_map_name=? and Event.ignore=? ORDER BY Event.start_date DESC', (current_date, current_date, robot_map_name, False))
-            records = cursor.fetchall()
-            cursor.close()
-            if len(records) == 0: 
-                return None
-            else:
-                return records[0]
+            return self.insert(SQL_ADD_SCHEDULE, (event_name, location_name, rule, duration, first_date, last_date, exceptions, ignore))
+        except sqlite3.OperationalError:
+            print("DatabaseHandler: Unable to add_schedule()...")
+
+
+    # Returns the ongoing event (one-off or an occurrence of a schedule) on the map that started last, or None
+    @timed(QUERY_SECONDS)
+    def search_ongoing_events(self, robot_map_name, current_date=None):
+        current_date = current_date if current_date is not None else datetime.datetime.now()
+        try:
+            ongoing = self.get_snapshot().event_index(robot_map_name).latest_active(current_date)
+            return ongoing[2] if ongoing is not None else None
         except sqlite3.OperationalError:
             print("DatabaseHandler: Unable to search_ongoing_events()...")
 
 
+    # Returns every event on the map that is ongoing at current_date
+    @timed(QUERY_SECONDS)
+    def search_all_ongoing_events(self, robot_map_name, current_date):
+        try:
+            return [interval[2] for interval in self.get_snapshot().event_index(robot_map_name).active(current_date)]
+        except sqlite3.OperationalError:
+            print("DatabaseHandler: Unable to search_all_ongoing_events()...")
+
+
+    # Returns the first time after current_date when an event on the map starts or ends, or None
+    @timed(QUERY_SECONDS)
+    def next_event_boundary(self, robot_map_name, current_date):
+        try:
+            return self.get_snapshot().event_index(robot_map_name).next_boundary(current_date)
+        except sqlite3.OperationalError:
+            print("DatabaseHandler: Unable to next_event_boundary()...")
+
+
+    @timed(QUERY_SECONDS)
     def search_for_crowded_locations(self, robot_map_name, crowded=True):
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            connection.row_factory = self.namedtuple_factory_location_record
-            cursor = connection.cursor()
-            cursor.execute('SELECT * from Location WHERE robot_map_name=? AND crowded=?', (robot_map_name, crowded))
-            records = cursor.fetchall()
-            cursor.close()
-            if len(records) == 0: 
-                return None
-            elif len(records) == 1: 
-                return records[0]
-            else: 
-                n = random.randrange(start=0, stop=(len(records)-1))
-                return records[n]
+            records = self.get_snapshot().partition(robot_map_name).locations_by_crowded.get(bool(crowded), [])
+            return random.choice(records) if len(records) > 0 else None
         except sqlite3.OperationalError:
             print("DatabaseHandler: Unable to search_for_crowded_locations()...")
 
 
+    @timed(QUERY_SECONDS)
     def location_is_crowded(self, robot_map_name, location_name):
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            cursor = connection.cursor()
-            cursor.execute('SELECT * from Location WHERE robot_map_name=? AND crowded=? AND location_name=?', (robot_map_name, True, location_name))
-            records = cursor.fetchall()
-            cursor.close()
-            return True if len(records) > 0 else False
+            location = self.get_snapshot().location(location_name)
+            return location is not None and location.robot_map_name == robot_map_name and bool(location.crowded)
         except sqlite3.OperationalError:
             print("DatabaseHandler: Unable to location_is_crowded()...")
 
 
+    # Returns up to count locations on the map closest to the position, closest first. crowded (True/False) filters, exclude is a list of location names
+    @timed(QUERY_SECONDS)
+    def search_for_nearest_locations(self, robot_map_name, location_x, location_y, crowded=None, count=1, exclude=()):
+        try:
+            distances = self.get_snapshot().distance_matrix(robot_map_name)
+            return [distances.locations[i] for i in distances.nearest(location_x, location_y, count=count, crowded=crowded, exclude=exclude)]
+        except sqlite3.OperationalError:
+            print("DatabaseHandler: Unable to search_for_nearest_locations()...")
+
+
+    # Returns count of the locations closest to the position (filtered like search_for_nearest_locations()) in the order of a short tour starting at the position
+    # With travel_times (TravelTimes) the tour is the fastest by the recorded moves from from_location instead of the shortest, and of the
+    # 2 * count closest locations the count expected to be fastest to reach are visited
+    @timed(QUERY_SECONDS)
+    def plan_tour(self, robot_map_name, location_x, location_y, crowded=None, count=5, exclude=(), travel_times=None, from_location=None):
+        try:
+            distances = self.get_snapshot().distance_matrix(robot_map_name)
+            if travel_times is None:
+                stops = distances.nearest(location_x, location_y, count=count, crowded=crowded, exclude=exclude)
+                return [distances.locations[i] for i in distances.tour(location_x, location_y, stops)]
+            def cost(i, j, distance): # i is None for the start position
+                return travel_times.expected(from_location if i is None else distances.locations[i].location_name, distances.locations[j].location_name, distance)
+            stops = distances.nearest(location_x, location_y, count=2 * count, crowded=crowded, exclude=exclude)
+            start = distances.distances_from(location_x, location_y)
+            stops = sorted(stops, key=lambda j: cost(None, j, start[j]))[:count]
+            return [distances.locations[i] for i in distances.tour(location_x, location_y, stops, cost=cost)]
+        except sqlite3.OperationalError:
+            print("DatabaseHandler: Unable to plan_tour()...")
+
+
+    # Returns the closest location on the map whose threshold contains the position, or None
+    @timed(QUERY_SECONDS)
     def find_location(self, robot_map_name, location_x, location_y):
         try:
-            connection = sqlite3.connect(self.dbfilename)
-            connection.row_factory = self.namedtuple_factory_location_record
-            cursor = connection.cursor()
-            cursor.execute('SELECT * from Location WHERE robot_map_name=?', (robot_map_name, ))
-            records = cursor.fetchall()
-            cursor.close()
-            if len(records) == 0: 
-                return None
-            else:
-                best = None
-                for record in records:
-                    distance = math.sqrt((location_x - record.x)**2 + (location_y - record.y)**2) 
-                    if distance < record.threshold:
-                        best = record
-                return best
+            return self.get_snapshot().spatial_index(robot_map_name).within_threshold(location_x, location_y)
         except sqlite3.OperationalError:
             print("DatabaseHandler: Unable to find_location()...")
 
+
+    # Same as find_location() for many positions at once, returns a list with a location or None per position
+    @timed(QUERY_SECONDS)
+    def find_locations(self, robot_map_name, locations_x, locations_y):
+        try:
+            return self.get_snapshot().spatial_index(robot_map_name).batch_within_threshold(locations_x, locations_y)
+        except sqlite3.OperationalError:
+            print("DatabaseHandler: Unable to find_locations()...")
+
+
+    # Yields every succeeded move in the Travel table as (from_location, to_location, duration), oldest first
+    def get_travel_times(self):
+        cursor = self.connect().cursor()
+        try:
+            for from_location, to_location, duration in cursor.execute(SQL_GET_TRAVEL_TIMES):
+                if duration is not None:
+                    yield from_location, to_location, duration
+        except sqlite3.OperationalError:
+            print("DatabaseHandler: Unable to get_travel_times()...")
+        finally:
+            cursor.close()
+
+
+    # Returns the names of every map that has a location
+    @timed(QUERY_SECONDS)
+    def get_map_names(self):
+        try:
+            return self.get_snapshot().map_names()
+        except sqlite3.OperationalError:
+            print("DatabaseHandler: Unable to get_map_names()...")
+
+
+    # Loads the locations and events of the map and builds its indexes, so switching to it later is done in memory
+    # Returns False if the map could not be read or has no locations
+    @timed(QUERY_SECONDS)
+    def load_map(self, robot_map_name):
+        try:
+            snapshot = self.get_snapshot()
+            spatial_index = snapshot.spatial_index(robot_map_name)
+            snapshot.event_index(robot_map_name)
+            return len(spatial_index) > 0
+        except sqlite3.OperationalError:
+            print("DatabaseHandler: Unable to load_map()...")
+            return False
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import numpy
+from locationcolumns import LocationSequence, location_column
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+
+class DistanceMatrix(object):
+    """DistanceMatrix
+
+    Straight line distances between the locations of one map. Up to
+    max_matrix_locations the whole N x N matrix is computed once with NumPy,
+    larger maps compute the rows they need, so memory stays linear. Used to
+    find the nearest suitable locations and to order a multi-stop tour
+    through them (nearest neighbour, then 2-opt)."""
+
+    max_matrix_locations = 2048 # Above this the matrix (4 bytes per pair) is not kept
+    max_improvement_passes = 50 # 2-opt passes over the tour at most
+
+    def __init__(self, locations):
+        self.locations = locations if isinstance(locations, LocationSequence) else list(locations) # A LocationSequence is read column by column
+        self.index = None # location_name -> index, only made for a list of records
+        if not isinstance(self.locations, LocationSequence):
+            self.index = dict((location.location_name, i) for i, location in enumerate(self.locations))
+        self.x = location_column(self.locations, "x")
+        self.y = location_column(self.locations, "y")
+        self.crowded = location_column(self.locations, "crowded", dtype=bool)
+        self.matrix = None
+        if len(self.locations) <= self.max_matrix_locations:
+            self.matrix = numpy.hypot(self.x[:, None] - self.x[None, :], self.y[:, None] - self.y[None, :]).astype(numpy.float32)
+
+    def __len__(self):
+        return len(self.locations)
+
+    # Index of the location with the name, or None
+    def position_of(self, location_name):
+        if self.index is None:
+            return self.locations.position_of(location_name)
+        return self.index.get(location_name)
+
+    # Distance (m) from the position to every location
+    def distances_from(self, x, y):
+        return numpy.hypot(self.x - x, self.y - y)
+
+    # Distances (m) between the locations with the indices, as a len(indices) x len(indices) array
+    def submatrix(self, indices):
+        indices = numpy.asarray(indices, dtype=numpy.intp)
+        if self.matrix is not None:
+            return self.matrix[numpy.ix_(indices, indices)].astype(numpy.float64)
+        x = self.x[indices]
+        y = self.y[indices]
+        return numpy.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+
+    # Indices of the count locations closest to the position, closest first. crowded (True/False) filters, exclude is a set of location names
+    def nearest(self, x, y, count=1, crowded=None, exclude=None):
+        distances = self.distances_from(x, y)
+        candidates = numpy.arange(len(self.locations))
+        if crowded is not None:
+            candidates = candidates[self.crowded[candidates] == bool(crowded)]
+        if exclude:
+            allowed = numpy.ones(len(self.locations), dtype=bool)
+            allowed[[i for i in [self.position_of(name) for name in exclude] if i is not None]] = False
+            candidates = candidates[allowed[candidates]]
+        if count < len(candidates):
+            candidates = candidates[numpy.argpartition(distances[candidates], count)[:count]]
+        return candidates[numpy.argsort(distances[candidates], kind="mergesort")].tolist()
+
+    # Orders the locations with the indices into a short open tour starting at the position, returns the indices in visiting order
+    # cost(i, j, distance) replaces the distance from location i (None for the position) to location j, e.g. by an expected travel time
+    def tour(self, x, y, indices, cost=None):
+        indices = list(indices)
+        if len(indices) <= 1:
+            return indices
+        start = self.distances_from(x, y)[indices]
+        costs = self.submatrix(indices)
+        if cost is not None:
+            start = numpy.array([cost(None, j, start[b]) for b, j in enumerate(indices)], dtype=numpy.float64)
+            costs = numpy.array([[cost(i, j, costs[a, b]) for b, j in enumerate(indices)] for a, i in enumerate(indices)], dtype=numpy.float64)
+        # Nearest neighbour from the start position
+        order = []
+        remaining = set(range(len(indices)))
+        current = None
+        while remaining:
+            row = start if current is None else costs[current]
+            current = min(remaining, key=lambda i: row[i])
+            order.append(current)
+            remaining.remove(current)
+        # 2-opt: reverse order[i:j + 1] while it shortens the tour, the end is open so the last stop has no successor
+        def between(a, b):
+            return start[b] if a is None else costs[a, b]
+        def length(order):
+            return start[order[0]] + sum(costs[a, b] for a, b in zip(order[:-1], order[1:]))
+        for n in range(self.max_improvement_passes):
+            improved = False
+            for i in range(len(order) - 1):
+                before = order[i - 1] if i > 0 else None
+                for j in range(i + 1, len(order)):
+                    if cost is not None: # Costs may differ by direction, so the reversed segment changes too
+                        delta = length(order[:i] + order[i:j + 1][::-1] + order[j + 1:]) - length(order)
+                    else:
+                        after = order[j + 1] if j + 1 < len(order) else None
+                        delta = between(before, order[j]) - between(before, order[i])
+                        if after is not None:
+                            delta += costs[order[i], after] - costs[order[j], after]
+                    if delta < -1e-9:
+                        order[i:j + 1] = reversed(order[i:j + 1])
+                        improved = True
+            if not improved:
+                break
+        return [indices[i] for i in order]
+
+    # Length (m) of the open tour through the indices starting at the position
+    def tour_length(self, x, y, indices):
+        if len(indices) == 0:
+            return 0.0
+        length = float(self.distances_from(x, y)[indices[0]])
+        for a, b in zip(indices[:-1], indices[1:]):
+            length += float(self.matrix[a, b]) if self.matrix is not None else float(numpy.hypot(self.x[a] - self.x[b], self.y[a] - self.y[b]))
+        return length
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import datetime
+import threading
+from intervalindex import IntervalIndex, parse_date
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+RULE_ALIASES = {"@hourly": "0 * * * *", "@daily": "0 0 * * *", "@weekly": "0 0 * * 0", "@monthly": "0 0 1 * *", "@yearly": "0 0 1 1 *"}
+RULE_FIELDS = [("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 7)] # Weekday 0 and 7 are Sunday
+
+
+# Parses one cron field (*, 5, 1-5, 1,15, */10 or 0-30/10) into the sorted list of values it matches
+def parse_field(text, low, high):
+    values = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/", 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError("Invalid step: " + text)
+        if part == "*":
+            first, last = low, high
+        elif "-" in part:
+            first, last = [int(value) for value in part.split("-", 1)]
+        else:
+            first = last = int(part)
+        if first < low or last > high or first > last:
+            raise ValueError("Value out of range " + str(low) + "-" + str(high) + ": " + text)
+        values.update(range(first, last + 1, step))
+    return sorted(values)
+
+
+class CronRule(object):
+    """CronRule
+
+    When a schedule starts, in the cron format: minute hour day month
+    weekday, e.g. "0 12 * * *" every day at 12:00 and "30 10 * * 3" every
+    Wednesday at 10:30 (weekday 0 or 7 is Sunday). The aliases @hourly,
+    @daily, @weekly, @monthly and @yearly are accepted. As in cron, a day
+    matches either the day or the weekday field when both are restricted."""
+
+    def __init__(self, text):
+        self.text = text
+        fields = RULE_ALIASES.get(text.strip(), text).split()
+        if len(fields) != 5:
+            raise ValueError("A rule has 5 fields (minute hour day month weekday): " + text)
+        self.minutes, self.hours, self.days, self.months, weekdays = [parse_field(field, low, high) for field, (name, low, high) in zip(fields, RULE_FIELDS)]
+        self.weekdays = set(weekday % 7 for weekday in weekdays)
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+        self.times = [datetime.time(hour, minute) for hour in self.hours for minute in self.minutes] # Start times within a matching day, in order
+
+    # Whether the rule has starts on the date
+    def matches_date(self, date):
+        if date.month not in self.months:
+            return False
+        day = date.day in self.days
+        weekday = (date.isoweekday() % 7) in self.weekdays # isoweekday: Monday 1 .. Sunday 7
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    # Yields every start at or after start and before end, in order
+    def starts(self, start, end):
+        date = start.date()
+        while datetime.datetime.combine(date, datetime.time()) < end:
+            if self.matches_date(date):
+                for time in self.times:
+                    moment = datetime.datetime.combine(date, time)
+                    if moment >= end:
+                        return
+                    if moment >= start:
+                        yield moment
+            date += datetime.timedelta(days=1)
+
+
+class EventSchedule(object):
+    """EventSchedule
+
+    A recurring event: a ScheduleRecord with its rule parsed. Every start of
+    the rule between first_date and last_date (both optional) begins an
+    occurrence lasting duration (s), except on the dates in exceptions."""
+
+    def __init__(self, record):
+        self.record = record
+        self.rule = CronRule(record.rule)
+        self.duration = datetime.timedelta(seconds=max(float(record.duration or 0.0), 0.0))
+        self.first_date = parse_date(record.first_date)
+        self.last_date = parse_date(record.last_date)
+        self.exceptions = set()
+        for text in (record.exceptions or "").split(","):
+            if text.strip() != "":
+                date = parse_date(text.strip()) or parse_date(text.strip() + " 00:00:00")
+                if date is None:
+                    raise ValueError("Invalid exception date: " + text)
+                self.exceptions.add(date.date())
+
+    # Yields (start, end) of every occurrence that overlaps start .. end
+    def occurrences(self, start, end):
+        first = start - self.duration
+        if self.first_date is not None:
+            first = max(first, self.first_date)
+        last = end
+        if self.last_date is not None:
+            last = min(last, self.last_date)
+        if first >= last:
+            return
+        for moment in self.rule.starts(first, last):
+            if moment.date() not in self.exceptions:
+                yield moment, moment + self.duration
+
+
+class ScheduleIndex(object):
+    """ScheduleIndex
+
+    The occurrences of the schedules of one map, expanded lazily into an
+    IntervalIndex over a window of window_days from the first date asked
+    about. A date outside the window moves the window, so a query costs the
+    same however long the schedules run. occurrence(record, start, end)
+    makes the item of an occurrence, the EventRecord the queries return."""
+
+    window_days = 7
+
+    def __init__(self, schedules, occurrence):
+        self.schedules = []
+        for record in schedules:
+            try:
+                self.schedules.append(EventSchedule(record))
+            except ValueError as e:
+                print("ScheduleIndex: Schedule " + str(record.schedule_id) + " is ignored - " + str(e) + "...")
+        self.occurrence = occurrence
+        self.window = None # (start, end, IntervalIndex), replaced as a whole so readers need no lock
+        self.lock = threading.Lock() # One window is expanded at a time
+
+    def __len__(self):
+        return len(self.schedules)
+
+    # Returns (start, end, IntervalIndex) of a window that contains the date
+    def covering(self, date):
+        window = self.window
+        if window is not None and window[0] <= date < window[1]:
+            return window
+        with self.lock:
+            window = self.window
+            if window is not None and window[0] <= date < window[1]:
+                return window
+            start = datetime.datetime.combine(date.date(), datetime.time())
+            end = start + datetime.timedelta(days=self.window_days)
+            intervals = []
+            for schedule in self.schedules:
+                for occurrence_start, occurrence_end in schedule.occurrences(start, end):
+                    intervals.append((occurrence_start, occurrence_end, self.occurrence(schedule.record, occurrence_start, occurrence_end)))
+            window = self.window = (start, end, IntervalIndex(intervals))
+            return window
+
+    def active(self, t):
+        return self.covering(t)[2].active(t)
+
+    # The first start or end of an occurrence after t, or the end of the window when nothing changes before it
+    def next_boundary(self, t):
+        start, end, intervals = self.covering(t)
+        boundary = intervals.next_boundary(t)
+        return boundary if boundary is not None and boundary < end else end
+
+
+class EventIndex(object):
+    """EventIndex
+
+    The one-off events (an IntervalIndex) and the recurring events (a
+    ScheduleIndex) of one map, queried as one."""
+
+    def __init__(self, intervals, schedules):
+        self.intervals = intervals
+        self.schedules = schedules
+
+    def active(self, t):
+        found = self.intervals.active(t)
+        if len(self.schedules) > 0:
+            found = found + self.schedules.active(t)
+        return found
+
+    # The active (start, end, item) tuple with the latest start, or None
+    def latest_active(self, t):
+        found = self.active(t)
+        return max(found, key=lambda interval: interval[0]) if len(found) > 0 else None
+
+    # The first time after t when an event starts or ends, or None
+    def next_boundary(self, t):
+        boundaries = [self.intervals.next_boundary(t)]
+        if len(self.schedules) > 0:
+            boundaries.append(self.schedules.next_boundary(t))
+        boundaries = [boundary for boundary in boundaries if boundary is not None]
+        return min(boundaries) if len(boundaries) > 0 else None
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import bisect
+import datetime
+import re
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+DATE_FORMATS = ["%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]
+DATE_PATTERN = re.compile(r"^(\d{4})-(\d{2})-(\d{2})[ T](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?$")
+
+
+# Converts a DATETIME column value (as written by the sqlite3 datetime adapter) to a datetime, or None
+def parse_date(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if value is None:
+        return None
+    match = DATE_PATTERN.match(str(value))
+    if match is not None: # Fast path for the format written by sqlite3, strptime is slow
+        fields = match.groups()
+        try:
+            return datetime.datetime(int(fields[0]), int(fields[1]), int(fields[2]), int(fields[3]), int(fields[4]), int(fields[5]), int((fields[6] or "0").ljust(6, "0")))
+        except ValueError:
+            return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(str(value), date_format)
+        except ValueError:
+            pass
+    return None
+
+
+class IntervalNode(object):
+    """One node of the centered interval tree. Holds the intervals that contain its center."""
+
+    def __init__(self, intervals):
+        endpoints = sorted([interval[0] for interval in intervals] + [interval[1] for interval in intervals])
+        self.center = endpoints[len(endpoints) // 2]
+        left = []
+        right = []
+        here = []
+        for interval in intervals:
+            if interval[1] < self.center:
+                left.append(interval)
+            elif interval[0] > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        self.by_start = sorted(here, key=lambda interval: interval[0])
+        self.by_end = sorted(here, key=lambda interval: interval[1], reverse=True)
+        self.left = IntervalNode(left) if len(left) > 0 else None
+        self.right = IntervalNode(right) if len(right) > 0 else None
+
+
+class IntervalIndex(object):
+    """IntervalIndex
+
+    Static centered interval tree over (start, end, item) tuples. Finds the
+    intervals with start < t < end (the same bounds as the Event query) in
+    O(log n + k), and the next start or end after t in O(log n). Intervals
+    that end before they start can never be active and are left out."""
+
+    def __init__(self, intervals):
+        intervals = [interval for interval in intervals if interval[0] < interval[1]]
+        self.root = IntervalNode(intervals) if len(intervals) > 0 else None
+        self.boundaries = sorted(set([interval[0] for interval in intervals] + [interval[1] for interval in intervals]))
+
+    def __len__(self):
+        return len(self.boundaries)
+
+    # Returns the (start, end, item) tuples active at time t
+    def active(self, t):
+        found = []
+        node = self.root
+        while node is not None:
+            if t < node.center:
+                for interval in node.by_start:
+                    if not interval[0] < t:
+                        break
+                    found.append(interval)
+                node = node.left
+            elif t > node.center:
+                for interval in node.by_end:
+                    if not interval[1] > t:
+                        break
+                    found.append(interval)
+                node = node.right
+            else:
+                for interval in node.by_start:
+                    if not interval[0] < t:
+                        break
+                    if interval[1] > t:
+                        found.append(interval)
+                node = None
+        return found
+
+    # Returns the active (start, end, item) tuple with the latest start, or None
+    def latest_active(self, t):
+        found = self.active(t)
+        return max(found, key=lambda interval: interval[0]) if len(found) > 0 else None
+
+    # Returns the first start or end strictly after time t, or None
+    def next_boundary(self, t):
+        i = bisect.bisect_right(self.boundaries, t)
+        return self.boundaries[i] if i < len(self.boundaries) else None
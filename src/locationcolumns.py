@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import json
+import os
+import struct
+import numpy
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+# File layout: MAGIC, the header length (8 bytes, little endian), a JSON header, then the record array, the name offsets and the
+# UTF-8 name bytes, each starting at a multiple of 8 bytes. The header gives the offset of each part
+MAGIC = b"CYBLOC01"
+REAL_FIELDS = ["x", "y", "z", "p", "j", "r", "threshold", "enviorment"]
+LOCATION_DTYPE = numpy.dtype([(field, "<f8") for field in REAL_FIELDS] + [("map", "<i4"), ("crowded", "u1")], align=True)
+
+
+def aligned(offset):
+    return (offset + 7) // 8 * 8
+
+
+# The column of the locations as an array, read directly from a LocationSequence or collected from the records
+def location_column(locations, field, dtype=numpy.float64):
+    if isinstance(locations, LocationSequence):
+        return locations.column(field).astype(dtype)
+    return numpy.array([getattr(location, field) for location in locations], dtype=dtype)
+
+
+class LocationColumns(object):
+    """LocationColumns
+
+    Every location in one structured NumPy array (one row of 72 bytes, the
+    map an index into a short list of map names) and the names as one UTF-8
+    buffer sorted by name, so a name is found by binary search. Written to
+    a file with write() and memory-mapped read-only with open(), nothing is
+    built per location, and processes opening the same file share the
+    pages. revision is the Location revision of the database it was made
+    from, see DatabaseHandler.load_location_columns().
+
+    The part of the dict interface DatabaseSnapshot uses on its location
+    name -> map name table (get(), keys() and values()) is provided, so it
+    can stand in for that table."""
+
+    def __init__(self, records, name_offsets, names, maps, revision=None):
+        self.records = records # LOCATION_DTYPE array, sorted by name
+        self.name_offsets = name_offsets # len(records) + 1 offsets into names
+        self.names = names # uint8 array of the UTF-8 names
+        self.maps = maps # Map names, records["map"] indexes it
+        self.revision = revision
+        self.map_indices = {} # Map index -> sorted record indices of the map
+
+    # Makes the columns from location records (anything with the LocationRecord fields)
+    @classmethod
+    def from_records(cls, locations, revision=None):
+        locations = sorted(locations, key=lambda location: location.location_name.encode("utf-8"))
+        maps = sorted(set(location.robot_map_name or "" for location in locations))
+        map_index = dict((robot_map_name, i) for i, robot_map_name in enumerate(maps))
+        records = numpy.zeros(len(locations), dtype=LOCATION_DTYPE)
+        for field in REAL_FIELDS:
+            records[field] = [getattr(location, field) or 0.0 for location in locations]
+        records["map"] = [map_index[location.robot_map_name or ""] for location in locations]
+        records["crowded"] = [bool(location.crowded) for location in locations]
+        encoded = [location.location_name.encode("utf-8") for location in locations]
+        name_offsets = numpy.zeros(len(encoded) + 1, dtype="<i8")
+        name_offsets[1:] = numpy.cumsum([len(name) for name in encoded])
+        names = numpy.frombuffer(b"".join(encoded), dtype=numpy.uint8)
+        return cls(records, name_offsets, names, maps, revision)
+
+    # Memory-maps the file read-only, raises ValueError if it is not a location file
+    @classmethod
+    def open(cls, path):
+        data = numpy.memmap(path, dtype=numpy.uint8, mode="r").view(numpy.ndarray) # Still backed by the mapping, without the memmap overhead on every slice
+        if len(data) < 16 or data[:8].tobytes() != MAGIC:
+            raise ValueError("Not a location file: " + path)
+        length = struct.unpack("<Q", data[8:16].tobytes())[0]
+        header = json.loads(data[16:16 + length].tobytes().decode("utf-8"))
+        count = header["count"]
+        records = data[header["records"]:header["records"] + count * LOCATION_DTYPE.itemsize].view(LOCATION_DTYPE)
+        name_offsets = data[header["name_offsets"]:header["name_offsets"] + (count + 1) * 8].view("<i8")
+        names = data[header["names"]:header["names"] + int(name_offsets[-1])]
+        return cls(records, name_offsets, names, header["maps"], header["revision"])
+
+    # Writes the columns to a temporary file and renames it over path, so a process that has the old file mapped keeps reading it
+    def write(self, path):
+        header = {"count": len(self.records), "maps": self.maps, "revision": self.revision}
+        length = len(json.dumps(dict(header, records=0, name_offsets=0, names=0)).encode("utf-8")) + 64 # Room for the offsets
+        header["records"] = aligned(16 + length)
+        header["name_offsets"] = aligned(header["records"] + self.records.nbytes)
+        header["names"] = aligned(header["name_offsets"] + self.name_offsets.nbytes)
+        encoded = json.dumps(header).encode("utf-8").ljust(length)
+        temporary = path + "." + str(os.getpid()) + ".tmp"
+        with open(temporary, "wb") as stream:
+            stream.write(MAGIC + struct.pack("<Q", length) + encoded)
+            for offset, array in [(header["records"], self.records), (header["name_offsets"], self.name_offsets), (header["names"], self.names)]:
+                stream.write(b"\0" * (offset - stream.tell()))
+                stream.write(numpy.ascontiguousarray(array).tobytes())
+        os.rename(temporary, path)
+
+    def __len__(self):
+        return len(self.records)
+
+    def name(self, index):
+        return self.names[self.name_offsets[index]:self.name_offsets[index + 1]].tobytes().decode("utf-8")
+
+    # Index of the record with the name, or None
+    def index_of(self, location_name):
+        encoded = location_name.encode("utf-8")
+        low = 0
+        high = len(self.records)
+        while low < high:
+            middle = (low + high) // 2
+            if self.names[self.name_offsets[middle]:self.name_offsets[middle + 1]].tobytes() < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.records) and self.name(low) == location_name:
+            return low
+        return None
+
+    def view(self, index):
+        return LocationView(self, index)
+
+    # The locations of the map as a LocationSequence
+    def map_locations(self, robot_map_name):
+        try:
+            map_index = self.maps.index(robot_map_name)
+        except ValueError:
+            return LocationSequence(self, numpy.array([], dtype=numpy.intp))
+        indices = self.map_indices.get(map_index)
+        if indices is None:
+            indices = self.map_indices[map_index] = numpy.flatnonzero(self.records["map"] == map_index)
+        return LocationSequence(self, indices)
+
+    # Every location as a LocationSequence, in name order
+    def all_locations(self):
+        return LocationSequence(self, numpy.arange(len(self.records)))
+
+    # The map name of the location, or default
+    def get(self, location_name, default=None):
+        index = self.index_of(location_name)
+        return self.maps[self.records["map"][index]] if index is not None else default
+
+    def keys(self):
+        names = self.names.tobytes()
+        offsets = self.name_offsets.tolist()
+        return (names[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:]))
+
+    # The map names in use, each once
+    def values(self):
+        return [self.maps[map_index] for map_index in numpy.unique(self.records["map"])]
+
+
+class LocationSequence(object):
+    """LocationSequence
+
+    The locations with the given record indices (ascending) of a
+    LocationColumns, a sequence of LocationView made on access."""
+
+    def __init__(self, columns, indices):
+        self.columns = columns
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, position):
+        return LocationView(self.columns, int(self.indices[position]))
+
+    def __iter__(self):
+        for index in self.indices:
+            yield LocationView(self.columns, int(index))
+
+    # The column of these locations as an array
+    def column(self, field):
+        return self.columns.records[field][self.indices]
+
+    # Position in this sequence of the location with the name, or None
+    def position_of(self, location_name):
+        index = self.columns.index_of(location_name)
+        if index is None:
+            return None
+        position = int(numpy.searchsorted(self.indices, index))
+        return position if position < len(self.indices) and self.indices[position] == index else None
+
+    # The location with the name if it is in this sequence, or None
+    def find(self, location_name):
+        position = self.position_of(location_name)
+        return self[position] if position is not None else None
+
+    # The locations that are crowded (or not)
+    def where_crowded(self, crowded):
+        return LocationSequence(self.columns, self.indices[(self.column("crowded") != 0) == bool(crowded)])
+
+
+def column_property(field, convert):
+    return property(lambda self: convert(self.columns.records[field][self.index]))
+
+
+class LocationView(object):
+    """LocationView
+
+    One row of a LocationColumns with the fields of a LocationRecord, read
+    from the columns when asked for."""
+
+    __slots__ = ["columns", "index"]
+
+    def __init__(self, columns, index):
+        self.columns = columns
+        self.index = index
+
+    location_name = property(lambda self: self.columns.name(self.index))
+    robot_map_name = property(lambda self: self.columns.maps[self.columns.records["map"][self.index]])
+    x = column_property("x", float)
+    y = column_property("y", float)
+    z = column_property("z", float)
+    p = column_property("p", float)
+    j = column_property("j", float)
+    r = column_property("r", float)
+    threshold = column_property("threshold", float)
+    crowded = column_property("crowded", bool)
+    enviorment = column_property("enviorment", float)
+
+    def __eq__(self, other):
+        return isinstance(other, LocationView) and other.columns is self.columns and other.index == self.index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.columns), self.index))
+
+    def __repr__(self):
+        return "LocationView(location_name=" + repr(self.location_name) + ", robot_map_name=" + repr(self.robot_map_name) + ", x=" + repr(self.x) + ", y=" + repr(self.y) + ")"
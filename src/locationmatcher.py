@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import threading
+from collections import deque
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+
+class LocationMatcher(object):
+    """LocationMatcher
+
+    Aho-Corasick automaton over location names. Finds every name mentioned in
+    a text in one pass, and reduces them to the leftmost-longest
+    non-overlapping mentions ("entrance 2" wins over "entrance"). Names are
+    added and removed in the trie directly, the failure links are recomputed
+    on the next search after a change. Thread safe."""
+
+    def __init__(self, names=()):
+        self.lock = threading.Lock()
+        self.children = [{}] # node -> {character: node}, node 0 is the root
+        self.name = [None] # node -> the name ending at this node
+        self.fail = [0] # node -> longest proper suffix that is also a trie node
+        self.output = [0] # node -> nearest node along the failure links that ends a name (0 if none)
+        self.names = set()
+        self.is_compiled = True
+        self.update(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def add(self, name):
+        with self.lock:
+            self.add_name(name)
+
+    def remove(self, name):
+        with self.lock:
+            self.remove_name(name)
+
+    # Adds and removes names so the matcher holds exactly the given names
+    def update(self, names):
+        names = set(name for name in names if name)
+        with self.lock:
+            for name in self.names - names:
+                self.remove_name(name)
+            for name in names - self.names:
+                self.add_name(name)
+
+    def add_name(self, name):
+        if not name or name in self.names:
+            return
+        node = 0
+        for character in name:
+            child = self.children[node].get(character)
+            if child is None:
+                child = len(self.children)
+                self.children.append({})
+                self.name.append(None)
+                self.fail.append(0)
+                self.output.append(0)
+                self.children[node][character] = child
+            node = child
+        self.name[node] = name
+        self.names.add(name)
+        self.is_compiled = False
+
+    def remove_name(self, name):
+        if name not in self.names:
+            return
+        node = 0
+        for character in name:
+            node = self.children[node][character]
+        self.name[node] = None # Nodes are kept, they still lead to longer names or are reused when the name returns
+        self.names.discard(name)
+        self.is_compiled = False
+
+    # Recomputes the failure and output links breadth first
+    def compile(self):
+        queue = deque()
+        for child in self.children[0].values():
+            self.fail[child] = 0
+            self.output[child] = 0
+            queue.append(child)
+        while len(queue) > 0:
+            node = queue.popleft()
+            for character, child in self.children[node].items():
+                fail = self.fail[node]
+                while fail != 0 and character not in self.children[fail]:
+                    fail = self.fail[fail]
+                fail = self.children[fail].get(character, 0)
+                self.fail[child] = fail
+                self.output[child] = fail if self.name[fail] is not None else self.output[fail]
+                queue.append(child)
+        self.is_compiled = True
+
+    # Returns every (start, end, name) occurrence in the text, overlapping ones included
+    def find_all(self, text):
+        found = []
+        with self.lock:
+            if not self.is_compiled:
+                self.compile()
+            node = 0
+            for i, character in enumerate(text):
+                while node != 0 and character not in self.children[node]:
+                    node = self.fail[node]
+                node = self.children[node].get(character, 0)
+                match = node if self.name[node] is not None else self.output[node]
+                while match != 0:
+                    name = self.name[match]
+                    found.append((i + 1 - len(name), i + 1, name))
+                    match = self.output[match]
+        return found
+
+    # Returns the names mentioned in the text, leftmost-longest and non-overlapping, in order of appearance
+    # With whole_words a mention must not start or end inside a word ("he" is not found in "the")
+    def find(self, text, whole_words=True):
+        mentions = []
+        end = 0
+        for start, stop, name in sorted(self.find_all(text), key=lambda match: (match[0], -match[1])):
+            if whole_words and ((start > 0 and text[start - 1].isalnum()) or (stop < len(text) and text[stop].isalnum())):
+                continue
+            if start >= end:
+                mentions.append(name)
+                end = stop
+        return mentions
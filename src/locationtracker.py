@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import math
+import threading
+from navigationmetrics import timed, CALLBACK_SECONDS
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+
+class LocationTracker(object):
+    """LocationTracker
+
+    Follows which location the robot is at. update() only stores the latest
+    position and notifies the condition, the tracker thread of the
+    NavigationFleet (shared by the trackers of every robot, see
+    NavigationFleet.track()) takes it and resolves it, so a burst of
+    amcl_pose messages costs one lookup. The robot enters a location inside
+    its threshold and leaves it beyond threshold + exit_margin, so the
+    result does not flicker on the boundary. Listeners are called with
+    (previous, location) on every change, either may be None."""
+
+    exit_margin = 0.5 # (m) How far beyond its threshold the robot has to be to leave a location
+
+    def __init__(self, database_handler, map_name, metrics=None, condition=None):
+        self.database_handler = database_handler
+        self.map_name = map_name
+        self.metrics = metrics
+        self.location = None # LocationRecord the robot is at, or None
+        self.x = None
+        self.y = None
+        self.condition = condition if condition is not None else threading.Condition() # Notified when a position is waiting
+        self.pending = None # Latest (x, y) not resolved yet
+        self.coalesced = 0 # Positions replaced by a newer one before they were resolved
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    # Stores the position for the tracker thread, a position that has not been resolved yet is replaced
+    def update(self, x, y):
+        with self.condition:
+            if self.pending is not None:
+                self.coalesced += 1
+            self.pending = (x, y)
+            self.condition.notify()
+
+    # Changes the map and resolves the last position again on it
+    def set_map(self, map_name):
+        with self.condition:
+            self.map_name = map_name
+            if self.x is not None and self.pending is None:
+                self.pending = (self.x, self.y)
+            self.condition.notify()
+
+    # Returns the position waiting to be resolved and clears it, called with condition held
+    def take(self):
+        pending = self.pending
+        self.pending = None
+        return pending
+
+    @timed(CALLBACK_SECONDS, "location_tracker")
+    def track(self, x, y):
+        self.x = x
+        self.y = y
+        previous = self.location
+        location = self.resolve(x, y)
+        self.location = location
+        if (location.location_name if location is not None else None) == (previous.location_name if previous is not None else None):
+            return
+        for listener in list(self.listeners):
+            listener(previous, location)
+
+    # The current location while within threshold + exit_margin of it, otherwise the closest location whose threshold contains the position
+    def resolve(self, x, y):
+        current = self.location
+        if current is not None:
+            current = self.database_handler.search_for_location(location_name=current.location_name) # The record may have changed in the database
+        if current is not None and current.robot_map_name == self.map_name and math.hypot(current.x - x, current.y - y) <= current.threshold + self.exit_margin:
+            return current
+        return self.database_handler.find_location(robot_map_name=self.map_name, location_x=x, location_y=y) # Looks only at the grid cell of the position
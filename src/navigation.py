@@ -3,12 +3,12 @@
 """Created by Thomas Rostrup Andersen on 11/11/2016.
 Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
 
-import rospy
 import sys
 import os
 import datetime
-from navigationserver import NavigationServer
+import threading
 from databasehandler import DatabaseHandler
+from navigationmetrics import StartupTimer
 
 __author__ = "Thomas Rostrup Andersen"
 __copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
@@ -18,47 +18,96 @@ __all__ = []
 
 """Cyborg Navigation Module"""
 
-def main():
+# The locations, events, schedules and responses of the NTNU building a new database is seeded with
+SEED_LOCATIONS = [
+    {"location_name": "entrance", "robot_map_name": "ntnu2.map", "x": -18.440, "y": 6.500, "z": 0, "p": 0, "j": 0, "r": 2, "threshold": 3, "crowded": False, "enviorment": -0.10},
+    {"location_name": "home", "robot_map_name": "ntnu2.map", "x": -29.500, "y": 8.700, "z": 0, "p": 0, "j": 0, "r": 2, "threshold": 3, "crowded": False, "enviorment": 0.20},
+    {"location_name": "waiting area", "robot_map_name": "ntnu2.map", "x": -33.600, "y": 10.600, "z": 0, "p": 0, "j": 0, "r": 2, "threshold": 3, "crowded": False, "enviorment": -0.10},
+    {"location_name": "cafeteria", "robot_map_name": "ntnu2.map", "x": -33.090, "y": -55.700, "z": 0, "p": 0, "j": 0, "r": 2, "threshold": 3, "crowded": True, "enviorment": 0.20},
+    {"location_name": "elevator", "robot_map_name": "ntnu2.map", "x": -29.500, "y": -50.200, "z": 0, "p": 0, "j": 0, "r": 2, "threshold": 3, "crowded": True, "enviorment": -0.02},
+    {"location_name": "entrance 2", "robot_map_name": "ntnu2.map", "x": -18.300, "y": -66.000, "z": 0, "p": 0, "j": 0, "r": 33, "threshold": 3, "crowded": True, "enviorment": 0.05},
+    {"location_name": "information", "robot_map_name": "ntnu2.map", "x": -33.490, "y": 1.160, "z": 0, "p": 0, "j": 0, "r": 2, "threshold": 3, "crowded": True, "enviorment": 0.05},
+    {"location_name": "el5", "robot_map_name": "ntnu2.map", "x": -33.720, "y": -32.500, "z": 0, "p": 0, "j": 0, "r": -2, "threshold": 3, "crowded": True, "enviorment": 0.00},
+    {"location_name": "el6", "robot_map_name": "ntnu2.map", "x": -30.300, "y": -12.840, "z": 0, "p": 0, "j": 0, "r": 2, "threshold": 3, "crowded": True, "enviorment": 0.00},
+    {"location_name": "bridge", "robot_map_name": "ntnu2.map", "x": -28.090, "y": -63.500, "z": 0, "p": 0, "j": 0, "r": 2, "threshold": 3, "crowded": True, "enviorment": 0.00},
+]
+SEED_EVENTS = [
+    {"event_name": "lunch_time", "location_name": "cafeteria", "start_date": datetime.datetime(2017, 1, 18, 7, 0, 1, 1), "end_date": datetime.datetime(2017, 1, 18, 7, 0, 0, 1), "ignore": False},
+    {"event_name": "goodbye_time", "location_name": "entrance 2", "start_date": datetime.datetime(2017, 1, 18, 9, 0, 1, 1), "end_date": datetime.datetime(2017, 1, 18, 9, 0, 0, 1), "ignore": False},
+]
+SEED_SCHEDULES = [ # Every day, duration in seconds
+    {"event_name": "welcome_time", "location_name": "entrance", "rule": "0 11 * * *", "duration": 240, "ignore": False},
+    {"event_name": "dinner_time", "location_name": "cafeteria", "rule": "0 15 * * *", "duration": 3540, "ignore": False},
+    {"event_name": "wait_time", "location_name": "waiting area", "rule": "0 8 * * *", "duration": 2760, "ignore": False},
+]
+SEED_RESPONSES = [
+    {"message": "I love LOCATION", "response_type": "navigation_response", "emotion": "love"},
+    {"message": "I am happy about LOCATION", "response_type": "navigation_response", "emotion": "elated"},
+    {"message": "I like LOCATION", "response_type": "navigation_response", "emotion": "elated"},
+    {"message": "I like LOCATION", "response_type": "navigation_response", "emotion": "dignified"},
+    {"message": "I am happy about at LOCATION", "response_type": "navigation_response", "emotion": "neutral"},
+    {"message": "I like LOCATION", "response_type": "navigation_response", "emotion": "neutral"},
+    {"message": "What is this place? A LOCATION you say?", "response_type": "navigation_response", "emotion": "curious"},
+    {"message": "What is this place? A LOCATION you say?", "response_type": "navigation_response", "emotion": "puzzled"},
+    {"message": "I hate the LOCATION", "response_type": "navigation_response", "emotion": "angry"},
+    {"message": "I dont like the LOCATION", "response_type": "navigation_response", "emotion": "angry"},
+    {"message": "A the LOCATION, whatever. Been there, done that...", "response_type": "navigation_response", "emotion": "unconcerned"},
+    {"message": "A the LOCATION, whatever. Been there, done that...", "response_type": "navigation_response", "emotion": "angry"},
+    {"message": "A the LOCATION, whatever. Been there, done that...", "response_type": "navigation_response", "emotion": "inhibited"},
+]
+
+
+# Creates the database with the locations, events, schedules and responses of the NTNU building, in one transaction
+def create_database(path):
+    database_handler = DatabaseHandler(filename=path)
+    database_handler.create()
+    seeded = True
+    for table, records in [("Location", SEED_LOCATIONS), ("Event", SEED_EVENTS), ("Schedule", SEED_SCHEDULES)]:
+        seeded = seeded and database_handler.import_records(table, records, commit=False) is not None
+    if seeded:
+        database_handler.import_records("Response", SEED_RESPONSES) # Commits every table
+    database_handler.close()
 
+
+def main():
+    startup = StartupTimer()
     homedir = os.path.expanduser("~")
     path = homedir + "/navigation.db"
 
     if (os.path.exists(path) == False):
-        database_handler = DatabaseHandler(filename=path)
-        database_handler.create()
-        database_handler.add_location(location_name="entrance", robot_map_name="ntnu2.map", x=-18.440, y=6.500, z=0, p=0, j=0, r=2, threshold=3, crowded=False,enviorment=-0.10)
-        database_handler.add_location(location_name="home", robot_map_name="ntnu2.map", x=-29.500, y=8.700, z=0, p=0, j=0, r=2, threshold=3, crowded=False, enviorment=0.20)
-        database_handler.add_location(location_name="waiting area", robot_map_name="ntnu2.map", x=-33.600, y=10.600, z=0, p=0, j=0, r=2, threshold=3, crowded=False, enviorment=-0.10)
-        database_handler.add_location(location_name="cafeteria", robot_map_name="ntnu2.map", x=-33.090, y=-55.700, z=0, p=0, j=0, r=2, threshold=3, crowded=True, enviorment=0.20)
-        database_handler.add_location(location_name="elevator", robot_map_name="ntnu2.map", x=-29.500, y=-50.200, z=0, p=0, j=0, r=2, threshold=3, crowded=True, enviorment=-0.02)
-        database_handler.add_location(location_name="entrance 2", robot_map_name="ntnu2.map", x=-18.300, y=-66.000, z=0, p=0, j=0, r=33, threshold=3, crowded=True, enviorment=0.05)
-        database_handler.add_location(location_name="information", robot_map_name="ntnu2.map", x=-33.490, y=1.160, z=0, p=0, j=0, r=2, threshold=3, crowded=True, enviorment=0.05)
-        database_handler.add_location(location_name="el5", robot_map_name="ntnu2.map", x=-33.720, y=-32.500, z=0, p=0, j=0, r=-2, threshold=3, crowded=True, enviorment=0.00)
-        database_handler.add_location(location_name="el6", robot_map_name="ntnu2.map", x=-30.300, y=-12.840, z=0, p=0, j=0, r=2, threshold=3, crowded=True, enviorment=0.00)
-        database_handler.add_location(location_name="bridge", robot_map_name="ntnu2.map", x=-28.090, y=-63.500, z=0, p=0, j=0, r=2, threshold=3, crowded=True, enviorment=0.00)
-        
-        database_handler.add_event(event_name="welcome_time", location_name="entrance", start_date=datetime.datetime(2017, 1, 18, 11, 0, 0, 1), end_date=datetime.datetime(2017, 1, 18, 11, 4, 0, 1), ignore=False)
-        database_handler.add_event(event_name="dinner_time", location_name="cafeteria", start_date=datetime.datetime(2017, 1, 18, 15, 0, 7, 1) , end_date=datetime.datetime(2017, 1, 18, 15, 59, 0, 1), ignore=False)
-        database_handler.add_event(event_name="wait_time", location_name="waiting area", start_date=datetime.datetime(2017, 1, 18, 8, 0, 1, 1) , end_date=datetime.datetime(2017, 1, 18, 8, 46, 0, 1), ignore=False)
-        database_handler.add_event(event_name="lunch_time", location_name="cafeteria", start_date=datetime.datetime(2017, 1, 18, 7, 0, 1, 1) , end_date=datetime.datetime(2017, 1, 18, 7, 0, 0, 1), ignore=False)
-        database_handler.add_event(event_name="goodbye_time", location_name="entrance 2", start_date=datetime.datetime(2017, 1, 18, 9, 0, 1, 1), end_date=datetime.datetime(2017, 1, 18, 9, 0, 0, 1), ignore=False)
-        
-        database_handler.add_response( message="I love LOCATION", response_type="navigation_response", emotion="love")
-        database_handler.add_response( message="I am happy about LOCATION", response_type="navigation_response", emotion="elated")
-        database_handler.add_response( message="I like LOCATION", response_type="navigation_response", emotion="elated")
-        database_handler.add_response( message="I like LOCATION", response_type="navigation_response", emotion="dignified")
-        database_handler.add_response( message="I am happy about at LOCATION", response_type="navigation_response", emotion="neutral")
-        database_handler.add_response( message="I like LOCATION", response_type="navigation_response", emotion="neutral")
-        database_handler.add_response( message="What is this place? A LOCATION you say?", response_type="navigation_response", emotion="curious")
-        database_handler.add_response( message="What is this place? A LOCATION you say?", response_type="navigation_response", emotion="puzzled")
-        database_handler.add_response( message="I hate the LOCATION", response_type="navigation_response", emotion="angry")
-        database_handler.add_response( message="I dont like the LOCATION", response_type="navigation_response", emotion="angry")
-        database_handler.add_response( message="A the LOCATION, whatever. Been there, done that...", response_type="navigation_response", emotion="unconcerned")
-        database_handler.add_response( message="A the LOCATION, whatever. Been there, done that...", response_type="navigation_response", emotion="angry")
-        database_handler.add_response( message="A the LOCATION, whatever. Been there, done that...", response_type="navigation_response", emotion="inhibited")
-        
+        create_database(path)
+        startup.mark("seed")
+
+    # ROS, actionlib and the message packages are imported after the database is ready, so seeding does not wait for them
+    import rospy
+    from navigationserver import NavigationServer
+    from navigationfleet import NavigationFleet
+    startup.mark("imports")
     rospy.init_node("cyborg_navigation")
-    navigation_server = NavigationServer(database_file=path)
+    startup.mark("init_node")
+    robots = rospy.get_param("~robots", []) # Namespaces of the robots, empty for a single robot without namespace
+    location_file = os.path.expanduser(rospy.get_param("~location_file", "")) # Memory-mapped copy of the locations, shared by the processes given the same file
+    record_directory = os.path.expanduser(rospy.get_param("~record_directory", "")) # Poses, locations, events and decisions are recorded here if set
+    fleet = NavigationFleet(database_file=path, metrics_file=rospy.get_param("~metrics_file", ""), location_file=location_file, record_directory=record_directory)
+    startup.mark("fleet")
+    if len(robots) == 0:
+        navigation_servers = [NavigationServer(map_name=rospy.get_param("~map_name", ""), fleet=fleet)]
+    else:
+        navigation_servers = [NavigationServer(map_name=rospy.get_param("~map_name", ""), namespace="/" + robot.strip("/"), fleet=fleet) for robot in robots]
+    startup.mark("servers")
+    rospy.loginfo("Cyborg Navigation: Ready in " + "%.3f" % startup.elapsed() + " s (" + startup.report() + ").")
+    warming = [len(navigation_servers)]
+    warming_lock = threading.Lock()
+    def warmed(future): # The last map load to finish reports
+        with warming_lock:
+            warming[0] -= 1
+            if warming[0] > 0:
+                return
+        startup.add("warm", startup.elapsed())
+        startup.record(fleet.metrics)
+        rospy.loginfo("Cyborg Navigation: Caches warm after " + "%.3f" % startup.elapsed() + " s.")
+    for server in navigation_servers:
+        server.map_warm.add_done_callback(warmed)
     rospy.spin()
 
 if __name__ == "__main__":
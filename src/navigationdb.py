@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import argparse
+import codecs
+import csv
+import datetime
+import json
+import os
+import sys
+from databasehandler import DatabaseHandler, TABLE_COLUMNS, SCHEMA_VERSION
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+"""Cyborg Navigation Database Tool
+
+Bulk import and export of the Location, Event and Response tables, and
+schema upgrades.
+
+    $ rosrun cyborg_navigation navigationdb.py import location locations.csv --upsert
+    $ rosrun cyborg_navigation navigationdb.py export event events.jsonl
+    $ rosrun cyborg_navigation navigationdb.py migrate
+    $ rosrun cyborg_navigation navigationdb.py check
+    $ rosrun cyborg_navigation navigationdb.py columns ~/navigation.locations
+
+The format follows the file extension: .csv, .jsonl (one JSON object per
+line) or .json (an array of objects). All formats are streamed."""
+
+TABLES = dict((table.lower(), table) for table in TABLE_COLUMNS)
+PYTHON2 = sys.version_info[0] == 2
+JSON_CHUNK_SIZE = 65536
+
+
+def file_format(path, requested=None):
+    if requested is not None:
+        return requested
+    extension = os.path.splitext(path)[1].lower()
+    return {".csv": "csv", ".jsonl": "jsonl", ".json": "json"}.get(extension, "jsonl")
+
+
+def open_text(path, mode):
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    if PYTHON2:
+        return open(path, mode + "b")
+    return open(path, mode, newline="") if path.endswith(".csv") else codecs.open(path, mode, encoding="utf-8")
+
+
+def decode(value):
+    return value.decode("utf-8") if PYTHON2 and isinstance(value, str) else value
+
+
+# Yields the objects of a top level JSON array without reading the whole file
+def read_json_array(stream):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    eof = False
+    while True:
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise
+                break # Incomplete object, read more
+            if end == len(buffer) and not eof:
+                break # A number could continue in the next chunk
+            yield value
+            position = end
+        buffer = buffer[position:]
+        chunk = stream.read(JSON_CHUNK_SIZE)
+        if not chunk:
+            if eof:
+                if buffer.strip():
+                    raise ValueError("Unterminated JSON array")
+                return
+            eof = True
+        buffer += decode(chunk)
+
+
+def read_records(path, requested_format=None):
+    stream = open_text(path, "r")
+    try:
+        selected = file_format(path, requested_format)
+        if selected == "csv":
+            for row in csv.DictReader(stream):
+                yield dict((decode(key), decode(value)) for key, value in row.items())
+        elif selected == "json":
+            for record in read_json_array(stream):
+                yield record
+        else:
+            for line in stream:
+                line = decode(line).strip()
+                if line:
+                    yield json.loads(line)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def export_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(" ")
+    if PYTHON2 and isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+
+def write_records(path, table, records, requested_format=None):
+    stream = open_text(path, "w")
+    count = 0
+    try:
+        selected = file_format(path, requested_format)
+        if selected == "csv":
+            writer = csv.writer(stream)
+            writer.writerow(TABLE_COLUMNS[table])
+            for record in records:
+                writer.writerow([export_value(value) for value in record.values()])
+                count += 1
+        elif selected == "json":
+            stream.write("[")
+            for record in records:
+                stream.write(("\n" if count == 0 else ",\n") + json.dumps(record))
+                count += 1
+            stream.write("\n]\n")
+        else:
+            for record in records:
+                stream.write(json.dumps(record) + "\n")
+                count += 1
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    return count
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Bulk import and export of the Cyborg Navigation database.")
+    parser.add_argument("--database", default=os.path.join(os.path.expanduser("~"), "navigation.db"), help="database file (default ~/navigation.db)")
+    commands = parser.add_subparsers(dest="command")
+    import_parser = commands.add_parser("import", help="insert records from a file in one transaction")
+    import_parser.add_argument("table", choices=sorted(TABLES))
+    import_parser.add_argument("file", help="csv, jsonl or json file, - for standard input")
+    import_parser.add_argument("--format", choices=["csv", "jsonl", "json"], default=None)
+    import_parser.add_argument("--upsert", action="store_true", help="replace rows with the same key")
+    import_parser.add_argument("--dry-run", action="store_true", help="validate and insert, then roll back")
+    import_parser.add_argument("--batch-size", type=int, default=1000)
+    export_parser = commands.add_parser("export", help="write every record of a table to a file")
+    export_parser.add_argument("table", choices=sorted(TABLES))
+    export_parser.add_argument("file", help="csv, jsonl or json file, - for standard output")
+    export_parser.add_argument("--format", choices=["csv", "jsonl", "json"], default=None)
+    commands.add_parser("migrate", help="upgrade the database to the current schema in place")
+    commands.add_parser("check", help="fail if a query reads a whole table without an index")
+    columns_parser = commands.add_parser("columns", help="write the locations to a file the node can memory-map (~location_file)")
+    columns_parser.add_argument("file")
+    options = parser.parse_args(arguments)
+    if options.command is None:
+        parser.print_help()
+        return 2
+
+    database_handler = DatabaseHandler(filename=options.database)
+    try:
+        if options.command == "migrate":
+            version = database_handler.migrate()
+            sys.stderr.write("Cyborg Navigation: Database schema version " + str(version) + "...\n")
+            return 0 if version == SCHEMA_VERSION else 1
+        if options.command == "check":
+            scans = database_handler.check_query_plans()
+            for name, detail in scans:
+                sys.stderr.write("Cyborg Navigation: Query " + name + " is not indexed - " + detail + "...\n")
+            return 1 if len(scans) > 0 else 0
+        if options.command == "columns":
+            database_handler.migrate()
+            count = database_handler.write_location_columns(options.file)
+            sys.stderr.write("Cyborg Navigation: Wrote " + str(count) + " locations to " + options.file + "...\n")
+            return 0
+        table = TABLES[options.table]
+        if options.command == "import":
+            database_handler.create()
+            count = database_handler.import_records(table, read_records(options.file, options.format), upsert=options.upsert, dry_run=options.dry_run, batch_size=options.batch_size)
+            if count is None:
+                return 1
+            sys.stderr.write("Cyborg Navigation: " + ("Validated " if options.dry_run else "Imported ") + str(count) + " " + options.table + " records...\n")
+        else:
+            count = write_records(options.file, table, database_handler.export_records(table), options.format)
+            sys.stderr.write("Cyborg Navigation: Exported " + str(count) + " " + options.table + " records...\n")
+        return 0
+    finally:
+        database_handler.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import datetime
+import sys
+import threading
+import time
+import traceback
+import rospy
+from databasehandler import DatabaseHandler, SQL_ADD_TRAVEL
+from databaseexecutor import DatabaseExecutor, DatabaseTimeout
+from navigationmetrics import Metrics, timer, CALLBACK_SECONDS
+from navigationrecorder import Recorder
+from traveltimes import TravelTimes
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+
+class NavigationFleet(object):
+    """NavigationFleet
+
+    What the robots served by one process share: the metrics, one
+    DatabaseHandler (so one snapshot of the locations, events and
+    responses), one DatabaseExecutor, one scheduler thread and one location
+    tracker thread. A robot is a NavigationServer made with the fleet and a
+    namespace, it only adds its action servers, subscribers and state.
+    The travel times learned from the moves of every robot are shared too,
+    and so is the Recorder when a record directory is given.
+
+    The scheduler evaluates every robot that is due or was woken in one
+    pass, and looks up the ongoing event and the next event boundary once
+    per map instead of once per robot. A NavigationServer made without a
+    fleet makes a fleet of its own, so a single robot runs the same code."""
+
+    query_deadline = 0.5 # (s) Longest wait for a database lookup, lookups still queued after it are dropped
+    metrics_period = 10 # (s) How often the metrics are published on /diagnostics and written to the metrics file
+    scheduler_idle_timeout = 60 # (s) Longest time the scheduler sleeps without being woken
+
+    def __init__(self, database_file="", metrics_file="", location_file="", record_directory=""):
+        self.metrics = Metrics()
+        self.metrics_file = metrics_file # Prometheus text file, written every metrics_period if set
+        self.servers = [] # NavigationServer of every robot
+        self.is_running = True
+        self.scheduler_condition = threading.Condition() # Shared by the servers, see NavigationServer.wake_scheduler()
+        self.tracker_condition = threading.Condition() # Shared by the location trackers of the servers
+        self.database_handler = DatabaseHandler(filename=database_file, metrics=self.metrics, location_file=location_file) # location_file: see DatabaseHandler
+        self.database_handler.add_change_listener(self.wake_scheduler)
+        self.database_handler.migrate() # Upgrades the schema in place before anything reads it
+        self.database_executor = DatabaseExecutor(self.database_handler) # Database work runs here, not on the subscriber and action server threads
+        self.database_executor.start()
+        self.travel_times = TravelTimes() # Learned from every recorded move, see record_travel()
+        self.recorder = None # Recorder of the poses, locations, events and decisions of every robot, None to not record
+        if record_directory != "":
+            self.recorder = Recorder(record_directory, metrics=self.metrics)
+            self.recorder.start()
+        self.database_executor.submit(None, self.load_travel_times)
+        self.diagnostics_publisher = rospy.Publisher("/diagnostics", DiagnosticArray, queue_size=10)
+        rospy.on_shutdown(self.shutdown)
+        self.scheduler_thread = threading.Thread(target=self.scheduler, name="NavigationFleet scheduler")
+        self.scheduler_thread.daemon = True # Thread terminates when main thread terminates
+        self.scheduler_thread.start()
+        self.tracker_thread = threading.Thread(target=self.track, name="NavigationFleet tracker")
+        self.tracker_thread.daemon = True
+        self.tracker_thread.start()
+        self.metrics_timer = rospy.Timer(rospy.Duration(self.metrics_period), self.publish_metrics)
+
+    # Adds the robot, its location tracker is run by the tracker thread and its scheduling by the scheduler thread
+    def add(self, server):
+        with self.tracker_condition:
+            self.servers.append(server)
+        self.wake_scheduler()
+
+    # Wakes the states of every robot before the database goes away, so none of them waits on it
+    def shutdown(self):
+        self.is_running = False
+        self.wake_scheduler()
+        for server in list(self.servers):
+            server.signal_state()
+        with self.tracker_condition:
+            self.tracker_condition.notify_all()
+        self.database_executor.shutdown()
+        self.database_handler.close()
+        if self.recorder is not None:
+            self.recorder.stop()
+
+    # Runs the database lookup on the database executor and waits for it, returns None if it takes longer than query_deadline
+    # or fails (e.g. a malformed row), so an error is logged instead of ending the action server callback that asked
+    def lookup(self, function, **keywords):
+        try:
+            return self.database_executor.submit(self.query_deadline, function, **keywords).result(self.query_deadline)
+        except DatabaseTimeout as e:
+            rospy.logwarn("NavigationFleet: " + str(e))
+            return None
+        except Exception:
+            sys.stderr.write("NavigationFleet: Unable to lookup() " + getattr(function, "__name__", "call") + "...\n" + traceback.format_exc())
+            return None
+
+    # Adds every succeeded move in the database to the travel times, runs on the database executor at start
+    def load_travel_times(self):
+        count = 0
+        for from_location, to_location, duration in self.database_handler.get_travel_times():
+            self.travel_times.add(from_location, to_location, duration)
+            count += 1
+        rospy.logdebug("NavigationFleet: Loaded " + str(count) + " travel times.")
+
+    # Appends the move to the Travel table and, if it succeeded, counts it in the travel times. from_location may be None
+    def record_travel(self, robot_map_name, from_location, to_location, start_date, duration, outcome):
+        if outcome == "succeeded":
+            self.travel_times.add(from_location, to_location, duration)
+        self.database_executor.execute(None, SQL_ADD_TRAVEL, (robot_map_name, from_location, to_location, start_date, duration, outcome))
+
+    # Makes the scheduler evaluate every robot now, called when the database changes
+    def wake_scheduler(self):
+        with self.scheduler_condition:
+            for server in self.servers:
+                server.scheduler_wakeup = True
+            self.scheduler_condition.notify()
+
+    # Thread, evaluates the robots that asked for it (see NavigationServer.schedule()) and sleeps until the next one is due or one is woken
+    def scheduler(self): # Threaded
+        while not rospy.is_shutdown() and self.is_running:
+            with self.scheduler_condition:
+                now = time.time()
+                due = [server for server in self.servers if server.scheduler_wakeup or server.scheduler_due <= now]
+                if len(due) == 0:
+                    timeout = min([server.scheduler_due for server in self.servers] + [now + self.scheduler_idle_timeout]) - now
+                    self.scheduler_condition.wait(max(timeout, 0))
+                    continue
+                for server in due:
+                    server.scheduler_wakeup = False
+            started = timer()
+            by_map = {}
+            for server in due:
+                by_map.setdefault(server.map_name, []).append(server)
+            for map_name, servers in by_map.items():
+                current_date = datetime.datetime.now()
+                try: # A lookup that misses the deadline is not "no event", the map is evaluated again soon instead
+                    event_future = self.database_executor.submit(self.query_deadline, self.database_handler.search_ongoing_events, robot_map_name=map_name, current_date=current_date)
+                    boundary_future = self.database_executor.submit(self.query_deadline, self.database_handler.next_event_boundary, robot_map_name=map_name, current_date=current_date)
+                    event = event_future.result(self.query_deadline)
+                    boundary = boundary_future.result(self.query_deadline)
+                except DatabaseTimeout as e:
+                    rospy.logwarn("NavigationFleet: " + str(e))
+                    self.retry_later(servers)
+                    continue
+                except Exception: # E.g. a malformed event or schedule, the thread is shared by every robot so it must keep running
+                    sys.stderr.write("NavigationFleet: Unable to look up the events of " + map_name + "...\n" + traceback.format_exc())
+                    self.retry_later(servers)
+                    continue
+                for server in servers:
+                    try:
+                        timeout = server.schedule(current_date, event, boundary)
+                    except Exception:
+                        sys.stderr.write("NavigationFleet: Unable to schedule() " + server.namespace + "...\n" + traceback.format_exc())
+                        timeout = server.scheduler_retry_timeout
+                    server.scheduler_due = time.time() + max(timeout, 0)
+            self.metrics.observe(CALLBACK_SECONDS, "scheduler", timer() - started)
+
+    # Makes the scheduler evaluate the robots again after their scheduler_retry_timeout
+    def retry_later(self, servers):
+        for server in servers:
+            server.scheduler_due = time.time() + server.scheduler_retry_timeout
+
+    # Thread, resolves the latest position of every robot whose location tracker has one waiting
+    def track(self): # Threaded
+        while True:
+            with self.tracker_condition:
+                pending = []
+                while self.is_running:
+                    pending = [(server.location_tracker, server.location_tracker.take()) for server in self.servers if server.location_tracker.pending is not None]
+                    if len(pending) > 0:
+                        break
+                    self.tracker_condition.wait()
+                if not self.is_running:
+                    return
+            for tracker, (x, y) in pending:
+                try:
+                    tracker.track(x, y)
+                except Exception:
+                    sys.stderr.write("NavigationFleet: Unable to track() position...\n" + traceback.format_exc())
+
+    # Publishes the metrics on /diagnostics and writes them to the metrics file, called by a rospy.Timer
+    def publish_metrics(self, event=None):
+        status = DiagnosticStatus()
+        status.level = DiagnosticStatus.OK
+        status.name = "cyborg_navigation: Metrics"
+        status.hardware_id = rospy.get_name()
+        for family, series in sorted(self.metrics.snapshot().items()):
+            for label, value in sorted(series.items()):
+                if isinstance(value, dict):
+                    value = str(value["count"]) + " calls, p50 " + "%.6f" % (value["p50"] or 0.0) + " s, p99 " + "%.6f" % (value["p99"] or 0.0) + " s, total " + "%.6f" % value["sum"] + " s"
+                status.values.append(KeyValue(key=family + " " + label, value=str(value)))
+        diagnostics = DiagnosticArray()
+        diagnostics.header.stamp = rospy.Time.now()
+        diagnostics.status.append(status)
+        self.diagnostics_publisher.publish(diagnostics)
+        if self.metrics_file != "":
+            try:
+                self.metrics.write(self.metrics_file)
+            except (IOError, OSError) as e:
+                rospy.logwarn("NavigationFleet: Unable to write metrics to " + self.metrics_file + " - " + str(e))
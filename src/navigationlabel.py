@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import argparse
+import collections
+import csv
+import datetime
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+import numpy
+from databasehandler import DatabaseHandler
+from intervalindex import parse_date
+from navigationdb import open_text, decode, export_value
+from navigationrecorder import SEGMENT_SUFFIX
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+"""Cyborg Navigation Pose Labeler
+
+Runs without ROS. Labels every pose of a pose log with the location it is
+at and the event that is ongoing there, and sums up the time spent and the
+number of visits at each location.
+
+    $ python navigationlabel.py monday.csv tuesday.csv --map ntnu2.map --output labelled.csv --summary summary.json
+    $ rostopic echo -b tour.bag -p /rosarnl_node/amcl_pose > tour.csv
+    $ python navigationlabel.py tour.csv --map ntnu2.map --processes 4
+    $ python navigationlabel.py ~/navigation_records/recording-*.db --map ntnu2.map
+
+A log is a csv file with a header, either with the columns time, x and y
+(and optionally robot_map_name and robot) or as written by rostopic echo -p
+for a PoseWithCovarianceStamped topic, or a segment of the Recorder (its
+pose records). Times are seconds since the epoch (nanoseconds for %time and
+field.header.stamp) or dates, and are compared with the event dates in
+local time. The files are read in blocks of --chunk-size poses, and the
+blocks are labelled by a pool of processes with the batch lookups of the
+SpatialIndex, the events once per event boundary instead of once per pose.
+
+A pose is at the nearest location within its threshold, as with
+DatabaseHandler.find_locations() (there is no hysteresis as in the
+LocationTracker). The poses of each robot must be in time order. A visit
+starts at the first pose at a location, and the time between two poses at
+the same location is dwell time unless it is longer than --max-gap, then
+the pose starts a new visit."""
+
+TIME_COLUMNS = [("time", 1.0), ("%time", 1e-9), ("field.header.stamp", 1e-9), ("stamp", 1.0), ("timestamp", 1.0)] # (column, seconds per unit)
+X_COLUMNS = ["x", "field.pose.pose.position.x", "field.pose.position.x", "field.position.x"]
+Y_COLUMNS = ["y", "field.pose.pose.position.y", "field.pose.position.y", "field.position.y"]
+MAP_COLUMNS = ["robot_map_name", "map"]
+ROBOT_COLUMNS = ["robot", "namespace"]
+SQL_GET_POSES = "SELECT time, x, y, robot FROM Record WHERE kind = 'pose' ORDER BY rowid"
+OUTPUT_COLUMNS = ["time", "x", "y", "robot_map_name", "robot", "location_name", "event_name"]
+
+labeler = None # PoseLabeler of the worker process, see start_worker()
+
+
+def first_column(header, candidates):
+    for candidate in candidates:
+        if candidate in header:
+            return header.index(candidate)
+    return None
+
+
+# Column positions of the csv header as {"time", "x", "y", "map", "robot", "scale"}, raises ValueError if a pose column is missing
+def csv_layout(header):
+    header = [column.strip().lower() for column in header]
+    layout = {"scale": 1.0}
+    for column, scale in TIME_COLUMNS:
+        if column in header:
+            layout["time"] = header.index(column)
+            layout["scale"] = scale
+            break
+    layout["x"] = first_column(header, X_COLUMNS)
+    layout["y"] = first_column(header, Y_COLUMNS)
+    layout["map"] = first_column(header, MAP_COLUMNS)
+    layout["robot"] = first_column(header, ROBOT_COLUMNS)
+    if layout.get("time") is None or layout["x"] is None or layout["y"] is None:
+        raise ValueError("Expected a time, x and y column, got: " + ",".join(header))
+    return layout
+
+
+# Yields the blocks of the files in order as (layout, lines or rows), lines of a csv file and (time, x, y, robot) rows of a recording
+def read_blocks(paths, chunk_size):
+    for path in paths:
+        if path.endswith(SEGMENT_SUFFIX):
+            connection = sqlite3.connect(path)
+            try:
+                cursor = connection.execute(SQL_GET_POSES)
+                layout = {"time": 0, "x": 1, "y": 2, "map": None, "robot": 3, "scale": 1.0, "rows": True}
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if len(rows) == 0:
+                        break
+                    yield layout, rows
+            finally:
+                connection.close()
+            continue
+        stream = open_text(path, "r")
+        try:
+            layout = csv_layout(next(csv.reader([stream.readline()])))
+            lines = []
+            for line in stream:
+                lines.append(line)
+                if len(lines) >= chunk_size:
+                    yield layout, lines
+                    lines = []
+            if len(lines) > 0:
+                yield layout, lines
+        finally:
+            stream.close()
+
+
+# Seconds since the epoch of a local datetime
+def epoch(date):
+    return time.mktime(date.timetuple()) + date.microsecond / 1e6
+
+
+def parse_times(values, scale):
+    try:
+        return numpy.array(values, dtype=numpy.float64) * scale
+    except ValueError: # Dates
+        dates = [parse_date(value) for value in values]
+        if None in dates:
+            raise ValueError("Invalid time: " + str(values[dates.index(None)]))
+        return numpy.array([epoch(date) for date in dates], dtype=numpy.float64)
+
+
+class PoseBlock(object):
+    """PoseBlock
+
+    The poses of one block as columns: times (s), xs, ys, and the map and
+    robot of each pose (object arrays, or None when the log has no such
+    column). location_names and event_names are filled in by the
+    PoseLabeler, None where there is no location or event."""
+
+    def __init__(self, layout, data):
+        rows = data if layout.get("rows") else [row for row in csv.reader(data) if len(row) > 0]
+        columns = list(zip(*rows)) if len(rows) > 0 else collections.defaultdict(tuple)
+        self.times = parse_times(columns[layout["time"]], layout["scale"])
+        self.xs = numpy.array(columns[layout["x"]], dtype=numpy.float64)
+        self.ys = numpy.array(columns[layout["y"]], dtype=numpy.float64)
+        self.maps = self.text_column(columns, layout["map"])
+        self.robots = self.text_column(columns, layout["robot"])
+        self.location_names = None
+        self.event_names = None
+
+    def text_column(self, columns, index):
+        if index is None:
+            return None
+        column = numpy.empty(len(columns[index]), dtype=object)
+        column[:] = [decode(value) if value is not None else "" for value in columns[index]]
+        return column
+
+    def __len__(self):
+        return len(self.times)
+
+    # The labelled poses as csv rows, in the order of OUTPUT_COLUMNS
+    def rows(self, default_map):
+        count = len(self)
+        maps = [export_value(name) for name in self.maps] if self.maps is not None else [default_map] * count
+        robots = [export_value(name) for name in self.robots] if self.robots is not None else [""] * count
+        location_names = [export_value(name or "") for name in self.location_names]
+        event_names = [export_value(name or "") for name in self.event_names]
+        return zip(self.times.tolist(), self.xs.tolist(), self.ys.tolist(), maps, robots, location_names, event_names)
+
+
+class PoseLabeler(object):
+    """PoseLabeler
+
+    Labels the poses of a PoseBlock with the locations and events of the
+    database, and counts the dwell time and visits of each location in the
+    block. The counts of the blocks of a log are added up by a
+    LocationSummary."""
+
+    def __init__(self, database_file, location_file="", default_map="", max_gap=60.0):
+        self.database_handler = DatabaseHandler(filename=database_file, location_file=location_file)
+        self.default_map = default_map
+        self.max_gap = max_gap # (s)
+        self.location_names = {} # robot_map_name -> (SpatialIndex, object array of its location names with None last, so index -1 is None)
+
+    def close(self):
+        self.database_handler.close()
+
+    # Labels the block, returns (block, counts) where counts are the arguments of LocationSummary.add()
+    def label(self, block):
+        count = len(block)
+        block.location_names = numpy.empty(count, dtype=object)
+        block.event_names = numpy.empty(count, dtype=object)
+        codes = numpy.full(count, -1, dtype=numpy.int64) # Position of the location in names, -1 for none
+        names = []
+        maps = block.maps if block.maps is not None else numpy.array([self.default_map], dtype=object)
+        for robot_map_name in set(maps.tolist()):
+            if block.maps is not None:
+                selected = numpy.flatnonzero(block.maps == robot_map_name)
+            else:
+                selected = numpy.arange(count)
+            snapshot = self.database_handler.get_snapshot()
+            spatial_index = snapshot.spatial_index(robot_map_name)
+            cached_index, location_names = self.location_names.get(robot_map_name, (None, None))
+            if cached_index is not spatial_index: # First block of the map, or the snapshot was reloaded
+                location_names = numpy.empty(len(spatial_index.locations) + 1, dtype=object)
+                location_names[:-1] = [location.location_name for location in spatial_index.locations]
+                self.location_names[robot_map_name] = (spatial_index, location_names)
+            indices = spatial_index.batch_indices_within_threshold(block.xs[selected], block.ys[selected])
+            block.location_names[selected] = location_names[indices]
+            codes[selected] = numpy.where(indices >= 0, indices + len(names), -1)
+            names.extend(location_names[:-1].tolist())
+            block.event_names[selected] = self.event_names(snapshot.event_index(robot_map_name), block.times[selected])
+        return block, self.count(block, codes, names)
+
+    # The name of the latest ongoing event at each time. The event index is asked once per event boundary between the first and last time
+    def event_names(self, event_index, times):
+        result = numpy.empty(len(times), dtype=object)
+        if len(times) == 0:
+            return result
+        low = float(times.min()) - 1.0
+        high = float(times.max()) + 1.0
+        boundaries = []
+        date = datetime.datetime.fromtimestamp(low)
+        while True:
+            date = event_index.next_boundary(date)
+            if date is None or epoch(date) >= high:
+                break
+            boundaries.append(epoch(date))
+        boundaries = numpy.array(boundaries, dtype=numpy.float64)
+        # Between two boundaries the same events are ongoing, events start and end strictly after and before their dates so a time on a boundary is asked for on its own
+        edges = numpy.concatenate([[low], boundaries, [high]])
+        labels = [self.event_name(event_index, (start + end) / 2.0) for start, end in zip(edges[:-1], edges[1:])]
+        segments = numpy.searchsorted(boundaries, times, side="left")
+        result[:] = numpy.array(labels + [None], dtype=object)[segments]
+        if len(boundaries) > 0:
+            on_boundary = numpy.flatnonzero(boundaries[numpy.minimum(segments, len(boundaries) - 1)] == times)
+            for i in on_boundary:
+                result[i] = self.event_name(event_index, float(times[i]))
+        return result
+
+    def event_name(self, event_index, t):
+        ongoing = event_index.latest_active(datetime.datetime.fromtimestamp(t))
+        return ongoing[2].event_name if ongoing is not None else None
+
+    # Dwell time and visits of each location in the block, with the first and last labelled pose of each robot
+    def count(self, block, codes, names):
+        count = len(block)
+        robots = block.robots if block.robots is not None else numpy.array([""] * count, dtype=object)
+        if count == 0:
+            return {}, {}, {}, 0, 0
+        robot_names, robot_numbers = numpy.unique(robots, return_inverse=True)
+        order = numpy.argsort(robot_numbers, kind="mergesort") # Stable, so the poses of each robot stay in log order
+        robot_numbers = robot_numbers[order]
+        codes = codes[order]
+        times = block.times[order]
+        first = numpy.ones(count, dtype=bool) # First pose of a robot
+        first[1:] = robot_numbers[1:] != robot_numbers[:-1]
+        gaps = numpy.zeros(count)
+        gaps[1:] = times[1:] - times[:-1]
+        located = codes >= 0
+        previous = numpy.full(count, -1, dtype=numpy.int64)
+        previous[1:] = codes[:-1]
+        staying = located & ~first & (codes == previous) & (gaps >= 0) & (gaps <= self.max_gap)
+        arriving = located & ~staying
+        dwell = numpy.bincount(codes[staying], weights=gaps[staying], minlength=len(names))
+        visits = numpy.bincount(codes[arriving], minlength=len(names))
+        locations = {}
+        for code in numpy.flatnonzero((dwell > 0) | (visits > 0)):
+            locations[names[code]] = [float(dwell[code]), int(visits[code])]
+        first_poses = {}
+        last_poses = {}
+        for number in numpy.flatnonzero(first):
+            robot = robot_names[robot_numbers[number]]
+            first_poses[robot] = (float(times[number]), names[codes[number]] if codes[number] >= 0 else None)
+        last = numpy.ones(count, dtype=bool)
+        last[:-1] = first[1:]
+        for number in numpy.flatnonzero(last):
+            robot = robot_names[robot_numbers[number]]
+            last_poses[robot] = (float(times[number]), names[codes[number]] if codes[number] >= 0 else None)
+        return locations, first_poses, last_poses, count, int(numpy.count_nonzero(located))
+
+
+class LocationSummary(object):
+    """LocationSummary
+
+    The dwell time (s) and visits of each location over a whole log, added
+    up block by block in log order. A visit that spans two blocks is
+    counted once, its dwell time includes the gap between the blocks."""
+
+    def __init__(self, max_gap=60.0):
+        self.max_gap = max_gap # (s)
+        self.locations = collections.defaultdict(lambda: [0.0, 0]) # location_name -> [dwell, visits]
+        self.last_poses = {} # robot -> (time, location_name) of the last pose added
+        self.poses = 0
+        self.located = 0
+
+    def add(self, locations, first_poses, last_poses, poses, located):
+        for location_name, (dwell, visits) in locations.items():
+            self.locations[location_name][0] += dwell
+            self.locations[location_name][1] += visits
+        for robot, (first_time, location_name) in first_poses.items():
+            if robot not in self.last_poses or location_name is None:
+                continue
+            last_time, last_location_name = self.last_poses[robot]
+            if last_location_name == location_name and 0 <= first_time - last_time <= self.max_gap:
+                self.locations[location_name][0] += first_time - last_time
+                self.locations[location_name][1] -= 1 # The block counted it as an arrival
+        self.last_poses.update(last_poses)
+        self.poses += poses
+        self.located += located
+
+    def result(self):
+        locations = dict((location_name, {"dwell_seconds": dwell, "visits": visits}) for location_name, (dwell, visits) in self.locations.items())
+        return {"poses": self.poses, "located": self.located, "locations": locations}
+
+
+def start_worker(database_file, location_file, default_map, max_gap):
+    global labeler
+    labeler = PoseLabeler(database_file, location_file, default_map, max_gap)
+
+
+def label_block(block):
+    return labeler.label(PoseBlock(*block))
+
+
+# Labels the blocks in order, by a pool of processes with at most 2 blocks per process waiting, so the log is never read into memory as a whole
+def label_blocks(blocks, processes, worker_arguments):
+    if processes <= 1:
+        start_worker(*worker_arguments)
+        try:
+            for block in blocks:
+                yield label_block(block)
+        finally:
+            labeler.close()
+        return
+    pool = multiprocessing.Pool(processes, initializer=start_worker, initargs=worker_arguments)
+    try:
+        pending = collections.deque()
+        for block in blocks:
+            pending.append(pool.apply_async(label_block, (block,)))
+            if len(pending) >= processes * 2:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Label pose logs with the locations and events of the Cyborg Navigation database.")
+    parser.add_argument("files", nargs="+", help="csv pose logs or Recorder segments (.db), in time order")
+    parser.add_argument("--database", default=os.path.join(os.path.expanduser("~"), "navigation.db"), help="database file (default ~/navigation.db)")
+    parser.add_argument("--location-file", default="", help="location file to memory-map in every process, see navigationdb.py columns")
+    parser.add_argument("--map", default="ntnu2.map", help="map of the poses when the log has no robot_map_name column")
+    parser.add_argument("--output", default=None, help="csv file of the labelled poses, - for standard output")
+    parser.add_argument("--summary", default="-", help="JSON file of the dwell time and visits of each location, - for standard output")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="poses per block")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(), help="labelling processes, 1 to label in this process")
+    parser.add_argument("--max-gap", type=float, default=60.0, help="(s) longest time between two poses of one visit")
+    options = parser.parse_args(arguments)
+    for path in options.files:
+        if not os.path.exists(path):
+            sys.stderr.write("Cyborg Navigation: No such file " + path + "...\n")
+            return 1
+    if not os.path.exists(options.database):
+        sys.stderr.write("Cyborg Navigation: No such database " + options.database + "...\n")
+        return 1
+
+    started = time.time()
+    summary = LocationSummary(options.max_gap)
+    output = None
+    writer = None
+    if options.output is not None:
+        output = open_text(options.output, "w")
+        writer = csv.writer(output)
+        writer.writerow(OUTPUT_COLUMNS)
+    try:
+        blocks = read_blocks(options.files, max(options.chunk_size, 1))
+        for block, counts in label_blocks(blocks, options.processes, (options.database, options.location_file, options.map, options.max_gap)):
+            summary.add(*counts)
+            if writer is not None:
+                writer.writerows(block.rows(options.map))
+    except (ValueError, IndexError, sqlite3.Error) as e:
+        sys.stderr.write("Cyborg Navigation: Unable to label poses - " + str(e) + "...\n")
+        return 1
+    finally:
+        if output is not None and output is not sys.stdout:
+            output.close()
+    seconds = time.time() - started
+    result = summary.result()
+    result["seconds"] = seconds
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if options.summary == "-":
+        sys.stdout.write(text + "\n")
+    else:
+        with open(options.summary, "w") as stream:
+            stream.write(text + "\n")
+    sys.stderr.write("Cyborg Navigation: Labelled " + str(summary.poses) + " poses (" + str(summary.located) + " at a location) in " + str(round(seconds, 2)) + " s...\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import bisect
+import functools
+import os
+import threading
+import time
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+timer = getattr(time, "perf_counter", time.time) # (s) Python 2 has no monotonic clock
+
+# Metric families: name -> (type, label names, help)
+CALLBACK_SECONDS = "navigation_callback_seconds"
+QUERY_SECONDS = "navigation_query_seconds"
+STATE_SECONDS = "navigation_state_seconds"
+EVENTS_TOTAL = "navigation_events_total"
+DEADLINES_TOTAL = "navigation_database_deadlines_total"
+STARTUP_SECONDS = "navigation_startup_seconds"
+RECORDS_TOTAL = "navigation_records_total"
+FAMILIES = {
+    CALLBACK_SECONDS: ("histogram", ["callback"], "Time spent in subscriber, action client and scheduler callbacks."),
+    QUERY_SECONDS: ("histogram", ["query"], "Time spent in DatabaseHandler queries."),
+    STATE_SECONDS: ("histogram", ["state", "outcome"], "Time from the start of a state until it succeeded, was preempted, aborted or timed out."),
+    EVENTS_TOTAL: ("counter", ["event"], "Events published to the state machine."),
+    DEADLINES_TOTAL: ("counter", ["query"], "Database calls dropped because their deadline passed before they ran."),
+    STARTUP_SECONDS: ("histogram", ["phase"], "Time spent in each phase of the node start."),
+    RECORDS_TOTAL: ("counter", ["outcome"], "Records written to the recording segments, or dropped because the writer fell behind."),
+}
+
+# (s) Upper bounds of the histogram buckets, 1 us to 1000 s
+BUCKETS = [float(multiplier + "e" + str(exponent)) for exponent in range(-6, 3) for multiplier in ["1", "2.5", "5"]] + [1000.0]
+
+
+class Histogram(object):
+    """Histogram
+
+    Counts observations in fixed buckets. observe() is a bisect and three
+    additions under a lock, so it can be called on every message."""
+
+    __slots__ = ["bounds", "counts", "count", "sum", "lock"]
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    # Returns (counts, count, sum) as one consistent copy
+    def read(self):
+        with self.lock:
+            return list(self.counts), self.count, self.sum
+
+    # Estimates the quantile by interpolating inside the bucket that holds it, like Prometheus' histogram_quantile()
+    def quantile(self, fraction, counts=None, count=None):
+        if counts is None:
+            counts, count, total = self.read()
+        if count == 0:
+            return None
+        rank = fraction * count
+        seen = 0
+        for i, bucket in enumerate(counts):
+            if seen + bucket >= rank and bucket > 0:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / bucket
+            seen += bucket
+        return self.bounds[-1]
+
+
+class Metrics(object):
+    """Metrics
+
+    Counters and latency histograms keyed by (family, label). A label is a
+    string, or a tuple for families with several label names. Read with
+    snapshot(), or render() in the Prometheus text format."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {} # (family, label) -> Histogram
+        self.counters = {} # (family, label) -> count
+        self.started = time.time()
+
+    def histogram(self, family, label):
+        histogram = self.histograms.get((family, label))
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault((family, label), Histogram(self.buckets))
+        return histogram
+
+    def observe(self, family, label, seconds):
+        self.histogram(family, label).observe(seconds)
+
+    def increment(self, family, label, amount=1):
+        with self.lock:
+            self.counters[(family, label)] = self.counters.get((family, label), 0) + amount
+
+    # Returns {family: {label: {"count", "sum", "p50", "p99"}}} for histograms and {family: {label: count}} for counters
+    def snapshot(self):
+        with self.lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+        families = {}
+        for (family, label), histogram in histograms:
+            counts, count, total = histogram.read()
+            families.setdefault(family, {})[label_text(label)] = {"count": count, "sum": total, "p50": histogram.quantile(0.50, counts, count), "p99": histogram.quantile(0.99, counts, count)}
+        for (family, label), count in counters:
+            families.setdefault(family, {})[label_text(label)] = count
+        return families
+
+    # Returns every metric in the Prometheus text exposition format
+    def render(self):
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        lines = []
+        described = set()
+        for (family, label), histogram in histograms:
+            if family not in described:
+                lines.extend(describe(family, "histogram"))
+                described.add(family)
+            labels = label_pairs(family, label)
+            counts, count, total = histogram.read()
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + [None], counts):
+                cumulative += bucket
+                lines.append(family + "_bucket{" + ",".join(labels + ['le="' + ("+Inf" if bound is None else repr(bound)) + '"']) + "} " + str(cumulative))
+            lines.append(family + "_sum{" + ",".join(labels) + "} " + repr(total))
+            lines.append(family + "_count{" + ",".join(labels) + "} " + str(count))
+        for (family, label), count in counters:
+            if family not in described:
+                lines.extend(describe(family, "counter"))
+                described.add(family)
+            lines.append(family + "{" + ",".join(label_pairs(family, label)) + "} " + str(count))
+        return "\n".join(lines) + "\n"
+
+    # Writes render() to the file, replacing it in one step so a scraper never reads half a file
+    def write(self, path):
+        temporary = path + ".tmp"
+        with open(temporary, "w") as output:
+            output.write(self.render())
+        os.rename(temporary, path)
+
+
+class StartupTimer(object):
+    """StartupTimer
+
+    Times the phases of the node start. mark() ends the running phase and
+    starts the next, add() records a phase that ran alongside the others
+    (e.g. warming the caches in the background)."""
+
+    def __init__(self):
+        self.started = timer()
+        self.last = self.started
+        self.lock = threading.Lock()
+        self.phases = [] # (phase, seconds) in the order they ended
+
+    def mark(self, phase):
+        now = timer()
+        with self.lock:
+            self.phases.append((phase, now - self.last))
+            self.last = now
+
+    def add(self, phase, seconds):
+        with self.lock:
+            self.phases.append((phase, seconds))
+
+    # (s) Since the timer was made
+    def elapsed(self):
+        return timer() - self.started
+
+    # Observes every phase in the STARTUP_SECONDS family
+    def record(self, metrics):
+        with self.lock:
+            phases = list(self.phases)
+        for phase, seconds in phases:
+            metrics.observe(STARTUP_SECONDS, phase, seconds)
+
+    # e.g. "imports 0.215 s, init_node 0.012 s, fleet 0.030 s"
+    def report(self):
+        with self.lock:
+            phases = list(self.phases)
+        return ", ".join(phase + " " + "%.3f" % seconds + " s" for phase, seconds in phases)
+
+
+def label_text(label):
+    return "/".join(label) if isinstance(label, tuple) else label
+
+
+def label_pairs(family, label):
+    names = FAMILIES.get(family, (None, ["name"], ""))[1]
+    values = label if isinstance(label, tuple) else (label, )
+    return [name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for name, value in zip(names, values)]
+
+
+def describe(family, kind):
+    return ["# HELP " + family + " " + FAMILIES.get(family, (None, None, ""))[2], "# TYPE " + family + " " + kind]
+
+
+# Decorates a method so its duration is observed in the family, labelled with the method name. Costs nothing while self.metrics is None
+def timed(family, label=None):
+    def decorator(function):
+        name = label if label is not None else function.__name__
+        @functools.wraps(function)
+        def wrapper(self, *arguments, **keywords):
+            metrics = self.metrics
+            if metrics is None:
+                return function(self, *arguments, **keywords)
+            started = timer()
+            try:
+                return function(self, *arguments, **keywords)
+            finally:
+                metrics.observe(family, name, timer() - started)
+        return wrapper
+    return decorator
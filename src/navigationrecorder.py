@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import collections
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from navigationmetrics import RECORDS_TOTAL
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+SEGMENT_PREFIX = "recording-"
+SEGMENT_SUFFIX = ".db"
+SQL_CREATE_RECORD = "CREATE TABLE IF NOT EXISTS Record(time REAL, kind TEXT, robot TEXT, x REAL, y REAL, name TEXT, data TEXT)"
+SQL_ADD_RECORD = "INSERT INTO Record (time, kind, robot, x, y, name, data) VALUES (?,?,?,?,?,?,?)"
+
+
+class Recorder(object):
+    """Recorder
+
+    Records poses, location changes, events and planing decisions for later
+    analysis. record() appends a tuple to a bounded ring buffer and returns,
+    a thread of its own writes the buffer in batches, one transaction per
+    batch, to SQLite segment files in the directory (table Record, see
+    SQL_CREATE_RECORD). A segment is closed when it grows past segment_bytes
+    and the oldest segments are deleted while all of them take more than
+    max_bytes. The segments are separate from the navigation database, so
+    recording never makes the DatabaseHandler reload its snapshot.
+
+    When the disk falls behind the buffer fills up and the oldest records
+    are dropped, record() never waits. Dropped and written records are
+    counted in the RECORDS_TOTAL metric."""
+
+    capacity = 65536 # Records kept in memory, the oldest are dropped beyond it
+    batch_size = 4096 # Records written per transaction at most, the thread is woken early when this many are waiting
+    flush_period = 1.0 # (s) Longest time a record waits before it is written
+    segment_bytes = 64 * 1024 * 1024 # A new segment is started when the current one is larger
+    max_bytes = 1024 * 1024 * 1024 # The oldest segments are deleted while all segments take more
+
+    def __init__(self, directory, metrics=None, clock=time.time):
+        self.directory = directory
+        self.metrics = metrics
+        self.clock = clock # Returns the time (s) records are stamped with
+        self.buffer = collections.deque(maxlen=self.capacity) # Appending to a full deque drops the oldest record
+        self.dropped = 0 # Records dropped by the ring buffer, counted by record() without a lock, so approximate
+        self.written = 0
+        self.wakeup = threading.Event()
+        self.is_running = False
+        self.thread = None
+        self.connection = None # Connection to the current segment, only used by the recorder thread
+        self.segment = None # Path of the current segment
+        self.segment_number = 0
+
+    def start(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, name="Recorder")
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Writes what is left in the buffer and closes the segment, waits at most timeout (s)
+    def stop(self, timeout=5.0):
+        self.is_running = False
+        self.wakeup.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    # Adds the record to the buffer, called from the callbacks. kind is e.g. "pose", robot the namespace of the robot
+    def record(self, kind, robot, x=None, y=None, name=None, data=None):
+        buffer = self.buffer
+        if len(buffer) >= self.capacity:
+            self.dropped += 1
+        buffer.append((self.clock(), kind, robot, x, y, name, data))
+        if len(buffer) >= self.batch_size and not self.wakeup.is_set():
+            self.wakeup.set()
+
+    def run(self): # Threaded
+        dropped = 0
+        while True:
+            self.wakeup.wait(self.flush_period)
+            self.wakeup.clear()
+            is_running = self.is_running # Read before the flush, so the records added before stop() are written
+            try:
+                self.flush()
+            except Exception:
+                sys.stderr.write("Recorder: Unable to flush()...\n" + traceback.format_exc())
+            if self.metrics is not None and self.dropped != dropped:
+                self.metrics.increment(RECORDS_TOTAL, "dropped", self.dropped - dropped)
+                dropped = self.dropped
+            if not is_running:
+                self.close()
+                return
+
+    # Writes the buffer in batches of at most batch_size records
+    def flush(self):
+        buffer = self.buffer
+        while len(buffer) > 0:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(buffer.popleft())
+            except IndexError:
+                pass # Buffer is empty
+            self.write(batch)
+
+    # Writes the records in one transaction, starting a new segment first if the current one is full. Records that cannot be written are dropped
+    def write(self, batch):
+        try:
+            if self.connection is None or self.size(self.segment) > self.segment_bytes:
+                self.rotate()
+            with self.connection:
+                self.connection.executemany(SQL_ADD_RECORD, batch)
+            self.written += len(batch)
+            if self.metrics is not None:
+                self.metrics.increment(RECORDS_TOTAL, "written", len(batch))
+        except (sqlite3.Error, IOError, OSError) as e:
+            self.dropped += len(batch)
+            print("Recorder: Unable to write() " + str(len(batch)) + " records - " + str(e) + "...")
+            self.close() # A new segment is tried on the next write
+
+    # Closes the current segment, opens a new one and deletes the oldest segments beyond max_bytes
+    def rotate(self):
+        self.close()
+        self.segment_number += 1
+        self.segment = os.path.join(self.directory, SEGMENT_PREFIX + time.strftime("%Y%m%d-%H%M%S") + "-" + str(os.getpid()) + "-" + str(self.segment_number) + SEGMENT_SUFFIX)
+        self.connection = sqlite3.connect(self.segment)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=OFF") # A batch lost in a power failure is acceptable, the writer falling behind is not
+        self.connection.execute(SQL_CREATE_RECORD)
+        self.delete_oldest()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except sqlite3.Error:
+                pass
+            self.connection = None
+
+    # Deletes the oldest segments (never the current one) while all segments take more than max_bytes
+    def delete_oldest(self):
+        segments = self.segments()
+        total = sum(self.size(segment) for segment in segments)
+        for segment in segments:
+            if total <= self.max_bytes:
+                break
+            if segment == self.segment:
+                continue
+            total -= self.size(segment)
+            for path in [segment, segment + "-wal", segment + "-shm"]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    # The segment files in the directory, oldest first
+    def segments(self):
+        names = [name for name in os.listdir(self.directory) if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)]
+        paths = [os.path.join(self.directory, name) for name in names]
+        return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+    # Size (bytes) of the segment with its write-ahead log
+    def size(self, segment):
+        total = 0
+        for path in [segment, segment + "-wal"]:
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
@@ -4,19 +4,22 @@ Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
 
 import threading
 import time
+import math
 import datetime
+import json
 import sys
-import roslib 
 import rospy
-import tf.transformations
 import actionlib
 from move_base_msgs.msg import MoveBaseAction, MoveBaseGoal
 import geometry_msgs
 from std_msgs.msg import String
 from std_srvs.srv import Empty
-from databasehandler import DatabaseHandler
+from databaseexecutor import DatabaseTimeout
+from locationtracker import LocationTracker
+from navigationfleet import NavigationFleet
+from navigationmetrics import timed, timer, CALLBACK_SECONDS, STATE_SECONDS, EVENTS_TOTAL
 from geometry_msgs.msg import PoseWithCovarianceStamped
-from cyborg_navigation.msg import NavigationGoToAction
+from cyborg_navigation.msg import NavigationGoToAction, NavigationGoToResult, NavigationGoToFeedback
 from cyborg_controller.msg import StateMachineAction, StateMachineGoal, StateMachineResult, StateMachineFeedback, EmotionalState, EmotionalFeedback, SystemState
 
 __author__ = "Thomas Rostrup Andersen"
@@ -25,8 +28,29 @@ __copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
 __version__ = "0.0.3"
 __all__ = []
 
+class ConnectionListener(rospy.SubscribeListener):
+	"""ConnectionListener
+
+	Calls the callback whenever a subscriber connects to or disconnects from
+	the publisher it is given to."""
+
+	def __init__(self, callback):
+		self.callback = callback
+
+	def peer_subscribe(self, topic_name, topic_publish, peer_publish):
+		self.callback()
+
+	def peer_unsubscribe(self, topic_name, num_peers):
+		self.callback()
+
+
 class NavigationServer():
-	"""NavigationServer"""
+	"""NavigationServer
+
+	One robot. Its topics and action servers are prefixed with the namespace
+	("" for a single robot). The database, the scheduler and the location
+	tracker thread belong to the NavigationFleet the robot is part of, a
+	server made without one gets a fleet of its own."""
 	
 	client_base_feedback = StateMachineFeedback()
 	client_base_result = StateMachineResult()
@@ -43,61 +67,178 @@ class NavigationServer():
 	current_y = 0.0
 	current_emotion = "neutral"
 
+	scheduler_retry_timeout = 10 # (s) How often an ongoing event is published again while the robot is elsewhere
+	scheduler_idle_timeout = 60 # (s) Longest time between two evaluations by the scheduler
+	scheduler_boundary_delay = 0.01 # (s) Events are ongoing strictly after their start, so wake just after a boundary
+
 	planing_timeout = 60 # (s)
-	moving_timeout = 1000 # (s)
+	moving_timeout = 1000 # (s) Upper bound, the timeout of a move is learned from earlier moves, see TravelTimes.timeout()
+	stall_timeout = 120 # (s) A move is given up when the robot has not moved stall_distance in this time
+	stall_distance = 0.5 # (m)
+	connection_timeout = 2 # (s) Longest wait for the controller and the speech node to subscribe before a state publishes, see wait_for_subscribers()
 	taking_timeout = 60 # (s)
-
-
-	def __init__(self, database_file=""):
-		self.scheduler_rate = rospy.Rate(1) # (hz)
-		self.server_rate = rospy.Rate(0.5) # (hz)
-
-		self.server_planing = actionlib.SimpleActionServer(rospy.get_name() + "/planing", StateMachineAction, execute_cb=self.server_planing_callback, auto_start = False)
-		self.server_moving = actionlib.SimpleActionServer(rospy.get_name() + "/moving", StateMachineAction, execute_cb=self.server_moving_callback, auto_start = False)
-		self.server_talking = actionlib.SimpleActionServer(rospy.get_name() + "/talking", StateMachineAction, execute_cb=self.server_talking_callback, auto_start = False)
-		self.server_go_to = actionlib.SimpleActionServer(rospy.get_name() + "/go_to", NavigationGoToAction, execute_cb=self.server_go_to_callback, auto_start = False)
+	feedback_period = 15 # (s) Emotional feedback while moving or wandering
+	go_to_feedback_period = 2 # (s) Status feedback to go_to clients while moving
+	tour_stops = 5 # Nearest crowded (or quiet) locations a tour is planned through, see next_tour_stop()
+
+
+	def __init__(self, database_file="", metrics_file="", map_name="", namespace="", fleet=None, location_file="", record_directory=""):
+		if fleet == None:
+			fleet = NavigationFleet(database_file=database_file, metrics_file=metrics_file, location_file=location_file, record_directory=record_directory)
+		if map_name != "":
+			self.map_name = map_name
+		self.map_requested = self.map_name # Last map asked for on the map topic, it becomes map_name once loaded
+		self.namespace = namespace # e.g. "/robot1", prefixed to every topic
+		self.fleet = fleet
+		self.metrics = fleet.metrics
+		self.recorder = fleet.recorder # None when not recording
+		self.database_handler = fleet.database_handler
+		self.database_executor = fleet.database_executor
+		self.map_warm = self.database_executor.submit(None, self.database_handler.load_map, robot_map_name=self.map_name) # Loads the map while the action servers start
+		self.state_started = {} # action server -> timer() when its current goal started
+		self.scheduler_condition = fleet.scheduler_condition
+		self.scheduler_wakeup = True # Evaluated by the scheduler as soon as it is added
+		self.scheduler_due = 0.0 # time.time() when the scheduler evaluates the robot again without being woken
+		self.scheduler_location_name = ""
+		self.ongoing_event = None # Latest ongoing event on the map when the scheduler last evaluated the robot, used in responses
+		self.state_condition = threading.Condition() # Notified by signal_state() when anything a state waits for changes
+		self.text = ""
+		self.tour = [] # LocationRecords left of the tour planned by next_tour_stop()
+		self.tour_key = None # (map_name, crowded) the tour was planned for
+		self.moved_x = self.current_x # Position when the robot last moved stall_distance
+		self.moved_y = self.current_y
+		self.moved_at = time.time()
+
+		name = namespace + rospy.get_name()
+		self.server_planing = actionlib.SimpleActionServer(name + "/planing", StateMachineAction, execute_cb=self.server_planing_callback, auto_start = False)
+		self.server_moving = actionlib.SimpleActionServer(name + "/moving", StateMachineAction, execute_cb=self.server_moving_callback, auto_start = False)
+		self.server_talking = actionlib.SimpleActionServer(name + "/talking", StateMachineAction, execute_cb=self.server_talking_callback, auto_start = False)
+		self.server_go_to = actionlib.SimpleActionServer(name + "/go_to", NavigationGoToAction, execute_cb=self.server_go_to_callback, auto_start = False)
+		self.state_names = {self.server_planing: "planing", self.server_moving: "moving", self.server_talking: "talking", self.server_go_to: "go_to"}
+		for server in self.state_names:
+			server.register_preempt_callback(self.signal_state)
 		self.server_planing.start()
 		self.server_moving.start()
 		self.server_talking.start()
 		self.server_go_to.start()
-		self.client_base = actionlib.SimpleActionClient("/rosarnl_node/move_base", MoveBaseAction)
-		self.emotion_publisher = rospy.Publisher("/cyborg_controller/emotional_feedback", EmotionalFeedback, queue_size=100)
-		self.event_publisher = rospy.Publisher("/cyborg_controller/register_event", String, queue_size=100)
-		self.speech_publisher = rospy.Publisher("/cyborg_text_to_speech/text_to_speech", String, queue_size=100)
-		self.database_handler = DatabaseHandler(filename=database_file)
-		self.location_subscriber = rospy.Subscriber("/rosarnl_node/amcl_pose", PoseWithCovarianceStamped, self.location_callback)
-		self.emotion_subscriber = rospy.Subscriber("/cyborg_controller/emotional_state", EmotionalState, self.emotion_callback, queue_size=100)
-		self.text_subscriber = rospy.Subscriber("/text_from_speech", String, self.text_callback, queue_size=100)
-		self.scheduler_thread = threading.Thread(target=self.scheduler)
-		self.scheduler_thread.daemon = True # Thread terminates when main thread terminates
-		self.scheduler_thread.start()
-		rospy.loginfo("NavigationServer: Activated.")
-
-
-	# Updates the current position when the position subscriber receives data
+		self.client_base = actionlib.SimpleActionClient(namespace + "/rosarnl_node/move_base", MoveBaseAction)
+		self.connection_listener = ConnectionListener(self.signal_state) # The connections are made from node start, a state only waits for the ones still missing
+		self.emotion_publisher = rospy.Publisher(namespace + "/cyborg_controller/emotional_feedback", EmotionalFeedback, subscriber_listener=self.connection_listener, queue_size=100)
+		self.event_publisher = rospy.Publisher(namespace + "/cyborg_controller/register_event", String, subscriber_listener=self.connection_listener, queue_size=100)
+		self.speech_publisher = rospy.Publisher(namespace + "/cyborg_text_to_speech/text_to_speech", String, subscriber_listener=self.connection_listener, queue_size=100)
+		self.location_entered_publisher = rospy.Publisher(name + "/location_entered", String, queue_size=10)
+		self.location_exited_publisher = rospy.Publisher(name + "/location_exited", String, queue_size=10)
+		self.location_tracker = LocationTracker(self.database_handler, map_name=self.map_name, metrics=self.metrics, condition=fleet.tracker_condition)
+		self.location_tracker.add_listener(self.location_changed)
+		self.location_subscriber = rospy.Subscriber(namespace + "/rosarnl_node/amcl_pose", PoseWithCovarianceStamped, self.location_callback)
+		self.emotion_subscriber = rospy.Subscriber(namespace + "/cyborg_controller/emotional_state", EmotionalState, self.emotion_callback, queue_size=100)
+		self.text_subscriber = rospy.Subscriber(namespace + "/text_from_speech", String, self.text_callback, queue_size=100)
+		self.map_subscriber = rospy.Subscriber(name + "/map_name", String, self.map_callback, queue_size=10)
+		fleet.add(self)
+		rospy.loginfo("NavigationServer: Activated" + (" for " + namespace if namespace != "" else "") + ".")
+
+
+	# Updates the current position when the position subscriber receives data, the location tracker resolves it to a location
+	@timed(CALLBACK_SECONDS)
 	def location_callback(self, data):
 		self.current_x = data.pose.pose.position.x
 		self.current_y = data.pose.pose.position.y
+		if math.hypot(self.current_x - self.moved_x, self.current_y - self.moved_y) >= self.stall_distance:
+			self.moved_x = self.current_x
+			self.moved_y = self.current_y
+			self.moved_at = time.time()
+		self.location_tracker.update(self.current_x, self.current_y)
+		if self.recorder != None:
+			self.recorder.record("pose", self.namespace, self.current_x, self.current_y)
+
+
+	# Called by the location tracker when the robot leaves or enters a location, publishes the transition and wakes the scheduler
+	def location_changed(self, previous, location):
+		if previous != None:
+			self.location_exited_publisher.publish(previous.location_name)
+			rospy.logdebug("NavigationServer: Left " + previous.location_name + ".")
+			if self.recorder != None:
+				self.recorder.record("location_exited", self.namespace, previous.x, previous.y, previous.location_name)
+		if location != None:
+			self.location_entered_publisher.publish(location.location_name)
+			rospy.logdebug("NavigationServer: Entered " + location.location_name + ".")
+			if self.recorder != None:
+				self.recorder.record("location_entered", self.namespace, location.x, location.y, location.location_name)
+		self.wake_scheduler()
+
+
+	# Switches to the map named in the message, see set_map()
+	@timed(CALLBACK_SECONDS)
+	def map_callback(self, data):
+		self.set_map(data.data)
+
+
+	# Loads the map on the database executor and switches to it when it is in memory, so the switch itself does not wait for the database
+	def set_map(self, map_name):
+		self.map_requested = map_name
+		if map_name == self.map_name:
+			return
+		rospy.loginfo("NavigationServer: Loading map " + map_name + ".")
+		future = self.database_executor.submit(None, self.database_handler.load_map, robot_map_name=map_name)
+		future.add_done_callback(lambda future: self.map_loaded(map_name, future))
+
+
+	# Makes the map current unless an other map was asked for while it was loading, or it could not be loaded or has no locations
+	def map_loaded(self, map_name, future):
+		if map_name != self.map_requested or map_name == self.map_name:
+			return
+		if future.exception() != None or future.result() != True:
+			rospy.logwarn("NavigationServer: Unable to load map " + map_name + " (no locations?), staying on " + self.map_name + ".")
+			self.map_requested = self.map_name # So the map is loaded again when it is asked for again
+			return
+		self.map_name = map_name
+		self.location_tracker.set_map(map_name)
+		self.wake_scheduler()
+		rospy.loginfo("NavigationServer: Switched to map " + map_name + ".")
 
 
 	# Updates the current emotion when the emotion subscriber recives data from the controller (emotion system)
+	@timed(CALLBACK_SECONDS)
 	def emotion_callback(self, data):
 		self.current_emotion = data.to_emotional_state
-
-
-	# Thread, updating current location name based on current possition, checks for ongoing events and current position compared to the event, if ongoing event is an other location it publish a navigation_schedulaer event for the state machine
-	def scheduler(self): # Threaded
-		while (not rospy.is_shutdown()):
-			self.current_location = self.database_handler.find_location(robot_map_name=self.map_name, location_x=self.current_x, location_y=self.current_y)
-			current_location_name = self.current_location.location_name if self.current_location != None else ""
-			event = self.database_handler.search_ongoing_events(robot_map_name=self.map_name, current_date=datetime.datetime.now())
-			if event != None:
-				if event.location_name != current_location_name:
-					self.event_publisher.publish("navigation_schedualer")
-			self.scheduler_rate.sleep()
+		self.signal_state()
+
+
+	# Called by the fleet scheduler with the ongoing event and the next event boundary on the map at now, updates the current location,
+	# and if the ongoing event is at an other location it publish a navigation_schedualer event for the state machine
+	# Returns how long (s) until the robot has to be evaluated again, unless woken by wake_scheduler() when the robot enters or leaves a location or the database changes
+	def schedule(self, now, event, boundary):
+		self.ongoing_event = event
+		self.current_location = self.location_tracker.location
+		current_location_name = self.current_location.location_name if self.current_location != None else ""
+		if current_location_name != self.scheduler_location_name:
+			self.prepare_responses(self.current_location)
+		self.scheduler_location_name = current_location_name
+		timeout = self.scheduler_idle_timeout
+		if event != None:
+			if event.location_name != current_location_name:
+				if not self.is_busy(): # A state of this node is running (e.g. moving to the event), the state machine would ignore the event
+					self.publish_event("navigation_schedualer")
+				timeout = self.scheduler_retry_timeout # Published again if the robot is still idle and elsewhere then
+		if boundary != None:
+			timeout = min(timeout, (boundary - now).total_seconds() + self.scheduler_boundary_delay)
+		return timeout
+
+
+	# Whether one of the states of this node (planing, moving, talking or go_to) is running
+	def is_busy(self):
+		return any(server.is_active() for server in self.state_names)
+
+
+	# Makes the fleet scheduler re-evaluate the location and the ongoing events of this robot now
+	def wake_scheduler(self):
+		with self.scheduler_condition:
+			self.scheduler_wakeup = True
+			self.scheduler_condition.notify()
 
 
 	# Called once when the robot base (ROSARNL) goal completes
+	@timed(CALLBACK_SECONDS)
 	def client_base_done_callback(self, state, result):
 		if self.is_controlling_base:
 			if (state == 3): # Succeded aka arived at location
@@ -106,18 +247,23 @@ class NavigationServer():
 				self.base_canceled = True
 			elif (state == 1): # Canceled?
 				self.base_canceled = True
+			else: # Aborted, rejected, recalled or lost, the base will not get there
+				self.base_canceled = True
 			self.client_base_state = state
 			self.client_base_result = result
+			self.signal_state()
 			rospy.logdebug("NavigationServer: Base has completed its execution with " + str(state) + " and result " + str(result) + ".")
 
 
 	# Called once when the robot base (ROSARNL) goal becomes active
+	@timed(CALLBACK_SECONDS)
 	def client_base_active_callback(self):
 		rospy.logdebug("NavigationServer: Base goal has gone active.")
 		self.is_controlling_base = True
 		
 
 	# Called every time feedback is received for the goal for the robot base (ROSARNL)
+	@timed(CALLBACK_SECONDS)
 	def client_base_feedback_callback(self, feedback):
 		rospy.logdebug("NavigationServer: Received feedback from base - " + str(feedback) + ".")
 		self.client_base_feedback = feedback
@@ -126,63 +272,140 @@ class NavigationServer():
 	# Called when the controller (state machine) sets the navigation_planing state as active
 	def server_planing_callback(self, goal):
 		rospy.logdebug("NavigationServer: Executing planing state.")
-		time.sleep(2) # Let roscore update connections
+		self.state_started[self.server_planing] = timer()
+		self.wait_for_subscribers(self.server_planing, [self.event_publisher, self.emotion_publisher])
 
 		# Select what to do based on event
 		self.next_location = None
 		if goal.event == "navigation_schedualer":
 			if self.current_emotion == "angry":
-				self.next_location = self.database_handler.search_for_crowded_locations(robot_map_name=self.map_name, crowded=False)
+				self.next_location = self.next_tour_stop(crowded=False)
 				self.send_emotion(pleasure=0, arousal=0, dominance=0.1)
 				self.change_state(event="navigation_start_moving")
 			else:
-				self.next_location = self.database_handler.search_ongoing_events(robot_map_name=self.map_name, current_date=datetime.datetime.now())
+				self.next_location = self.lookup(self.database_handler.search_ongoing_events, robot_map_name=self.map_name, current_date=datetime.datetime.now())
+				self.leave_tour()
 				self.send_emotion(pleasure=0, arousal=0, dominance=-0.1)
 				self.change_state(event="navigation_start_moving")
 
 		elif goal.event == "navigation_emotional":
 			if self.current_emotion in ["angry", "sad", "fear", "inhibited"]:
-				self.next_location = self.database_handler.search_for_crowded_locations(robot_map_name=self.map_name, crowded=False)
+				self.next_location = self.next_tour_stop(crowded=False)
 				self.send_emotion(pleasure=0, arousal=0, dominance=0.1)
 				self.change_state(event="navigation_start_moving")
 			elif self.current_emotion in ["happy", "loved", "dignified", "neutral", "elated"]:
-				self.next_location = self.database_handler.search_for_crowded_locations(robot_map_name=self.map_name, crowded=True)
+				self.next_location = self.next_tour_stop(crowded=True)
 				self.send_emotion(pleasure=0, arousal=0, dominance=0.1)
 				self.change_state(event="navigation_start_moving")
 			elif self.current_emotion in ["bored", "curious", "unconcerned"]:
 				self.next_location = "wandering"
+				self.leave_tour()
 				self.send_emotion(pleasure=0, arousal=0, dominance=0.1)
 				self.change_state(event="navigation_start_wandering")
 
 		elif goal.event == "navigation_command":
 			self.next_location = self.command_location
+			self.leave_tour()
 			self.send_emotion(pleasure=0, arousal=0, dominance=-0.2)
 			self.change_state(event="navigation_start_moving")
 
+		if self.recorder != None: # The decision: what was chosen, why and from where
+			name = self.next_location if isinstance(self.next_location, str) or self.next_location == None else self.next_location.location_name
+			self.recorder.record("decision", self.namespace, self.current_x, self.current_y, name, json.dumps({"event": goal.event, "emotion": self.current_emotion, "map": self.map_name}))
+
+
+	# Returns the next stop of a tour through the nearest crowded (or quiet) locations, instead of a random one anywhere on the map
+	# A new tour is planned from the current position when the last one is used up or was for other locations
+	def next_tour_stop(self, crowded):
+		if self.tour_key != (self.map_name, crowded) or len(self.tour) == 0:
+			exclude = [self.current_location.location_name] if self.current_location != None else []
+			from_location = self.current_location.location_name if self.current_location != None else None
+			self.tour = self.lookup(self.database_handler.plan_tour, robot_map_name=self.map_name, location_x=self.current_x, location_y=self.current_y, crowded=crowded, count=self.tour_stops, exclude=exclude, travel_times=self.fleet.travel_times, from_location=from_location) or []
+			self.tour_key = (self.map_name, crowded)
+		if len(self.tour) == 0:
+			return None
+		return self.tour.pop(0)
+
+
+	# Drops the tour when the robot is sent somewhere off it, so the next tour is planned from where the robot ends up
+	def leave_tour(self):
+		self.tour = []
+
+
+	# Ends the goal of the action server with the outcome (succeeded, preempted, aborted or timeout) and records how long the state ran
+	def end_state(self, server, outcome, result=None):
+		started = self.state_started.pop(server, None)
+		if started != None:
+			self.metrics.observe(STATE_SECONDS, (self.state_names[server], outcome), timer() - started)
+		if outcome == "succeeded":
+			server.set_succeeded(result)
+		elif outcome == "preempted":
+			server.set_preempted(result)
+		else:
+			server.set_aborted(result)
+
+
+	# Publishes an event for the state machine (controller)
+	def publish_event(self, event):
+		self.metrics.increment(EVENTS_TOTAL, event)
+		self.event_publisher.publish(event)
+		if self.recorder != None:
+			self.recorder.record("event", self.namespace, self.current_x, self.current_y, event)
+
+
+	# Runs the database lookup on the database executor and waits for it, returns None if it takes longer than the query deadline of the fleet
+	def lookup(self, function, **keywords):
+		return self.fleet.lookup(function, **keywords)
+
+
+	# Wakes the state waiting in wait_for(), called by the base, preempt, emotion and text callbacks
+	def signal_state(self):
+		with self.state_condition:
+			self.state_condition.notify_all()
+
+
+	# Waits until done() is true, the server is preempted, the timeout (s, None for no timeout) passes or ROS shuts down
+	# Returns "done", "preempted", "timeout" or "shutdown". Sleeps on state_condition, so it wakes as soon as a callback signals
+	def wait_for(self, server, timeout=None, done=None):
+		deadline = time.time() + timeout if timeout != None else None
+		with self.state_condition:
+			while True:
+				if rospy.is_shutdown():
+					return "shutdown"
+				if done != None and done():
+					return "done"
+				if server.is_preempt_requested():
+					return "preempted"
+				remaining = deadline - time.time() if deadline != None else None
+				if remaining != None and remaining <= 0:
+					return "timeout"
+				self.state_condition.wait(remaining)
+
+
+	# Waits until every publisher has a subscriber, at most connection_timeout, returns at once when they already have
+	def wait_for_subscribers(self, server, publishers):
+		if self.wait_for(server, timeout=self.connection_timeout, done=lambda: all([publisher.get_num_connections() > 0 for publisher in publishers])) == "timeout":
+			rospy.logwarn("NavigationServer: No subscribers on " + ", ".join([publisher.name for publisher in publishers if publisher.get_num_connections() == 0]) + " after " + str(self.connection_timeout) + " s.")
+
 
 	# Publishes an event and waits for a change of state.
 	def change_state(self, event=None):
 		if event != None and self.next_location != None:
-			self.event_publisher.publish(event)
+			self.publish_event(event)
 		else:
-			self.server_planing.set_aborted()
+			self.end_state(self.server_planing, "aborted")
 			return
 
 		# Wait until state is preemted, or abort if it takes to long time
-		started_waiting = time.time() # Prevent eternal looping
-		while not rospy.is_shutdown():
-			if self.server_planing.is_preempt_requested():
-				self.server_planing.set_preempted()
-				return
-			elif (time.time() - started_waiting > self.planing_timeout): # Prevent eternal looping
-				self.server_planing.set_aborted() 
-				return
-			self.server_rate.sleep()
+		outcome = self.wait_for(self.server_planing, timeout=self.planing_timeout)
+		if outcome != "shutdown":
+			self.end_state(self.server_planing, outcome)
 
 
 	# Called when the controller (state machine) sets the navigation_moving state as active
 	def server_moving_callback(self, goal):
 		rospy.logdebug("NavigationServer: Executing moving state." + " Navigation movinging cmd " + str(self.next_location))
+		self.state_started[self.server_moving] = timer()
 		self.goal = goal
 		self.base_canceled = False
 		self.base_succeded = False
@@ -194,7 +417,7 @@ class NavigationServer():
 		elif goal.event == "navigation_start_moving" and self.next_location != None:
 			self.start_moving()
 		else:
-			self.server_moving.set_aborted()
+			self.end_state(self.server_moving, "aborted")
 			rospy.logdebug("NavigationServer: Received event that cant be handled - " + str(goal.event) + ".")
 
 
@@ -202,47 +425,34 @@ class NavigationServer():
 	def start_wandering(self):
 		# Tell base to start wandering
 		rospy.logdebug("NavigationServer: Waiting for base wandering service.")
-		rospy.wait_for_service("/rosarnl_node/wander")
+		rospy.wait_for_service(self.namespace + "/rosarnl_node/wander")
 		rospy.logdebug("NavigationServer: wandering service available.")
 		try:
-			baseStartWandering = rospy.ServiceProxy("/rosarnl_node/wander", Empty)
+			baseStartWandering = rospy.ServiceProxy(self.namespace + "/rosarnl_node/wander", Empty)
 			baseStartWandering()
-		except rospy.ServiceException, e:
+		except rospy.ServiceException as e:
 			rospy.logdebug("NavigationServer: wandering service error - " + str(e))
 
-		started_waiting = time.time() # Prevent eternal looping
-		feedback_cycle = time.time() 
-		while not rospy.is_shutdown():
-			if self.server_moving.is_preempt_requested():
-				self.client_base.cancel_all_goals() # HERE - goal on wandering?
-				try:
-					baseStop = rospy.ServiceProxy("/rosarnl_node/stop", Empty)
-					baseStop()
-				except rospy.ServiceException, e:
-					rospy.logdebug("NavigationServer: stop service error - " + str(e))
-				self.server_moving.set_preempted()
-				return
-			if self.current_emotion not in ["bored", "curious", "unconcerned"]:
-				self.client_base.cancel_all_goals() # HERE - goal on wandering?
-				try:
-					baseStop = rospy.ServiceProxy("/rosarnl_node/stop", Empty)
-					baseStop()
-				except rospy.ServiceException, e:
-					rospy.logdebug("NavigationServer: stop service error - " + str(e))
-				self.event_publisher.publish("navigation_wandering_completed")
-
-				# Wait until state is preemted
-				started_waiting = time.time() # Prevent eternal looping
-				while not rospy.is_shutdown():
-					if self.server_moving.is_preempt_requested():
-						self.server_moving.set_preempted()
-						return
-					self.server_rate.sleep()
+		while True:
+			outcome = self.wait_for(self.server_moving, timeout=self.feedback_period, done=lambda: self.current_emotion not in ["bored", "curious", "unconcerned"])
+			if outcome == "shutdown":
 				return
-			if (time.time() - feedback_cycle > 15): # send emotional feedback every 15 secounds
+			if outcome == "timeout": # send emotional feedback every feedback_period
 				self.send_emotion(pleasure=0.02, arousal=0.05, dominance=0.02)
-				feedback_cycle = time.time()
-			self.server_rate.sleep()
+				continue
+			self.client_base.cancel_all_goals() # HERE - goal on wandering?
+			try:
+				baseStop = rospy.ServiceProxy(self.namespace + "/rosarnl_node/stop", Empty)
+				baseStop()
+			except rospy.ServiceException as e:
+				rospy.logdebug("NavigationServer: stop service error - " + str(e))
+			if outcome == "done":
+				self.publish_event("navigation_wandering_completed")
+				# Wait until state is preemted
+				if self.wait_for(self.server_moving) == "shutdown":
+					return
+			self.end_state(self.server_moving, "preempted")
+			return
 
 
 	# The robot base moves to the self.next_location
@@ -251,33 +461,47 @@ class NavigationServer():
 	def start_moving(self):
 		rospy.logdebug("NavigationServer: Contacting base with goal.")
 		self.send_goal(location=self.next_location)
-
-		# Wait until state is preemted, or abort if it takes to long time
-		started_waiting = time.time() # Prevent eternal looping
-		feedback_cycle = time.time() 
-		while not rospy.is_shutdown():
-			if self.base_succeded:
-				self.current_location = self.next_location
-				self.send_emotion(pleasure=self.next_location.enviorment, arousal=0.00, dominance=0.00)
-				server_result = StateMachineResult()
-				self.server_moving.set_succeeded(server_result)
-				next_location = None
-				return
-			if self.server_moving.is_preempt_requested():
-				self.client_base.cancel_all_goals()
-				self.server_moving.set_preempted()
-				return
-			if self.base_canceled:
-				self.server_moving.set_aborted()
-				return
-			if (time.time() - started_waiting > self.moving_timeout): # Prevent eternal looping
+		outcome = self.wait_for_base(self.server_moving, self.feedback_period, lambda: self.send_emotion(pleasure=0.00, arousal=0.03, dominance=0.01)) # Give some feedback for the emotion
+		if outcome == "shutdown":
+			return
+		if outcome == "succeeded":
+			self.current_location = self.next_location
+			self.prepare_responses(self.current_location)
+			self.send_emotion(pleasure=self.next_location.enviorment, arousal=0.00, dominance=0.00)
+			server_result = StateMachineResult()
+			self.end_state(self.server_moving, "succeeded", server_result)
+			return
+		self.end_state(self.server_moving, outcome)
+
+
+	# Waits until the base reaches self.next_location, the state is preempted, or the move takes longer than learned from earlier moves
+	# or the robot stops moving (stall_timeout). Calls feedback() every period (s) meanwhile, cancels the base goal unless it ended by itself
+	# Returns "succeeded", "preempted", "aborted" (canceled by the base), "timeout", "stalled" or "shutdown", and records the move
+	def wait_for_base(self, server, period, feedback):
+		location = self.next_location
+		from_location = self.current_location.location_name if self.current_location != None else None
+		distance = math.hypot(location.x - self.current_x, location.y - self.current_y)
+		timeout = self.fleet.travel_times.timeout(from_location, location.location_name, distance, self.moving_timeout)
+		start_date = datetime.datetime.now()
+		started = time.time()
+		self.moved_at = started
+		while True:
+			remaining = timeout - (time.time() - started)
+			outcome = self.wait_for(server, timeout=max(min(remaining, period), 0), done=lambda: self.base_succeded or self.base_canceled)
+			if outcome == "shutdown":
+				return outcome
+			if outcome == "done":
+				outcome = "succeeded" if self.base_succeded else "aborted"
+			elif outcome == "timeout":
+				if time.time() - started < timeout and time.time() - self.moved_at < self.stall_timeout:
+					feedback()
+					continue
+				outcome = "timeout" if time.time() - started >= timeout else "stalled"
+				rospy.logwarn("NavigationServer: Gave up moving to " + location.location_name + " - " + outcome + " after " + str(int(time.time() - started)) + " s.")
+			if outcome in ["preempted", "timeout", "stalled"]:
 				self.client_base.cancel_all_goals()
-				self.server_moving.set_aborted() 
-				return
-			if (time.time() - feedback_cycle > 15): # Give some feedback for the emotion
-				self.send_emotion(pleasure=0.00, arousal=0.03, dominance=0.01)
-				feedback_cycle = time.time()
-			self.server_rate.sleep()
+			self.fleet.record_travel(self.map_name, from_location, location.location_name, start_date, time.time() - started, outcome)
+			return outcome
 
 
 
@@ -285,15 +509,15 @@ class NavigationServer():
 	# Called when the controller (state machine) sets the navigation_talking state as active
 	def server_talking_callback(self, goal):
 		rospy.logdebug("NavigationServer: Executing talking state - event was " + str(goal.event) + ".")
-		rate = rospy.Rate(.25) # (hz)
-		rate.sleep() # Let roscore update list
+		self.state_started[self.server_talking] = timer()
+		self.wait_for_subscribers(self.server_talking, [self.speech_publisher, self.event_publisher])
 		if goal.event == "succeded":
 			if self.reason == "navigation_direction":
 				self.speech_publisher.publish("Human, this is " + self.current_location.location_name)
 				self.reason = ""
 			else:
 				self.find_response(location=self.current_location.location_name, response_type="navigation_response", emotion=self.current_emotion)
-			self.server_talking.set_succeeded()
+			self.end_state(self.server_talking, "succeeded")
 			return
 
 		elif goal.event == "aborted":
@@ -301,160 +525,134 @@ class NavigationServer():
 				self.speech_publisher.publish("Human, I am sorry, but I am unable to reach " + self.next_location.location_name)
 			else:
 				self.speech_publisher.publish("Oh lord, I am stuck " )
-			self.server_talking.set_aborted()
+			self.end_state(self.server_talking, "aborted")
 			return
 
 		elif goal.event == "navigation_feedback":
 			self.find_response(location=self.command_location.location_name, response_type="navigation_response", emotion=self.current_emotion)
-			self.event_publisher.publish("navigation_feedback_completed")
+			self.publish_event("navigation_feedback_completed")
 			self.server_talking_wait()
 			return
 		
 		elif goal.event == "navigation_information":
 			self.speech_publisher.publish("I think I know where that is. Would you like me to show you?")
-			# Wait until state is preemted, or abort if it takes to long time
-			started_waiting = time.time() # Prevent eternal looping
-			while not rospy.is_shutdown():
-				if "yes" in self.text:
-					self.text = ""
-					self.reason = "navigation_direction"
-					self.speech_publisher.publish("At once!")
-					self.event_publisher.publish("navigation_command")
-					self.server_talking_wait()
-					return
-				if "no" in self.text:
-					self.text = ""
-					self.speech_publisher.publish("I wont go then...")
-					self.event_publisher.publish("navigation_feedback_completed")
-					self.server_talking_wait()
-					return
-				if self.server_talking.is_preempt_requested():
-					self.server_talking.set_preempted()
-					return
-				if (time.time() - started_waiting > self.taking_timeout): # Prevent eternal looping
-					self.server_talking.set_aborted() 
-					return
-				self.server_rate.sleep()
+			self.server_talking_answer()
+			return
 
 		elif goal.event == "navigation_command":
 			if self.current_emotion == "angry":
 				self.send_emotion(pleasure=0, arousal=0, dominance=0.2)
 				self.command_location = None
 				self.speech_publisher.publish("I dont want to go there! Stop telling me what to do human!")
-				self.event_publisher.publish("navigation_feedback_completed")
+				self.publish_event("navigation_feedback_completed")
 				self.server_talking_wait()
 				return
 			else:
 				self.speech_publisher.publish("You would like me to go to " + self.command_location.location_name + "?")
-				# Wait until state is preemted, or abort if it takes to long time
-				started_waiting = time.time() # Prevent eternal looping
-				while not rospy.is_shutdown():
-					if "yes" in self.text:
-						self.text = ""
-						self.reason = "navigation_direction"
-						self.speech_publisher.publish("At once!")
-						self.event_publisher.publish("navigation_command")
-						self.server_talking_wait()
-						return
-					if "no" in self.text:
-						self.text = ""
-						self.speech_publisher.publish("I wont go then...")
-						self.event_publisher.publish("navigation_feedback_completed")
-						self.server_talking_wait()
-						return
-					if self.server_talking.is_preempt_requested():
-						self.server_talking.set_preempted()
-						return
-					if (time.time() - started_waiting > self.taking_timeout): # Prevent eternal looping
-						self.server_talking.set_aborted() 
-						return
-					self.server_rate.sleep()
+				self.server_talking_answer()
+				return
 
 		else:
 			self.speech_publisher.publish("I dont understand, what am I doing?")
-			self.server_talking.set_aborted()
+			self.end_state(self.server_talking, "aborted")
+
+
+	# Waits for a yes or no from the human after a question, and acts on it
+	def server_talking_answer(self):
+		# Wait until answered or preemted, or abort if it takes to long time
+		outcome = self.wait_for(self.server_talking, timeout=self.taking_timeout, done=lambda: "yes" in self.text or "no" in self.text)
+		if outcome == "done" and "yes" in self.text:
+			self.text = ""
+			self.reason = "navigation_direction"
+			self.speech_publisher.publish("At once!")
+			self.publish_event("navigation_command")
+			self.server_talking_wait()
+		elif outcome == "done":
+			self.text = ""
+			self.speech_publisher.publish("I wont go then...")
+			self.publish_event("navigation_feedback_completed")
+			self.server_talking_wait()
+		elif outcome != "shutdown":
+			self.end_state(self.server_talking, outcome)
 
 
 	# Wait until state is preemted, or abort if it takes to long time
 	def server_talking_wait(self):
-		# Wait until state is preemted, or abort if it takes to long time
-		started_waiting = time.time() # Prevent eternal looping
-		while not rospy.is_shutdown():
-			if self.server_talking.is_preempt_requested():
-				self.server_talking.set_preempted()
-				return
-			if (time.time() - started_waiting > self.taking_timeout): # Prevent eternal looping
-				self.server_talking.set_aborted() 
-				return
-			self.server_rate.sleep()
+		outcome = self.wait_for(self.server_talking, timeout=self.taking_timeout)
+		if outcome != "shutdown":
+			self.end_state(self.server_talking, outcome)
 
 
 	# This can be used by other nodes for moving the cyborg to a known location.
 	def server_go_to_callback(self, goal):
 		rospy.logdebug("NavigationServer: go to server received a goal - " + str(goal))
-		self.next_location = self.database_handler.search_for_location(location_name=goal.location_name)
+		self.state_started[self.server_go_to] = timer()
+		self.next_location = self.lookup(self.database_handler.search_for_location, location_name=goal.location_name)
 		if self.next_location != None:
+			self.leave_tour()
+			self.base_canceled = False
+			self.base_succeded = False
+			self.is_controlling_base = False
 			self.send_goal(location=self.next_location)
 
 			# Wait until state is preemted or succeeded
-			while not rospy.is_shutdown():
-				if self.base_succeded:
-					self.current_location = self.next_location
-					server_result = NavigationGoToResult()
-					server_result.status = "succeeded"
-					self.server_go_to.set_succeeded(server_result)
-					return
-				if self.server_go_to.is_preempt_requested():
-					self.client_base.cancel_all_goals()
-					server_result = NavigationGoToResult()
-					server_result.status = "preemted"
-					self.server_go_to.set_preempted(server_result)
-					return
-				if self.base_canceled:
-					server_result = NavigationGoToResult()
-					server_result.status = "aborted"
-					self.server_go_to.set_aborted(server_result)
-					return
-				else:
-					server_feedback = NavigationGoToFeedback()
-					server_feedback.status = "moving"
-					self.server_go_to.publish_feedback(feedback)
-				self.server_rate.sleep()
+			outcome = self.wait_for_base(self.server_go_to, self.go_to_feedback_period, self.go_to_feedback)
+			if outcome == "shutdown":
+				return
+			if outcome == "succeeded":
+				self.current_location = self.next_location
+			server_result = NavigationGoToResult()
+			server_result.status = {"succeeded": "succeeded", "preempted": "preemted"}.get(outcome, "aborted")
+			self.end_state(self.server_go_to, outcome, server_result)
 		else:
 			rospy.logdebug("NavigationServer: Go to server received a goal with unrecognized name - " + str(goal))
 			server_result = NavigationGoToResult()
 			server_result.status = "aborted"
-			self.server_go_to.set_aborted(server_result)
+			self.end_state(self.server_go_to, "aborted", server_result)
+
+
+	# Status feedback to the go_to client while moving
+	def go_to_feedback(self):
+		server_feedback = NavigationGoToFeedback()
+		server_feedback.status = "moving"
+		self.server_go_to.publish_feedback(server_feedback)
 
 
 	# Called when the speech to text publishes new text
 	# Searches the text from speech for keywords to see if the Navigation module can act on it, if so, an event is sent to the state machine.
+	# Only the first location mentioned is used, and a longer name wins over a shorter name inside it ("entrance 2" over "entrance").
+	@timed(CALLBACK_SECONDS)
 	def text_callback(self, data):
 		self.text = data.data
+		self.signal_state()
 		rospy.logdebug("NavigationServer: Recived text - " + self.text)
 		if "go to " in data.data or "move to" in data.data or "go " in data.data:
-			locations = self.database_handler.get_all_locations()
-			for location in locations:
-				if location.location_name in data.data:
-					self.command_location = location
-					self.event_publisher.publish("navigation_command")
-					rospy.logdebug("NavigationServer: Cmd to next location - " + str(location))
-
+			event = "navigation_command"
+			description = "Cmd to next location - "
 		elif "where is " in data.data:
-			locations = self.database_handler.get_all_locations()
-			for location in locations:
-				if location.location_name in data.data:
-					self.command_location = location
-					self.event_publisher.publish("navigation_information")
-					rospy.logdebug("NavigationServer: information about location - " + str(location))
-
+			event = "navigation_information"
+			description = "information about location - "
 		elif "think of " in data.data or "think about " in data.data:
-			locations = self.database_handler.get_all_locations()
-			for location in locations:
-				if location.location_name in data.data:
-					self.command_location = location
-					self.event_publisher.publish("navigation_feedback")
-					rospy.logdebug("NavigationServer: Opinion about location - " + str(location))
+			event = "navigation_feedback"
+			description = "Opinion about location - "
+		else:
+			return
+
+		self.database_executor.submit(self.fleet.query_deadline, self.database_handler.find_location_mentions, text=data.data).add_done_callback(lambda future: self.text_locations_found(future, event, description))
+
+
+	# Called by the database executor with the locations mentioned in the text from text_callback
+	@timed(CALLBACK_SECONDS)
+	def text_locations_found(self, future, event, description):
+		try:
+			locations = future.result()
+		except DatabaseTimeout as e:
+			rospy.logwarn("NavigationServer: Ignored text - " + str(e))
+			return
+		if locations:
+			self.command_location = locations[0]
+			self.publish_event(event)
+			rospy.logdebug("NavigationServer: " + description + str(locations[0]))
 
 
 	# Sends the location to the ROSARNL node (Pioneer XL robot base)
@@ -467,6 +665,7 @@ class NavigationServer():
 		pose.position.x = location.x
 		pose.position.y = location.y
 		pose.position.z = location.z
+		import tf.transformations # Imported on the first goal instead of at node start, it loads most of tf
 		q = tf.transformations.quaternion_from_euler(location.p, location.j, location.r)
 		pose.orientation = geometry_msgs.msg.Quaternion(*q)
 		goal = MoveBaseGoal()
@@ -486,12 +685,25 @@ class NavigationServer():
 		self.emotion_publisher.publish(msg)
 
 
-	# Chack the database for responses (aka voice output) for the Cyborg
+	# Chack the snapshot for responses (aka voice output) for the Cyborg, without waiting for the database
 	def find_response(self, location, response_type, emotion):
-		response = self.database_handler.search_for_response(response_type=response_type, emotion=emotion)
-		if response != None:
-			speech = response.message.replace("LOCATION", location)
+		speech = self.database_handler.cached_response(response_type=response_type, emotion=emotion, values=self.response_values(location, emotion))
+		if speech != None:
 			self.speech_publisher.publish(speech)
+		else:
+			rospy.logdebug("NavigationServer: No response ready for " + str(location) + ".")
+
 
+	# Placeholder values for responses spoken at the location
+	def response_values(self, location, emotion):
+		values = {"LOCATION": location, "EMOTION": emotion}
+		event = self.ongoing_event
+		if event != None:
+			values["EVENT"] = event.event_name.replace("_", " ")
+		return values
 
 
+	# Renders the responses for the location on the database executor ahead of the talking state, so speaking needs no database work. Does not wait
+	def prepare_responses(self, location):
+		if location != None:
+			self.database_executor.submit(self.fleet.query_deadline, self.database_handler.render_responses, response_type="navigation_response", emotion=self.current_emotion, values=self.response_values(location.location_name, self.current_emotion))
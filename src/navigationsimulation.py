@@ -0,0 +1,952 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import argparse
+import collections
+import datetime
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import types
+
+try:
+    import Queue as queue
+except ImportError: # Python 3
+    import queue
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+"""Cyborg Navigation Simulation
+
+Runs the NavigationServer without ROS. In-process stand-ins replace rospy,
+actionlib, tf and the message packages, a simulated move_base drives the
+robot towards its goals at a configurable speed, and a minimal state machine
+plays the part of cyborg_controller. Recorded amcl_pose, speech, emotion and
+controller event streams are replayed from csv or jsonl files with a time
+column (seconds from the start of the simulation). The clock can run faster
+than real time. A JSON report gives the duration of every planing, moving and
+talking state, the latency of every state transition and the server's own
+metrics.
+
+    $ python navigationsimulation.py --speed 20 --duration 3600 --replay speech.csv --output report.json"""
+
+POSE_TOPIC = "/rosarnl_node/amcl_pose"
+TEXT_TOPIC = "/text_from_speech"
+EMOTION_TOPIC = "/cyborg_controller/emotional_state"
+EVENT_TOPIC = "/cyborg_controller/register_event"
+FEEDBACK_TOPIC = "/cyborg_controller/emotional_feedback"
+SPEECH_TOPIC = "/cyborg_text_to_speech/text_to_speech"
+BASE_ACTION = "/rosarnl_node/move_base"
+START_DATE = "2017-01-18 07:59:00" # A minute before the first event of the database created by navigation.py
+
+# actionlib_msgs/GoalStatus
+PENDING = 0
+ACTIVE = 1
+PREEMPTED = 2
+SUCCEEDED = 3
+ABORTED = 4
+
+# (state, event) -> next state of the controller stand-in, events without a transition are ignored like the real state machine does
+TRANSITIONS = {
+    ("idle", "navigation_schedualer"): "planing",
+    ("idle", "navigation_emotional"): "planing",
+    ("idle", "navigation_command"): "talking",
+    ("idle", "navigation_information"): "talking",
+    ("idle", "navigation_feedback"): "talking",
+    ("planing", "navigation_start_moving"): "moving",
+    ("planing", "navigation_start_wandering"): "moving",
+    ("talking", "navigation_command"): "planing",
+    ("talking", "navigation_feedback_completed"): "idle",
+    ("moving", "navigation_wandering_completed"): "idle",
+}
+
+
+class SimulatedClock(object):
+    """SimulatedClock
+
+    Simulated time starts at start_date and runs speed times faster than real
+    time. Provides time() and sleep() so it can stand in for the time module,
+    and every sleep returns early when the simulation stops."""
+
+    def __init__(self, speed=1.0, start_date=None):
+        self.speed = float(speed)
+        self.start_date = start_date if start_date is not None else datetime.datetime.now()
+        self.start_time = time.mktime(self.start_date.timetuple()) + self.start_date.microsecond / 1e6
+        self.real_start = time.time()
+        self.stopped = threading.Event()
+
+    # Simulated seconds since the start
+    def elapsed(self):
+        return (time.time() - self.real_start) * self.speed
+
+    def time(self):
+        return self.start_time + self.elapsed()
+
+    def now(self):
+        return self.start_date + datetime.timedelta(seconds=self.elapsed())
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.stopped.wait(seconds / self.speed)
+
+    # Sleeps until the simulated second given by elapsed()
+    def sleep_until(self, elapsed):
+        self.sleep(elapsed - self.elapsed())
+
+    def stop(self):
+        self.stopped.set()
+
+    # A stand-in for the datetime module where datetime.now() follows the clock
+    def datetime_module(self):
+        clock = self
+        class SimulatedDatetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.now()
+        module = types.ModuleType("datetime")
+        module.__dict__.update(datetime.__dict__)
+        module.datetime = SimulatedDatetime
+        return module
+
+    # A stand-in for the threading module where Condition.wait() timeouts follow the clock
+    def threading_module(self):
+        clock = self
+        module = types.ModuleType("threading")
+        module.__dict__.update(threading.__dict__)
+        module.Condition = lambda *arguments: SimulatedCondition(clock, *arguments)
+        return module
+
+
+class SimulatedCondition(object):
+    """SimulatedCondition
+
+    threading.Condition with the wait() timeout in simulated seconds."""
+
+    def __init__(self, clock, lock=None):
+        self.clock = clock
+        self.condition = threading.Condition(lock) if lock is not None else threading.Condition()
+
+    def __enter__(self):
+        return self.condition.__enter__()
+
+    def __exit__(self, *arguments):
+        return self.condition.__exit__(*arguments)
+
+    def wait(self, timeout=None):
+        return self.condition.wait(timeout / self.clock.speed if timeout is not None else None)
+
+    def notify(self, n=1):
+        self.condition.notify(n)
+
+    def notify_all(self):
+        self.condition.notify_all()
+
+    notifyAll = notify_all
+
+
+class SimulatedGoal(object):
+    """SimulatedGoal
+
+    One goal sent to a simulated action server, with its outcome and timing."""
+
+    def __init__(self, server_name, goal, started):
+        self.server_name = server_name
+        self.state = server_name.rsplit("/", 1)[-1]
+        self.goal = goal
+        self.event = getattr(goal, "event", None)
+        self.started = started # (s) Simulated
+        self.real_started = time.time()
+        self.ended = None
+        self.real_ended = None
+        self.outcome = None
+        self.done = threading.Event()
+
+
+class Simulation(object):
+    """Simulation
+
+    The shared state behind the stand-in modules: the clock, topic
+    subscribers, action servers and targets, shutdown hooks, finished goals
+    and error counts."""
+
+    def __init__(self, clock, verbose=False):
+        self.clock = clock
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.node_name = "/simulation"
+        self.parameters = {} # rospy parameters, by the name given to get_param()
+        self.subscribers = {} # topic -> [(callback, callback_args)]
+        self.subscribe_listeners = {} # topic -> [rospy.SubscribeListener] given to the publishers of the topic
+        self.published = collections.Counter() # topic -> messages
+        self.services = collections.Counter() # service -> calls
+        self.action_servers = {} # name -> SimpleActionServer stand-in
+        self.action_targets = {} # name -> object with execute() and cancel(), what a SimpleActionClient talks to
+        self.goal_listeners = []
+        self.goals = [] # Finished SimulatedGoal
+        self.shutdown_hooks = []
+        self.errors = 0
+
+    def is_shutdown(self):
+        return self.clock.stopped.is_set()
+
+    def shutdown(self, reason=""):
+        if self.is_shutdown():
+            return
+        self.log("info", "Shutting down - " + str(reason))
+        self.clock.stop()
+        for hook in list(self.shutdown_hooks):
+            try:
+                hook()
+            except Exception:
+                self.error("shutdown hook")
+
+    def log(self, level, text):
+        if self.verbose or level in ["warn", "error", "fatal"]:
+            sys.stderr.write("[%10.3f] %-5s %s\n" % (self.clock.elapsed(), level.upper(), text))
+
+    def error(self, where):
+        with self.lock:
+            self.errors += 1
+        sys.stderr.write("Cyborg Navigation: Exception in " + where + "...\n" + traceback.format_exc())
+
+    def subscribe(self, topic, callback, callback_args=None):
+        entry = (callback, callback_args)
+        with self.lock:
+            self.subscribers.setdefault(topic, []).append(entry)
+            listeners = list(self.subscribe_listeners.get(topic, []))
+        for listener in listeners:
+            listener.peer_subscribe(topic, None, None)
+        return entry
+
+    def unsubscribe(self, topic, entry):
+        with self.lock:
+            if entry in self.subscribers.get(topic, []):
+                self.subscribers[topic].remove(entry)
+            listeners = list(self.subscribe_listeners.get(topic, []))
+            count = len(self.subscribers.get(topic, []))
+        for listener in listeners:
+            listener.peer_unsubscribe(topic, count)
+
+    def subscriber_count(self, topic):
+        with self.lock:
+            return len(self.subscribers.get(topic, []))
+
+    # Delivers the message to every subscriber in the publishing thread
+    def publish(self, topic, message):
+        with self.lock:
+            self.published[topic] += 1
+            entries = list(self.subscribers.get(topic, []))
+        for callback, callback_args in entries:
+            try:
+                if callback_args is None:
+                    callback(message)
+                else:
+                    callback(message, callback_args)
+            except Exception:
+                self.error("subscriber of " + topic)
+
+    def goal_done(self, goal):
+        with self.lock:
+            self.goals.append(goal)
+            listeners = list(self.goal_listeners)
+        for listener in listeners:
+            listener(goal)
+
+
+# Returns a message class with the given (field, default) pairs, a default that is a class is instantiated for every message
+def message_type(name, *fields):
+    def __init__(self, *arguments, **keywords):
+        for i, (field, default) in enumerate(fields):
+            if i < len(arguments):
+                value = arguments[i]
+            elif field in keywords:
+                value = keywords[field]
+            else:
+                value = default() if isinstance(default, type) else default
+            setattr(self, field, value)
+    def __repr__(self):
+        return name + "(" + ", ".join([field + "=" + repr(getattr(self, field)) for field, default in fields]) + ")"
+    return type(name, (object, ), {"__init__": __init__, "__repr__": __repr__, "__slots__": [field for field, default in fields]})
+
+
+# Same rotation as tf.transformations.quaternion_from_euler with the default static xyz axes, returns [x, y, z, w]
+def quaternion_from_euler(ai, aj, ak, axes="sxyz"):
+    ci, si = math.cos(ai / 2.0), math.sin(ai / 2.0)
+    cj, sj = math.cos(aj / 2.0), math.sin(aj / 2.0)
+    ck, sk = math.cos(ak / 2.0), math.sin(ak / 2.0)
+    return [si * cj * ck - ci * sj * sk, ci * sj * ck + si * cj * sk, ci * cj * sk - si * sj * ck, ci * cj * ck + si * sj * sk]
+
+
+def module(name, **attributes):
+    created = types.ModuleType(name)
+    created.__dict__.update(attributes)
+    return created
+
+
+# Message packages used by the NavigationServer, as {module name: module}
+def message_modules():
+    Header = message_type("Header", ("seq", 0), ("stamp", 0.0), ("frame_id", ""))
+    Point = message_type("Point", ("x", 0.0), ("y", 0.0), ("z", 0.0))
+    Quaternion = message_type("Quaternion", ("x", 0.0), ("y", 0.0), ("z", 0.0), ("w", 1.0))
+    Pose = message_type("Pose", ("position", Point), ("orientation", Quaternion))
+    PoseStamped = message_type("PoseStamped", ("header", Header), ("pose", Pose))
+    PoseWithCovariance = message_type("PoseWithCovariance", ("pose", Pose), ("covariance", list))
+    PoseWithCovarianceStamped = message_type("PoseWithCovarianceStamped", ("header", Header), ("pose", PoseWithCovariance))
+    geometry_msgs_msg = module("geometry_msgs.msg", Header=Header, Point=Point, Quaternion=Quaternion, Pose=Pose, PoseStamped=PoseStamped, PoseWithCovariance=PoseWithCovariance, PoseWithCovarianceStamped=PoseWithCovarianceStamped)
+    move_base_msgs_msg = module("move_base_msgs.msg",
+        MoveBaseAction=message_type("MoveBaseAction"),
+        MoveBaseGoal=message_type("MoveBaseGoal", ("target_pose", PoseStamped)),
+        MoveBaseResult=message_type("MoveBaseResult"),
+        MoveBaseFeedback=message_type("MoveBaseFeedback", ("base_position", PoseStamped)))
+    cyborg_controller_msg = module("cyborg_controller.msg",
+        StateMachineAction=message_type("StateMachineAction"),
+        StateMachineGoal=message_type("StateMachineGoal", ("event", "")),
+        StateMachineResult=message_type("StateMachineResult"),
+        StateMachineFeedback=message_type("StateMachineFeedback"),
+        EmotionalState=message_type("EmotionalState", ("from_emotional_state", ""), ("to_emotional_state", ""), ("current_pleasure", 0.0), ("current_arousal", 0.0), ("current_dominance", 0.0)),
+        EmotionalFeedback=message_type("EmotionalFeedback", ("delta_pleasure", 0.0), ("delta_arousal", 0.0), ("delta_dominance", 0.0)),
+        SystemState=message_type("SystemState", ("system_state", "")))
+    cyborg_navigation_msg = module("cyborg_navigation.msg",
+        NavigationGoToAction=message_type("NavigationGoToAction"),
+        NavigationGoToGoal=message_type("NavigationGoToGoal", ("location_name", "")),
+        NavigationGoToResult=message_type("NavigationGoToResult", ("status", "")),
+        NavigationGoToFeedback=message_type("NavigationGoToFeedback", ("status", "")))
+    DiagnosticStatus = message_type("DiagnosticStatus", ("level", 0), ("name", ""), ("message", ""), ("hardware_id", ""), ("values", list))
+    DiagnosticStatus.OK, DiagnosticStatus.WARN, DiagnosticStatus.ERROR, DiagnosticStatus.STALE = 0, 1, 2, 3
+    diagnostic_msgs_msg = module("diagnostic_msgs.msg",
+        DiagnosticArray=message_type("DiagnosticArray", ("header", Header), ("status", list)),
+        DiagnosticStatus=DiagnosticStatus,
+        KeyValue=message_type("KeyValue", ("key", ""), ("value", "")))
+    return {
+        "geometry_msgs": module("geometry_msgs", msg=geometry_msgs_msg),
+        "geometry_msgs.msg": geometry_msgs_msg,
+        "move_base_msgs": module("move_base_msgs", msg=move_base_msgs_msg),
+        "move_base_msgs.msg": move_base_msgs_msg,
+        "std_msgs": module("std_msgs"),
+        "std_msgs.msg": module("std_msgs.msg", String=message_type("String", ("data", "")), Header=Header),
+        "diagnostic_msgs": module("diagnostic_msgs", msg=diagnostic_msgs_msg),
+        "diagnostic_msgs.msg": diagnostic_msgs_msg,
+        "std_srvs": module("std_srvs"),
+        "std_srvs.srv": module("std_srvs.srv", Empty=message_type("Empty")),
+        "cyborg_controller": module("cyborg_controller", msg=cyborg_controller_msg),
+        "cyborg_controller.msg": cyborg_controller_msg,
+        "cyborg_navigation": module("cyborg_navigation", msg=cyborg_navigation_msg),
+        "cyborg_navigation.msg": cyborg_navigation_msg,
+    }
+
+
+# The rospy stand-in, topics and services stay inside the simulation
+def rospy_module(simulation):
+    clock = simulation.clock
+
+    class ROSException(Exception):
+        pass
+
+    class ROSInterruptException(ROSException):
+        pass
+
+    class ServiceException(Exception):
+        pass
+
+    class Duration(object):
+        def __init__(self, secs=0, nsecs=0):
+            self.seconds = secs + nsecs / 1e9
+        @classmethod
+        def from_sec(cls, seconds):
+            return cls(seconds)
+        def to_sec(self):
+            return self.seconds
+
+    class Time(Duration):
+        @classmethod
+        def now(cls):
+            return cls(clock.time())
+
+    class Rate(object):
+        def __init__(self, hz):
+            self.period = 1.0 / hz
+            self.last = clock.elapsed()
+        def sleep(self):
+            self.last = max(self.last + self.period, clock.elapsed() - self.period) # Does not try to catch up after a long pause
+            clock.sleep_until(self.last)
+
+    class SubscribeListener(object):
+        def peer_subscribe(self, topic_name, topic_publish, peer_publish):
+            pass
+        def peer_unsubscribe(self, topic_name, num_peers):
+            pass
+
+    class Publisher(object):
+        def __init__(self, name, data_class, subscriber_listener=None, queue_size=None, latch=False, **keywords):
+            self.name = name
+            self.data_class = data_class
+            if subscriber_listener is not None:
+                with simulation.lock:
+                    simulation.subscribe_listeners.setdefault(name, []).append(subscriber_listener)
+        def publish(self, *arguments, **keywords):
+            message = arguments[0] if len(arguments) == 1 and isinstance(arguments[0], self.data_class) else self.data_class(*arguments, **keywords)
+            simulation.publish(self.name, message)
+        def get_num_connections(self):
+            return simulation.subscriber_count(self.name)
+        def unregister(self):
+            pass
+
+    class Subscriber(object):
+        def __init__(self, name, data_class, callback=None, callback_args=None, queue_size=None, **keywords):
+            self.name = name
+            self.entry = simulation.subscribe(name, callback, callback_args) if callback is not None else None
+        def get_num_connections(self):
+            return 1
+        def unregister(self):
+            if self.entry is not None:
+                simulation.unsubscribe(self.name, self.entry)
+                self.entry = None
+
+    class ServiceProxy(object):
+        def __init__(self, name, service_class, persistent=False):
+            self.name = name
+        def __call__(self, *arguments, **keywords):
+            simulation.services[self.name] += 1
+            return None
+
+    class Timer(object):
+        def __init__(self, period, callback, oneshot=False):
+            self.period = period.to_sec()
+            self.callback = callback
+            self.oneshot = oneshot
+            self.stopped = False
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        def run(self):
+            rate = Rate(1.0 / self.period)
+            while not self.stopped and not simulation.is_shutdown():
+                rate.sleep()
+                if self.stopped or simulation.is_shutdown():
+                    return
+                try:
+                    self.callback(None)
+                except Exception:
+                    simulation.error("timer callback")
+                if self.oneshot:
+                    return
+        def shutdown(self):
+            self.stopped = True
+
+    def init_node(name, *arguments, **keywords):
+        simulation.node_name = "/" + name.lstrip("/")
+
+    def spin():
+        while not simulation.is_shutdown():
+            clock.stopped.wait(1.0)
+
+    return module("rospy",
+        ROSException=ROSException,
+        ROSInterruptException=ROSInterruptException,
+        ServiceException=ServiceException,
+        Duration=Duration,
+        Time=Time,
+        Rate=Rate,
+        Timer=Timer,
+        Publisher=Publisher,
+        SubscribeListener=SubscribeListener,
+        Subscriber=Subscriber,
+        ServiceProxy=ServiceProxy,
+        init_node=init_node,
+        spin=spin,
+        get_name=lambda: simulation.node_name,
+        get_param=lambda name, default=None: simulation.parameters.get(name, default),
+        get_time=clock.time,
+        sleep=lambda duration: clock.sleep(duration.to_sec() if isinstance(duration, Duration) else duration),
+        is_shutdown=simulation.is_shutdown,
+        signal_shutdown=simulation.shutdown,
+        on_shutdown=simulation.shutdown_hooks.append,
+        wait_for_service=lambda name, timeout=None: None,
+        logdebug=lambda text, *arguments: simulation.log("debug", text % arguments if arguments else text),
+        loginfo=lambda text, *arguments: simulation.log("info", text % arguments if arguments else text),
+        logwarn=lambda text, *arguments: simulation.log("warn", text % arguments if arguments else text),
+        logerr=lambda text, *arguments: simulation.log("error", text % arguments if arguments else text),
+        logfatal=lambda text, *arguments: simulation.log("fatal", text % arguments if arguments else text))
+
+
+# The actionlib stand-in, servers run every goal in a thread of its own like actionlib does
+def actionlib_module(simulation):
+    clock = simulation.clock
+
+    class SimpleActionServer(object):
+        def __init__(self, name, ActionSpec, execute_cb=None, auto_start=True):
+            self.name = name
+            self.execute_callback = execute_cb
+            self.preempt_callback = None
+            self.lock = threading.Lock()
+            self.current = None
+            self.preempt_requested = False
+            self.feedback = 0
+            simulation.action_servers[name] = self
+
+        def start(self):
+            pass
+
+        def register_preempt_callback(self, preempt_callback):
+            self.preempt_callback = preempt_callback
+
+        def is_preempt_requested(self):
+            return self.preempt_requested
+
+        def is_active(self):
+            return self.current is not None and self.current.outcome is None
+
+        def publish_feedback(self, feedback):
+            self.feedback += 1
+
+        def set_succeeded(self, result=None, text=""):
+            self.finish("succeeded")
+
+        def set_aborted(self, result=None, text=""):
+            self.finish("aborted")
+
+        def set_preempted(self, result=None, text=""):
+            self.finish("preempted")
+
+        def finish(self, outcome):
+            with self.lock:
+                goal = self.current
+                if goal is None or goal.outcome is not None:
+                    simulation.log("error", self.name + ": To transition to a terminal state, the goal must be active")
+                    return
+                goal.outcome = outcome
+                goal.ended = clock.elapsed()
+                goal.real_ended = time.time()
+            simulation.goal_done(goal)
+            goal.done.set()
+
+        # Client side, starts the execute callback with the goal and returns the SimulatedGoal
+        def send_goal(self, goal):
+            simulated_goal = SimulatedGoal(self.name, goal, clock.elapsed())
+            with self.lock:
+                self.current = simulated_goal
+                self.preempt_requested = False
+            thread = threading.Thread(target=self.execute, args=(simulated_goal, ))
+            thread.daemon = True
+            thread.start()
+            return simulated_goal
+
+        # Client side, asks the running goal to stop
+        def preempt(self):
+            self.preempt_requested = True
+            if self.preempt_callback is not None:
+                try:
+                    self.preempt_callback()
+                except Exception:
+                    simulation.error(self.name + " preempt callback")
+
+        def execute(self, simulated_goal):
+            try:
+                self.execute_callback(simulated_goal.goal)
+            except Exception:
+                simulation.error(self.name + " execute callback")
+            if simulated_goal.outcome is None and self.current is simulated_goal:
+                simulation.log("warn", self.name + ": The execute callback did not set the goal to a terminal status, aborting")
+                self.set_aborted()
+
+    class SimpleActionClient(object):
+        def __init__(self, name, ActionSpec):
+            self.name = name
+
+        def target(self):
+            return simulation.action_targets.get(self.name)
+
+        def wait_for_server(self, timeout=None):
+            return self.target() is not None
+
+        def send_goal(self, goal, done_cb=None, active_cb=None, feedback_cb=None):
+            self.target().execute(goal, done_cb, active_cb, feedback_cb)
+
+        def cancel_all_goals(self):
+            if self.target() is not None:
+                self.target().cancel()
+
+        cancel_goal = cancel_all_goals
+
+        def get_state(self):
+            return self.target().state if self.target() is not None else PENDING
+
+    return module("actionlib", SimpleActionServer=SimpleActionServer, SimpleActionClient=SimpleActionClient)
+
+
+# Puts the stand-in modules in sys.modules, must run before navigationserver is imported
+def install(simulation):
+    modules = message_modules()
+    modules["roslib"] = module("roslib", load_manifest=lambda package: None)
+    modules["rospy"] = rospy_module(simulation)
+    modules["actionlib"] = actionlib_module(simulation)
+    transformations = module("tf.transformations", quaternion_from_euler=quaternion_from_euler)
+    modules["tf"] = module("tf", transformations=transformations)
+    modules["tf.transformations"] = transformations
+    sys.modules.update(modules)
+    return modules
+
+
+class SimulatedBase(object):
+    """SimulatedBase
+
+    Stands in for the move_base action of ROSARNL. Drives in a straight line
+    to the goal at base_speed, or in the travel time given for the goal
+    position, and publishes amcl_pose while it moves."""
+
+    base_speed = 0.5 # (m/s)
+    pose_period = 1.0 # (s) Simulated time between amcl_pose messages
+
+    def __init__(self, simulation, x=0.0, y=0.0, travel_times=None):
+        self.simulation = simulation
+        self.x = x
+        self.y = y
+        self.travel_times = travel_times if travel_times is not None else {} # (x, y) -> (s)
+        self.lock = threading.Lock()
+        self.goal_id = 0
+        self.state = PENDING
+        self.goals = 0
+        self.messages = sys.modules["geometry_msgs.msg"]
+        self.move_base = sys.modules["move_base_msgs.msg"]
+
+    def publish_pose(self):
+        message = self.messages.PoseWithCovarianceStamped()
+        message.header.stamp = self.simulation.clock.time()
+        message.header.frame_id = "map"
+        message.pose.pose.position.x = self.x
+        message.pose.pose.position.y = self.y
+        self.simulation.publish(POSE_TOPIC, message)
+
+    def execute(self, goal, done_cb, active_cb, feedback_cb):
+        with self.lock:
+            self.goal_id += 1
+            self.goals += 1
+            goal_id = self.goal_id
+        thread = threading.Thread(target=self.drive, args=(goal_id, goal, done_cb, active_cb, feedback_cb))
+        thread.daemon = True
+        thread.start()
+
+    def cancel(self):
+        with self.lock:
+            self.goal_id += 1
+
+    def drive(self, goal_id, goal, done_cb, active_cb, feedback_cb):
+        clock = self.simulation.clock
+        target_x = goal.target_pose.pose.position.x
+        target_y = goal.target_pose.pose.position.y
+        start_x, start_y = self.x, self.y
+        distance = math.hypot(target_x - start_x, target_y - start_y)
+        duration = self.travel_times.get((target_x, target_y), distance / self.base_speed)
+        started = clock.elapsed()
+        self.state = ACTIVE
+        if active_cb is not None:
+            active_cb()
+        while True:
+            clock.sleep(min(self.pose_period, started + duration - clock.elapsed()))
+            if goal_id != self.goal_id or self.simulation.is_shutdown():
+                self.state = PREEMPTED
+                if done_cb is not None:
+                    done_cb(PREEMPTED, self.move_base.MoveBaseResult())
+                return
+            progress = min(1.0, (clock.elapsed() - started) / duration) if duration > 0 else 1.0
+            self.x = start_x + (target_x - start_x) * progress
+            self.y = start_y + (target_y - start_y) * progress
+            self.publish_pose()
+            if progress >= 1.0:
+                self.state = SUCCEEDED
+                if done_cb is not None:
+                    done_cb(SUCCEEDED, self.move_base.MoveBaseResult())
+                return
+            if feedback_cb is not None:
+                feedback = self.move_base.MoveBaseFeedback()
+                feedback.base_position.pose.position.x = self.x
+                feedback.base_position.pose.position.y = self.y
+                feedback_cb(feedback)
+
+
+class SimulatedController(object):
+    """SimulatedController
+
+    Minimal stand-in for the cyborg_controller state machine. Follows
+    TRANSITIONS on the events published on register_event, preempts the
+    running state before it starts the next one, and moves on to talking when
+    moving ends. Records how long each transition took from the event to the
+    start of the next state."""
+
+    preempt_timeout = 120 # (s) Simulated time a state gets to honour a preempt
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.state = "idle"
+        self.goal = None
+        self.queue = queue.Queue()
+        self.latencies = collections.defaultdict(list) # "from>to" -> [(s)]
+        self.ignored = collections.Counter() # event -> count
+        self.timeouts = 0
+        self.feedback = 0 # Emotional feedback messages received
+        simulation.subscribe(EVENT_TOPIC, self.event_callback)
+        simulation.subscribe(FEEDBACK_TOPIC, self.feedback_callback)
+        simulation.goal_listeners.append(self.goal_callback)
+        self.messages = sys.modules["cyborg_controller.msg"]
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def event_callback(self, message):
+        self.queue.put(("event", message.data, self.simulation.clock.elapsed()))
+
+    def feedback_callback(self, message):
+        self.feedback += 1
+
+    def goal_callback(self, goal):
+        self.queue.put(("done", goal, goal.ended))
+
+    def server(self, state):
+        return self.simulation.action_servers[self.simulation.node_name + "/" + state]
+
+    def run(self):
+        while not self.simulation.is_shutdown():
+            try:
+                kind, value, triggered = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind == "event":
+                target = TRANSITIONS.get((self.state, value))
+                if target is None:
+                    self.ignored[value] += 1
+                else:
+                    self.enter(target, value, triggered)
+            elif value is self.goal: # Goals that were preempted to start another state are already handled
+                self.goal = None
+                if value.state == "moving" and value.outcome in ["succeeded", "aborted"]:
+                    self.enter("talking", "succeded" if value.outcome == "succeeded" else "aborted", triggered)
+                else:
+                    self.enter("idle", value.outcome, triggered)
+
+    def enter(self, target, event, triggered):
+        previous = self.state
+        if self.goal is not None:
+            self.server(self.goal.state).preempt()
+            deadline = time.time() + self.preempt_timeout / self.simulation.clock.speed
+            while not self.goal.done.wait(0.05):
+                if self.simulation.is_shutdown():
+                    return
+                if time.time() > deadline:
+                    self.timeouts += 1
+                    self.simulation.log("warn", "Controller: " + self.goal.state + " did not honour the preempt")
+                    break
+            self.goal = None
+        self.state = target
+        if target != "idle":
+            self.goal = self.server(target).send_goal(self.messages.StateMachineGoal(event=event))
+        self.latencies[previous + ">" + target].append(self.simulation.clock.elapsed() - triggered)
+        self.simulation.log("debug", "Controller: " + previous + " -> " + target + " on " + str(event))
+
+
+class Replayer(object):
+    """Replayer
+
+    Publishes recorded rows at their time column (simulated seconds from the
+    start). A row with x and y is an amcl_pose, text is speech from
+    text_from_speech, emotion is an emotional_state, event is published on
+    register_event and map switches the navigation server to that map. Rows
+    may combine several of them."""
+
+    def __init__(self, simulation, records, loop=False):
+        self.simulation = simulation
+        self.rows = sorted([record for record in records if record.get("time") not in [None, ""]], key=lambda record: float(record["time"]))
+        self.loop = loop
+        self.replayed = 0
+        self.messages = sys.modules["geometry_msgs.msg"]
+        self.strings = sys.modules["std_msgs.msg"]
+        self.emotions = sys.modules["cyborg_controller.msg"]
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        if len(self.rows) > 0:
+            self.thread.start()
+
+    def run(self):
+        period = max(float(self.rows[-1]["time"]), 1.0)
+        offset = 0.0
+        while not self.simulation.is_shutdown():
+            for row in self.rows:
+                self.simulation.clock.sleep_until(offset + float(row["time"]))
+                if self.simulation.is_shutdown():
+                    return
+                self.publish(row)
+            if not self.loop:
+                return
+            offset += period
+
+    def publish(self, row):
+        self.replayed += 1
+        if row.get("x") not in [None, ""] and row.get("y") not in [None, ""]:
+            message = self.messages.PoseWithCovarianceStamped()
+            message.header.stamp = self.simulation.clock.time()
+            message.header.frame_id = "map"
+            message.pose.pose.position.x = float(row["x"])
+            message.pose.pose.position.y = float(row["y"])
+            self.simulation.publish(POSE_TOPIC, message)
+        if row.get("emotion") not in [None, ""]:
+            self.simulation.publish(EMOTION_TOPIC, self.emotions.EmotionalState(to_emotional_state=row["emotion"]))
+        if row.get("text") not in [None, ""]:
+            self.simulation.publish(TEXT_TOPIC, self.strings.String(data=row["text"]))
+        if row.get("event") not in [None, ""]:
+            self.simulation.publish(EVENT_TOPIC, self.strings.String(data=row["event"]))
+        if row.get("map") not in [None, ""]:
+            self.simulation.publish(self.simulation.node_name + "/map_name", self.strings.String(data=row["map"]))
+
+
+def summary(samples):
+    if len(samples) == 0:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {"count": len(ordered), "p50": ordered[len(ordered) // 2], "p99": ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))], "max": ordered[-1], "mean": sum(ordered) / len(ordered)}
+
+
+def report(simulation, controller, base, replayer, metrics, options, real_seconds):
+    states = {}
+    for goal in simulation.goals:
+        states.setdefault(goal.state, []).append(goal)
+    return {
+        "parameters": {"speed": options.speed, "duration": options.duration, "start_date": options.start_date, "map": options.map, "replay": options.replay, "loop": options.loop, "base_speed": options.base_speed},
+        "simulated_seconds": simulation.clock.elapsed(),
+        "real_seconds": real_seconds,
+        "errors": simulation.errors,
+        "states": dict((state, {
+            "outcomes": dict(collections.Counter([goal.outcome for goal in goals])),
+            "events": dict(collections.Counter([goal.event for goal in goals])),
+            "duration_s": summary([goal.ended - goal.started for goal in goals]),
+            "real_duration_s": summary([goal.real_ended - goal.real_started for goal in goals]),
+        }) for state, goals in states.items()),
+        "transitions_s": dict((transition, summary(latencies)) for transition, latencies in controller.latencies.items()),
+        "ignored_events": dict(controller.ignored),
+        "preempt_timeouts": controller.timeouts,
+        "emotional_feedback": controller.feedback,
+        "published": dict(simulation.published),
+        "services": dict(simulation.services),
+        "base_goals": base.goals,
+        "replayed": replayer.replayed,
+        "metrics": metrics.snapshot(),
+    }
+
+
+def main(arguments=None):
+    from navigationdb import read_records
+    parser = argparse.ArgumentParser(description="Run the NavigationServer without ROS against simulated topics, a simulated base and a simulated state machine.")
+    parser.add_argument("--database", default=None, help="database file, a temporary copy of the navigation.py database by default")
+    parser.add_argument("--map", default="ntnu2.map")
+    parser.add_argument("--replay", action="append", default=[], help="csv or jsonl file with time and x/y, text, emotion or event columns, may be repeated")
+    parser.add_argument("--loop", action="store_true", help="repeat the replay files until the end of the simulation")
+    parser.add_argument("--duration", type=float, default=600.0, help="simulated seconds to run")
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated seconds per real second")
+    parser.add_argument("--start-date", default=START_DATE, help="simulated date and time at the start")
+    parser.add_argument("--start-location", default=None, help="location the base starts at, (0, 0) by default")
+    parser.add_argument("--emotion", default="neutral", help="emotional state at the start")
+    parser.add_argument("--base-speed", type=float, default=SimulatedBase.base_speed, help="(m/s)")
+    parser.add_argument("--travel-time", action="append", default=[], metavar="LOCATION=SECONDS", help="fixed travel time to a location, may be repeated")
+    parser.add_argument("--metrics-file", default="", help="Prometheus text file the server writes its metrics to")
+    parser.add_argument("--record-directory", default="", help="directory the server records poses, locations, events and decisions in")
+    parser.add_argument("--output", default="-", help="JSON report file, - for standard output")
+    parser.add_argument("--verbose", action="store_true", help="print the log of the server and the simulation")
+    options = parser.parse_args(arguments)
+
+    from intervalindex import parse_date
+    start_date = parse_date(options.start_date)
+    if start_date is None:
+        parser.error("unable to parse --start-date " + options.start_date)
+    clock = SimulatedClock(speed=options.speed, start_date=start_date)
+    simulation = Simulation(clock, verbose=options.verbose)
+    install(simulation)
+    import navigationserver
+    import navigationfleet
+    from navigation import create_database
+    from databasehandler import DatabaseHandler
+    for module in [navigationserver, navigationfleet]: # The server times its states with time and datetime, and the scheduler sleeps on a Condition
+        module.time = clock
+        module.datetime = clock.datetime_module()
+        module.threading = clock.threading_module()
+
+    path = options.database
+    temporary = path is None
+    if temporary:
+        handle, path = tempfile.mkstemp(suffix=".db", prefix="navigation_simulation_")
+        os.close(handle)
+        os.remove(path)
+        create_database(path)
+    try:
+        database_handler = DatabaseHandler(filename=path)
+        travel_times = {}
+        for travel_time in options.travel_time:
+            name, seconds = travel_time.rsplit("=", 1)
+            location = database_handler.search_for_location(location_name=name)
+            if location is None:
+                parser.error("unknown location in --travel-time " + travel_time)
+            travel_times[(location.x, location.y)] = float(seconds)
+        start = database_handler.search_for_location(location_name=options.start_location) if options.start_location is not None else None
+        if options.start_location is not None and start is None:
+            parser.error("unknown --start-location " + options.start_location)
+        database_handler.close()
+
+        rospy = sys.modules["rospy"]
+        rospy.init_node("cyborg_navigation")
+        base = SimulatedBase(simulation, x=start.x if start is not None else 0.0, y=start.y if start is not None else 0.0, travel_times=travel_times)
+        base.base_speed = options.base_speed
+        simulation.action_targets[BASE_ACTION] = base
+        controller = SimulatedController(simulation)
+        records = []
+        for replay in options.replay:
+            records.extend(read_records(replay))
+        replayer = Replayer(simulation, records, loop=options.loop)
+        simulation.subscribe(SPEECH_TOPIC, lambda message: simulation.log("info", "Speech: " + message.data))
+
+        real_started = time.time()
+        navigation_server = navigationserver.NavigationServer(database_file=path, metrics_file=options.metrics_file, map_name=options.map, record_directory=options.record_directory)
+        if navigation_server.recorder is not None:
+            navigation_server.recorder.clock = clock.time # Records are stamped with the simulated time, the writer thread runs in real time
+        simulation.publish(EMOTION_TOPIC, sys.modules["cyborg_controller.msg"].EmotionalState(to_emotional_state=options.emotion))
+        base.publish_pose()
+        controller.start()
+        replayer.start()
+        try:
+            clock.sleep_until(options.duration)
+        except KeyboardInterrupt:
+            pass
+        simulation.shutdown("end of simulation")
+        real_seconds = time.time() - real_started
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread() and thread.daemon:
+                thread.join(1.0)
+
+        if options.metrics_file != "":
+            navigation_server.metrics.write(options.metrics_file)
+        text = json.dumps(report(simulation, controller, base, replayer, navigation_server.metrics, options, real_seconds), indent=2, sort_keys=True)
+        if options.output == "-":
+            sys.stdout.write(text + "\n")
+        else:
+            with open(options.output, "w") as output:
+                output.write(text + "\n")
+        return 1 if simulation.errors > 0 else 0
+    finally:
+        if temporary:
+            for suffix in ["", "-wal", "-shm"]:
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import re
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+# Words in a response message that are replaced when the response is spoken
+PLACEHOLDERS = ["LOCATION", "EMOTION", "EVENT"]
+PLACEHOLDER_PATTERN = re.compile("|".join(sorted(PLACEHOLDERS, key=len, reverse=True)))
+
+
+class ResponseTemplate(object):
+    """ResponseTemplate
+
+    A response message split once into literal text and placeholders.
+    render() fills in the placeholders from a dictionary of strings, a
+    placeholder without a value is spoken as written."""
+
+    __slots__ = ["message", "parts", "placeholders"]
+
+    def __init__(self, message):
+        self.message = message
+        self.parts = [] # Literal strings, and (placeholder, ) tuples
+        self.placeholders = set()
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(message):
+            if match.start() > position:
+                self.parts.append(message[position:match.start()])
+            self.parts.append((match.group(0), ))
+            self.placeholders.add(match.group(0))
+            position = match.end()
+        if position < len(message):
+            self.parts.append(message[position:])
+
+    def render(self, values):
+        if len(self.placeholders) == 0:
+            return self.message
+        return "".join([part if not isinstance(part, tuple) else values.get(part[0], part[0]) for part in self.parts])
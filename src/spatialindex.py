@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import math
+import numpy
+from locationcolumns import LocationSequence, location_column
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+
+class SpatialIndex(object):
+    """SpatialIndex
+
+    Uniform grid over the locations of one map. Every location is registered
+    in each cell its threshold circle overlaps, so a threshold lookup only
+    has to check the candidates of a single cell. Locations covering more
+    than max_cells_per_location cells are kept in a small list that is
+    always checked."""
+
+    max_cells_per_location = 64
+    batch_size = 65536 # Points resolved per vectorized step, bounds the temporary arrays
+
+    def __init__(self, locations, cell_size=None):
+        self.locations = locations if isinstance(locations, LocationSequence) else list(locations) # A LocationSequence is read column by column
+        self.x = location_column(self.locations, "x")
+        self.y = location_column(self.locations, "y")
+        self.threshold = location_column(self.locations, "threshold")
+        if cell_size is None:
+            positive = self.threshold[self.threshold > 0]
+            cell_size = float(numpy.median(positive)) if len(positive) > 0 else 1.0
+        self.cell_size = cell_size
+
+        cells = {}
+        large = []
+        for i in range(len(self.locations)):
+            radius = max(self.threshold[i], 0.0)
+            min_cx, min_cy = self.cell(self.x[i] - radius, self.y[i] - radius)
+            max_cx, max_cy = self.cell(self.x[i] + radius, self.y[i] + radius)
+            if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > self.max_cells_per_location:
+                large.append(i)
+                continue
+            for cx in range(min_cx, max_cx + 1):
+                for cy in range(min_cy, max_cy + 1):
+                    cells.setdefault((cx, cy), []).append(i)
+        self.cells = dict((key, numpy.array(value, dtype=numpy.intp)) for key, value in cells.items())
+        self.large = numpy.array(large, dtype=numpy.intp)
+        self.empty = numpy.array([], dtype=numpy.intp)
+        # The grid flattened into sorted cell codes with offsets into one member array, used by the batch lookup
+        self.cell_keys = numpy.array([], dtype=numpy.int64)
+        if len(self.cells) > 0:
+            keys = numpy.array(list(self.cells.keys()), dtype=numpy.int64)
+            self.cell_min = keys.min(axis=0)
+            self.cell_max = keys.max(axis=0)
+            self.cell_span = self.cell_max[1] - self.cell_min[1] + 1
+            codes = (keys[:, 0] - self.cell_min[0]) * self.cell_span + (keys[:, 1] - self.cell_min[1])
+            order = numpy.argsort(codes)
+            self.cell_keys = codes[order]
+            members = [self.cells[(int(keys[i][0]), int(keys[i][1]))] for i in order]
+            self.cell_offsets = numpy.concatenate(([0], numpy.cumsum([len(m) for m in members]))).astype(numpy.intp)
+            self.cell_members = numpy.concatenate(members)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def candidates(self, x, y):
+        found = self.cells.get(self.cell(x, y), self.empty)
+        return numpy.concatenate((found, self.large)) if len(self.large) > 0 else found
+
+    # Returns the indices of the locations whose threshold contains (x, y), closest first
+    def indices_within_threshold(self, x, y):
+        candidates = self.candidates(x, y)
+        distance = numpy.hypot(self.x[candidates] - x, self.y[candidates] - y)
+        inside = distance < self.threshold[candidates]
+        candidates = candidates[inside]
+        return candidates[numpy.argsort(distance[inside], kind="mergesort")]
+
+    # Returns every location whose threshold contains (x, y), closest first
+    def all_within_threshold(self, x, y):
+        return [self.locations[i] for i in self.indices_within_threshold(x, y)]
+
+    # Returns the closest location whose threshold contains (x, y), or None
+    def within_threshold(self, x, y):
+        indices = self.indices_within_threshold(x, y)
+        return self.locations[indices[0]] if len(indices) > 0 else None
+
+    # Returns the closest location to (x, y) regardless of thresholds, or None if the index is empty
+    def nearest(self, x, y):
+        if len(self.locations) == 0:
+            return None
+        cx, cy = self.cell(x, y)
+        best = None
+        best_distance = float("inf")
+        if len(self.large) > 0:
+            distance = numpy.hypot(self.x[self.large] - x, self.y[self.large] - y)
+            best = self.large[numpy.argmin(distance)]
+            best_distance = distance.min()
+        if len(self.cells) > 0:
+            # Search rings of cells outwards until no unvisited cell can hold anything closer
+            extent = int(max(abs(cx - self.cell_min[0]), abs(cx - self.cell_max[0]), abs(cy - self.cell_min[1]), abs(cy - self.cell_max[1])))
+            ring = 0
+            while ring <= extent and best_distance > (ring - 1) * self.cell_size:
+                if (2 * ring + 1) ** 2 > len(self.cells):
+                    candidates = numpy.arange(len(self.locations)) # Sparse grid, a full scan is cheaper
+                    ring = extent
+                else:
+                    candidates = self.ring_candidates(cx, cy, ring)
+                if len(candidates) > 0:
+                    distance = numpy.hypot(self.x[candidates] - x, self.y[candidates] - y)
+                    i = numpy.argmin(distance)
+                    if distance[i] < best_distance:
+                        best = candidates[i]
+                        best_distance = distance[i]
+                ring += 1
+        return self.locations[best] if best is not None else None
+
+    def ring_candidates(self, cx, cy, ring):
+        if ring == 0:
+            return self.cells.get((cx, cy), self.empty)
+        found = []
+        for dx in range(-ring, ring + 1):
+            for dy in (-ring, ring) if abs(dx) != ring else range(-ring, ring + 1):
+                cell = self.cells.get((cx + dx, cy + dy))
+                if cell is not None:
+                    found.append(cell)
+        return numpy.concatenate(found) if len(found) > 0 else self.empty
+
+    # Vectorized within_threshold() for many points. Returns an index array, -1 where no location matches
+    def batch_indices_within_threshold(self, xs, ys):
+        xs = numpy.asarray(xs, dtype=numpy.float64)
+        ys = numpy.asarray(ys, dtype=numpy.float64)
+        result = numpy.full(len(xs), -1, dtype=numpy.intp)
+        for start in range(0, len(xs), self.batch_size):
+            stop = start + self.batch_size
+            result[start:stop] = self.batch_chunk(xs[start:stop], ys[start:stop])
+        return result
+
+    def batch_chunk(self, xs, ys):
+        result = numpy.full(len(xs), -1, dtype=numpy.intp)
+        best_distance = numpy.full(len(xs), numpy.inf)
+        if len(self.cell_keys) > 0:
+            # Expand every query point into (point, candidate) pairs using the flattened grid
+            cxs = numpy.floor(xs / self.cell_size).astype(numpy.int64)
+            cys = numpy.floor(ys / self.cell_size).astype(numpy.int64)
+            inside = (cxs >= self.cell_min[0]) & (cxs <= self.cell_max[0]) & (cys >= self.cell_min[1]) & (cys <= self.cell_max[1])
+            codes = (cxs - self.cell_min[0]) * self.cell_span + (cys - self.cell_min[1])
+            rows = numpy.minimum(numpy.searchsorted(self.cell_keys, codes), len(self.cell_keys) - 1)
+            hit = inside & (self.cell_keys[rows] == codes)
+            counts = numpy.where(hit, self.cell_offsets[rows + 1] - self.cell_offsets[rows], 0)
+            points = numpy.repeat(numpy.arange(len(xs)), counts)
+            within = numpy.arange(len(points)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+            candidates = self.cell_members[self.cell_offsets[rows][points] + within]
+            distance = numpy.hypot(xs[points] - self.x[candidates], ys[points] - self.y[candidates])
+            matches = distance < self.threshold[candidates]
+            points, candidates, distance = points[matches], candidates[matches], distance[matches]
+            # Keep the closest candidate per point
+            order = numpy.lexsort((distance, points))
+            points, candidates, distance = points[order], candidates[order], distance[order]
+            first = numpy.ones(len(points), dtype=bool)
+            first[1:] = points[1:] != points[:-1]
+            result[points[first]] = candidates[first]
+            best_distance[points[first]] = distance[first]
+        if len(self.large) > 0:
+            distance = numpy.hypot(xs[:, None] - self.x[None, self.large], ys[:, None] - self.y[None, self.large])
+            distance[distance >= self.threshold[None, self.large]] = numpy.inf
+            best = numpy.argmin(distance, axis=1)
+            best_large = distance[numpy.arange(len(xs)), best]
+            closer = best_large < best_distance
+            result[closer] = self.large[best[closer]]
+        return result
+
+    # Vectorized within_threshold() for many points. Returns a list with a location or None per point
+    def batch_within_threshold(self, xs, ys):
+        return [self.locations[i] if i >= 0 else None for i in self.batch_indices_within_threshold(xs, ys)]
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import math
+import threading
+
+__author__ = "Thomas Rostrup Andersen"
+__copyright__ = "Copyright (C) 2016 Thomas Rostrup Andersen"
+#__license__ = ""
+__version__ = "0.0.2"
+__all__ = []
+
+
+class QuantileEstimator(object):
+    """QuantileEstimator
+
+    Streaming estimate of one quantile with the P-square algorithm (Jain and
+    Chlamtac, 1985): five markers, constant memory and time per value."""
+
+    __slots__ = ["fraction", "heights", "positions", "desired", "increments", "count"]
+
+    def __init__(self, fraction):
+        self.fraction = fraction
+        self.heights = [] # Marker heights, the first five values until there are five
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0.0, 2 * fraction, 4 * fraction, 2 + 2 * fraction, 4.0]
+        self.increments = [0.0, fraction / 2, fraction, (1 + fraction) / 2, 1.0]
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        heights = self.heights
+        if self.count <= 5:
+            heights.append(value)
+            heights.sort()
+            return
+        if value < heights[0]:
+            heights[0] = value
+            k = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= heights[k + 1]:
+                k += 1
+        positions = self.positions
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in range(1, 4): # Moves the middle markers towards their desired positions
+            d = self.desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self.parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + d * (heights[i + d] - heights[i]) / float(positions[i + d] - positions[i])
+                heights[i] = height
+                positions[i] += d
+
+    def parabolic(self, i, d):
+        q = self.heights
+        n = self.positions
+        return q[i] + d / float(n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / float(n[i + 1] - n[i]) + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / float(n[i] - n[i - 1]))
+
+    # The estimate, exact (nearest rank) for the first five values, None before any
+    def value(self):
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            return self.heights[max(int(math.ceil(self.fraction * len(self.heights))) - 1, 0)]
+        return self.heights[2]
+
+
+class TravelStatistics(object):
+    """TravelStatistics
+
+    Streaming statistics of the durations (s) of the moves between two
+    locations: count, mean and variance (Welford), median and p95."""
+
+    __slots__ = ["count", "mean", "m2", "median", "high"]
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.median = QuantileEstimator(0.50)
+        self.high = QuantileEstimator(0.95)
+
+    def add(self, duration):
+        self.count += 1
+        delta = duration - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (duration - self.mean)
+        self.median.add(duration)
+        self.high.add(duration)
+
+    def deviation(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def summary(self):
+        return {"count": self.count, "mean": self.mean, "deviation": self.deviation(), "p50": self.median.value(), "p95": self.high.value()}
+
+
+class TravelTimes(object):
+    """TravelTimes
+
+    What the recorded moves say about travel times, kept per (from, to)
+    location pair and per destination from anywhere. Only succeeded moves
+    are counted, a timed out or aborted move says little about how long the
+    trip takes. Pairs with fewer than min_samples moves fall back on the
+    destination, then on the straight line distance."""
+
+    min_samples = 3 # Moves a pair (or destination) needs before its statistics are used
+    timeout_factor = 1.5 # The timeout of a move is its p95 travel time times this, plus timeout_margin
+    timeout_margin = 30.0 # (s)
+    nominal_speed = 0.5 # (m/s) Expected average speed of a move without statistics
+    minimum_speed = 0.2 # (m/s) Slowest acceptable average speed, sets the timeout of a move without statistics
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pairs = {} # (from location_name or None, to location_name) -> TravelStatistics
+
+    # Counts a move that took duration (s), from_location may be None when the robot was not at a known location
+    def add(self, from_location, to_location, duration):
+        with self.lock:
+            keys = [(from_location, to_location)] if from_location is None else [(from_location, to_location), (None, to_location)]
+            for key in keys:
+                statistics = self.pairs.get(key)
+                if statistics is None:
+                    statistics = self.pairs[key] = TravelStatistics()
+                statistics.add(duration)
+
+    # The statistics of the pair, or of the destination from anywhere, with at least min_samples moves, or None
+    def statistics(self, from_location, to_location):
+        with self.lock:
+            for key in [(from_location, to_location), (None, to_location)]:
+                statistics = self.pairs.get(key)
+                if statistics is not None and statistics.count >= self.min_samples:
+                    return statistics
+        return None
+
+    # Expected duration (s) of the move, distance (m) is the straight line distance of it
+    def expected(self, from_location, to_location, distance):
+        statistics = self.statistics(from_location, to_location)
+        if statistics is not None:
+            return statistics.mean
+        return distance / self.nominal_speed
+
+    # How long (s) the move may take before it is given up, at most maximum
+    def timeout(self, from_location, to_location, distance, maximum):
+        statistics = self.statistics(from_location, to_location)
+        if statistics is not None:
+            timeout = statistics.high.value() * self.timeout_factor + self.timeout_margin
+        else:
+            timeout = distance / self.minimum_speed + self.timeout_margin
+        return min(timeout, maximum)
+
+    # Returns {"from -> to": summary} of every pair, "*" for from anywhere
+    def summary(self):
+        with self.lock:
+            pairs = list(self.pairs.items())
+        return dict(((from_location if from_location is not None else "*") + " -> " + to_location, statistics.summary()) for (from_location, to_location), statistics in pairs)
@@ -0,0 +1,8 @@
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import os
+import sys
+
+# The modules live flat in src/ (catkin installs them as scripts), so the tests import them from there. No ROS is needed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
@@ -0,0 +1,81 @@
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import itertools
+import math
+import random
+from databasehandler import LocationRecord
+from distancematrix import DistanceMatrix
+
+
+def random_locations(rng, count):
+    return [LocationRecord("location %d" % i, "ntnu2.map", rng.uniform(-30.0, 30.0), rng.uniform(-30.0, 30.0), 0, 0, 0, 0, 2.0, rng.random() < 0.5, 0) for i in range(count)]
+
+
+# The reference: the length of the open tour, computed from the records
+def brute_length(locations, x, y, order):
+    length = 0.0
+    for location in [locations[i] for i in order]:
+        length += math.hypot(location.x - x, location.y - y)
+        x, y = location.x, location.y
+    return length
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(11)
+    locations = random_locations(rng, 200)
+    matrix = DistanceMatrix(locations)
+    for n in range(100):
+        x, y = rng.uniform(-40.0, 40.0), rng.uniform(-40.0, 40.0)
+        count = rng.randint(1, 250)
+        crowded = rng.choice([None, True, False])
+        exclude = set(location.location_name for location in rng.sample(locations, 10))
+        expected = sorted((math.hypot(location.x - x, location.y - y), i) for i, location in enumerate(locations) if (crowded is None or location.crowded == crowded) and location.location_name not in exclude)
+        assert matrix.nearest(x, y, count, crowded, exclude) == [i for distance, i in expected[:count]]
+
+
+def test_tour_is_a_short_permutation():
+    rng = random.Random(13)
+    locations = random_locations(rng, 60)
+    for size in [0, 1, 2, 5, 7]:
+        matrix = DistanceMatrix(locations)
+        indices = rng.sample(range(len(locations)), size)
+        tour = matrix.tour(0.0, 0.0, indices)
+        assert sorted(tour) == sorted(indices)
+        assert abs(matrix.tour_length(0.0, 0.0, tour) - brute_length(locations, 0.0, 0.0, tour)) < 1e-3
+        if size > 0:
+            best = min(brute_length(locations, 0.0, 0.0, order) for order in itertools.permutations(indices))
+            assert brute_length(locations, 0.0, 0.0, tour) <= 1.25 * best + 1e-6
+
+
+def test_tour_is_no_longer_than_nearest_neighbour():
+    rng = random.Random(17)
+    locations = random_locations(rng, 300)
+    matrix = DistanceMatrix(locations)
+    for n in range(10):
+        indices = rng.sample(range(len(locations)), 30)
+        order, x, y = [], 0.0, 0.0
+        remaining = list(indices)
+        while remaining:
+            i = min(remaining, key=lambda i: math.hypot(locations[i].x - x, locations[i].y - y))
+            order.append(i)
+            remaining.remove(i)
+            x, y = locations[i].x, locations[i].y
+        tour = matrix.tour(0.0, 0.0, indices)
+        assert brute_length(locations, 0.0, 0.0, tour) <= brute_length(locations, 0.0, 0.0, order) + 1e-3
+
+
+def test_tour_with_cost_and_without_matrix():
+    rng = random.Random(19)
+    locations = random_locations(rng, 20)
+    indices = list(range(6))
+    matrix = DistanceMatrix(locations)
+    assert matrix.tour(0.0, 0.0, indices, cost=lambda i, j, distance: distance) == matrix.tour(0.0, 0.0, indices)
+    DistanceMatrix.max_matrix_locations, limit = 0, DistanceMatrix.max_matrix_locations
+    try:
+        rows = DistanceMatrix(locations)
+    finally:
+        DistanceMatrix.max_matrix_locations = limit
+    assert rows.matrix is None
+    assert abs(rows.tour_length(0.0, 0.0, indices) - matrix.tour_length(0.0, 0.0, indices)) < 1e-3
+    assert abs(rows.submatrix(indices) - matrix.submatrix(indices)).max() < 1e-3
@@ -0,0 +1,110 @@
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import datetime
+import pytest
+from databasehandler import ScheduleRecord, schedule_occurrence
+from eventschedule import CronRule, EventSchedule, ScheduleIndex, parse_field
+
+MINUTE = datetime.timedelta(minutes=1)
+
+
+def schedule(rule, duration, first_date=None, last_date=None, exceptions="", schedule_id=1):
+    return ScheduleRecord(schedule_id, "event " + str(schedule_id), "home", rule, duration, first_date, last_date, exceptions, False, "ntnu2.map", 0, 0, 0, 0, 0, 0, 3, False, 0)
+
+
+# The reference: every minute from start to end that the five fields match, as cron reads them
+def brute_starts(text, start, end):
+    minute, hour, day, month, weekday = text.split()
+    def matches(field, value, low, high):
+        return value in parse_field(field, low, high)
+    moment = start
+    found = []
+    while moment < end:
+        cron_weekday = (moment.weekday() + 1) % 7 # Monday is 0 in Python, 1 in cron
+        day_matches = matches(day, moment.day, 1, 31)
+        weekday_matches = matches(weekday, cron_weekday, 0, 7) or (cron_weekday == 0 and matches(weekday, 7, 0, 7))
+        if day == "*" or weekday == "*":
+            date_matches = day_matches and weekday_matches
+        else:
+            date_matches = day_matches or weekday_matches
+        if date_matches and matches(month, moment.month, 1, 12) and matches(hour, moment.hour, 0, 23) and matches(minute, moment.minute, 0, 59):
+            found.append(moment)
+        moment += MINUTE
+    return found
+
+
+@pytest.mark.parametrize("text", ["0 12 * * *", "30 10 * * 3", "*/20 23 * * *", "0 0 1 * *", "15 6 29 2 *", "0 9 1,15 * 0", "0 8-10/2 * * 1-5", "59 23 31 * *", "0 0 * * 7"])
+def test_starts_match_brute_force(text):
+    # Across the end of a leap February and two month ends, so day, week and month rollover are all crossed
+    start = datetime.datetime(2024, 2, 25, 0, 0)
+    end = datetime.datetime(2024, 3, 3, 0, 0)
+    assert list(CronRule(text).starts(start, end)) == brute_starts(text, start, end)
+    start = datetime.datetime(2024, 12, 29, 12, 0)
+    end = datetime.datetime(2025, 1, 2, 12, 0)
+    assert list(CronRule(text).starts(start, end)) == brute_starts(text, start, end)
+
+
+def test_aliases_and_invalid_rules():
+    assert CronRule("@daily").times == [datetime.time(0, 0)]
+    assert CronRule("@hourly").times == [datetime.time(hour, 0) for hour in range(24)]
+    for text in ["0 12 * *", "60 * * * *", "0 24 * * *", "0 0 0 * *", "*/0 * * * *", "5-1 * * * *"]:
+        with pytest.raises(ValueError):
+            CronRule(text)
+
+
+def test_exceptions_first_and_last_date():
+    event = EventSchedule(schedule("0 12 * * *", 3600, first_date="2017-01-02 00:00:00", last_date="2017-01-06 00:00:00", exceptions="2017-01-03, 2017-01-05"))
+    starts = [start for start, end in event.occurrences(datetime.datetime(2017, 1, 1), datetime.datetime(2017, 1, 10))]
+    assert starts == [datetime.datetime(2017, 1, 2, 12), datetime.datetime(2017, 1, 4, 12)]
+    with pytest.raises(ValueError):
+        EventSchedule(schedule("0 12 * * *", 60, exceptions="not a date"))
+
+
+# The reference for a ScheduleIndex: the occurrences of a wide range, active strictly between start and end
+def brute_active(events, t):
+    found = []
+    for event in events:
+        for start, end in event.occurrences(t - datetime.timedelta(days=3), t + datetime.timedelta(days=3)):
+            if start < t < end:
+                found.append((start, end, event.record.schedule_id))
+    return sorted(found)
+
+
+def test_index_matches_brute_force_across_windows():
+    records = [
+        schedule("30 23 * * *", 3600, schedule_id=1), # Runs over midnight
+        schedule("0 10 * * 0", 7200, schedule_id=2), # Weekly, on Sunday
+        schedule("*/45 * * * *", 600, exceptions="2017-01-10", schedule_id=3),
+        schedule("0 12 * * *", 60, first_date="2017-01-05 00:00:00", last_date="2017-01-12 00:00:00", schedule_id=4),
+    ]
+    index = ScheduleIndex(records, schedule_occurrence)
+    events = [EventSchedule(record) for record in records]
+    t = datetime.datetime(2017, 1, 1, 0, 0)
+    while t < datetime.datetime(2017, 1, 22):
+        assert sorted((start, end, record.event_name) for start, end, record in index.active(t)) == [(start, end, "event " + str(schedule_id)) for start, end, schedule_id in brute_active(events, t)]
+        t += datetime.timedelta(minutes=7)
+
+
+def test_index_across_midnight_and_window_end():
+    index = ScheduleIndex([schedule("30 23 * * *", 3600)], schedule_occurrence)
+    index.covering(datetime.datetime(2017, 1, 1)) # The window is 2017-01-01 .. 2017-01-08
+    after_midnight = datetime.datetime(2017, 1, 8, 0, 15) # In the next window, the occurrence started in this one
+    assert [start for start, end, record in index.active(after_midnight)] == [datetime.datetime(2017, 1, 7, 23, 30)]
+    assert index.active(datetime.datetime(2017, 1, 8, 23, 30)) == [] # Starts are not active, as with Event
+    assert index.active(datetime.datetime(2017, 1, 9, 0, 30)) == []
+
+
+def test_next_boundary():
+    index = ScheduleIndex([schedule("0 12 * * *", 3600)], schedule_occurrence)
+    assert index.next_boundary(datetime.datetime(2017, 1, 1, 11, 0)) == datetime.datetime(2017, 1, 1, 12, 0)
+    assert index.next_boundary(datetime.datetime(2017, 1, 1, 12, 0)) == datetime.datetime(2017, 1, 1, 13, 0)
+    assert index.next_boundary(datetime.datetime(2017, 1, 1, 13, 0)) == datetime.datetime(2017, 1, 2, 12, 0)
+    empty = ScheduleIndex([schedule("0 12 29 2 *", 60, first_date="2017-01-01 00:00:00", last_date="2017-12-31 00:00:00")], schedule_occurrence)
+    t = datetime.datetime(2017, 3, 1, 5, 0)
+    assert empty.next_boundary(t) == datetime.datetime(2017, 3, 8) # Nothing changes in the window, its end is the boundary
+
+
+def test_invalid_schedules_are_ignored():
+    index = ScheduleIndex([schedule("not a rule", 60), schedule("0 12 * * *", 60, schedule_id=2)], schedule_occurrence)
+    assert len(index) == 1
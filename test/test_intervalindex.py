@@ -0,0 +1,78 @@
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import datetime
+import random
+from intervalindex import IntervalIndex, parse_date
+
+
+# The reference: every interval with start < t < end, and the first start or end after t
+def brute_active(intervals, t):
+    return sorted(interval for interval in intervals if interval[0] < t < interval[1])
+
+
+def brute_next_boundary(intervals, t):
+    boundaries = [value for start, end, item in intervals if start < end for value in (start, end) if value > t]
+    return min(boundaries) if len(boundaries) > 0 else None
+
+
+def test_matches_brute_force():
+    generator = random.Random(4)
+    for trial in range(50):
+        intervals = []
+        for item in range(generator.randint(0, 40)):
+            start = generator.randint(0, 100)
+            intervals.append((start, start + generator.randint(-5, 30), item)) # Some end before they start
+        index = IntervalIndex(intervals)
+        for t in range(-2, 135):
+            assert sorted(index.active(t)) == brute_active(intervals, t)
+            assert index.next_boundary(t) == brute_next_boundary(intervals, t)
+            latest = index.latest_active(t)
+            expected = brute_active(intervals, t)
+            if len(expected) == 0:
+                assert latest is None
+            else:
+                assert latest[0] == max(interval[0] for interval in expected)
+
+
+def test_bounds_are_strict():
+    index = IntervalIndex([(10, 20, "a")])
+    assert index.active(10) == []
+    assert index.active(20) == []
+    assert index.active(10.5) == [(10, 20, "a")]
+    assert index.active(19.999) == [(10, 20, "a")]
+    assert index.next_boundary(9) == 10
+    assert index.next_boundary(10) == 20 # Strictly after
+    assert index.next_boundary(20) is None
+
+
+def test_empty_and_inverted_intervals_are_never_active():
+    index = IntervalIndex([(10, 10, "empty"), (20, 15, "inverted")])
+    assert len(index) == 0
+    for t in range(0, 30):
+        assert index.active(t) == []
+        assert index.next_boundary(t) is None
+
+
+def test_touching_intervals():
+    index = IntervalIndex([(0, 10, "a"), (10, 20, "b")])
+    assert index.active(10) == []
+    assert [item for start, end, item in index.active(9)] == ["a"]
+    assert [item for start, end, item in index.active(11)] == ["b"]
+
+
+def test_dates():
+    start = datetime.datetime(2017, 1, 18, 7, 0)
+    index = IntervalIndex([(start, start + datetime.timedelta(hours=1), "lunch")])
+    assert index.latest_active(start + datetime.timedelta(minutes=30))[2] == "lunch"
+    assert index.latest_active(start) is None
+
+
+def test_parse_date():
+    assert parse_date("2017-01-18 07:00:01.000001") == datetime.datetime(2017, 1, 18, 7, 0, 1, 1)
+    assert parse_date("2017-01-18 07:00:01.5") == datetime.datetime(2017, 1, 18, 7, 0, 1, 500000)
+    assert parse_date("2017-01-18T07:00:01") == datetime.datetime(2017, 1, 18, 7, 0, 1)
+    assert parse_date("2017-01-18") == datetime.datetime(2017, 1, 18)
+    assert parse_date("2017-02-30 07:00:00") is None
+    assert parse_date("yesterday") is None
+    assert parse_date(None) is None
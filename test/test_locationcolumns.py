@@ -0,0 +1,80 @@
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import random
+import pytest
+from databasehandler import LocationRecord
+from locationcolumns import LocationColumns
+from spatialindex import SpatialIndex
+
+FIELDS = ["location_name", "robot_map_name", "x", "y", "z", "p", "j", "r", "threshold", "crowded", "enviorment"]
+
+
+def random_locations(rng, count):
+    names = [u"office", u"\u00f8ving", u"k\u00e5ken", u"Office", u"a", u"ab", u"b"] + [u"location %d" % i for i in range(count)]
+    return [LocationRecord(name, rng.choice([u"ntnu2.map", u"ntnu3.map", u"lab.map"]), rng.uniform(-30.0, 30.0), rng.uniform(-30.0, 30.0), rng.uniform(0.0, 1.0), 0.0, 0.0, rng.uniform(-3.0, 3.0), rng.uniform(0.5, 3.0), rng.random() < 0.5, 1.0) for name in names]
+
+
+def as_tuple(location):
+    return tuple(getattr(location, field) for field in FIELDS)
+
+
+@pytest.fixture(params=["records", "file"])
+def columns_and_locations(request, tmp_path):
+    locations = random_locations(random.Random(37), 200)
+    columns = LocationColumns.from_records(locations, revision=4)
+    if request.param == "file":
+        path = str(tmp_path / "locations.columns")
+        columns.write(path)
+        columns = LocationColumns.open(path)
+    return columns, locations
+
+
+def test_columns_match_the_records(columns_and_locations):
+    columns, locations = columns_and_locations
+    assert columns.revision == 4
+    assert len(columns) == len(locations)
+    assert sorted(as_tuple(location) for location in columns.all_locations()) == sorted(as_tuple(location) for location in locations)
+    assert sorted(columns.keys()) == sorted(location.location_name for location in locations)
+    assert sorted(columns.values()) == sorted(set(location.robot_map_name for location in locations))
+    for location in locations:
+        index = columns.index_of(location.location_name)
+        assert as_tuple(columns.view(index)) == as_tuple(location)
+        assert columns.get(location.location_name) == location.robot_map_name
+    for name in [u"", u"offic", u"office ", u"z", u"\u00f8"]:
+        assert columns.index_of(name) is None
+        assert columns.get(name, "none") == "none"
+
+
+def test_map_locations_match_the_records(columns_and_locations):
+    columns, locations = columns_and_locations
+    for robot_map_name in [u"ntnu2.map", u"lab.map", u"missing.map"]:
+        expected = [location for location in locations if location.robot_map_name == robot_map_name]
+        sequence = columns.map_locations(robot_map_name)
+        assert sorted(as_tuple(location) for location in sequence) == sorted(as_tuple(location) for location in expected)
+        for crowded in [True, False]:
+            assert sorted(location.location_name for location in sequence.where_crowded(crowded)) == sorted(location.location_name for location in expected if location.crowded == crowded)
+        for location in locations:
+            found = sequence.find(location.location_name)
+            assert (found is not None) == (location.robot_map_name == robot_map_name)
+            if found is not None:
+                assert sequence[sequence.position_of(location.location_name)] == found
+
+
+def test_spatial_index_over_a_sequence(columns_and_locations):
+    columns, locations = columns_and_locations
+    sequence = columns.map_locations(u"ntnu2.map")
+    records = sorted([location for location in locations if location.robot_map_name == u"ntnu2.map"], key=lambda location: location.location_name.encode("utf-8"))
+    from_sequence = SpatialIndex(sequence)
+    from_records = SpatialIndex(records)
+    rng = random.Random(41)
+    for n in range(200):
+        x, y = rng.uniform(-35.0, 35.0), rng.uniform(-35.0, 35.0)
+        assert list(from_sequence.indices_within_threshold(x, y)) == list(from_records.indices_within_threshold(x, y))
+
+
+def test_open_rejects_other_files(tmp_path):
+    path = tmp_path / "other"
+    path.write_bytes(b"not a location file")
+    with pytest.raises(ValueError):
+        LocationColumns.open(str(path))
@@ -0,0 +1,64 @@
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import random
+from locationmatcher import LocationMatcher
+
+
+# The reference: every occurrence of every name, by trying each name at each position
+def brute_find_all(names, text):
+    return sorted((start, start + len(name), name) for name in names for start in range(len(text)) if text.startswith(name, start))
+
+
+def test_find_all_matches_brute_force():
+    generator = random.Random(6)
+    for trial in range(200):
+        names = set("".join(generator.choice("ab ") for i in range(generator.randint(1, 4))) for n in range(generator.randint(1, 8)))
+        text = "".join(generator.choice("ab c") for i in range(generator.randint(0, 30)))
+        assert sorted(LocationMatcher(names).find_all(text)) == brute_find_all(names, text)
+
+
+def test_add_and_remove_match_a_new_matcher():
+    generator = random.Random(7)
+    words = ["entrance", "entrance 2", "el5", "el6", "elevator", "bridge", "home", "ho", "me"]
+    matcher = LocationMatcher()
+    names = set()
+    for step in range(300):
+        name = generator.choice(words)
+        if name in names and generator.random() < 0.5:
+            matcher.remove(name)
+            names.discard(name)
+        else:
+            matcher.add(name)
+            names.add(name)
+        text = " ".join(generator.choice(words + ["the", "to"]) for i in range(5))
+        assert sorted(matcher.find_all(text)) == brute_find_all(names, text)
+        assert matcher.find(text) == LocationMatcher(names).find(text)
+        assert len(matcher) == len(names)
+
+
+def test_longest_mention_wins():
+    matcher = LocationMatcher(["entrance", "entrance 2", "el5"])
+    assert matcher.find("go to entrance 2 please") == ["entrance 2"]
+    assert matcher.find("go to entrance please") == ["entrance"]
+    assert matcher.find("entrance 2 then el5 then entrance") == ["entrance 2", "el5", "entrance"]
+
+
+def test_overlapping_mentions_are_not_repeated():
+    matcher = LocationMatcher(["waiting area", "area 51"])
+    assert matcher.find("the waiting area 51") == ["waiting area"] # Leftmost first, the overlapping name is dropped
+
+
+def test_whole_words():
+    matcher = LocationMatcher(["he", "home"])
+    assert matcher.find("the homes") == []
+    assert matcher.find("the home.") == ["home"]
+    assert matcher.find("he went home") == ["he", "home"]
+    assert matcher.find("the homes", whole_words=False) == ["he", "home"]
+
+
+def test_update_replaces_the_names():
+    matcher = LocationMatcher(["home", "bridge"])
+    matcher.update(["bridge", "cafeteria"])
+    assert "home" not in matcher
+    assert matcher.find("home bridge cafeteria") == ["bridge", "cafeteria"]
@@ -0,0 +1,63 @@
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import math
+import random
+from databasehandler import LocationRecord
+from spatialindex import SpatialIndex
+
+
+def random_locations(rng, count, extent=50.0):
+    locations = []
+    for i in range(count):
+        threshold = rng.choice([0.0, rng.uniform(0.5, 4.0), rng.uniform(0.5, 4.0), rng.uniform(20.0, 60.0) if i % 25 == 0 else 2.0])
+        locations.append(LocationRecord("location %d" % i, "ntnu2.map", rng.uniform(-extent, extent), rng.uniform(-extent, extent), 0, 0, 0, 0, threshold, rng.random() < 0.5, 0))
+    return locations
+
+
+# The reference: every location whose threshold contains the point, closest first
+def brute_within(locations, x, y):
+    found = [(math.hypot(location.x - x, location.y - y), i) for i, location in enumerate(locations)]
+    return [i for distance, i in sorted(found) if distance < locations[i].threshold]
+
+
+def test_lookups_match_brute_force():
+    rng = random.Random(3)
+    for cell_size in [None, 0.7, 5.0, 100.0]:
+        locations = random_locations(rng, 300)
+        index = SpatialIndex(locations, cell_size)
+        xs = [rng.uniform(-70.0, 70.0) for n in range(500)]
+        ys = [rng.uniform(-70.0, 70.0) for n in range(500)]
+        batch = index.batch_indices_within_threshold(xs, ys)
+        for x, y, found in zip(xs, ys, batch):
+            expected = brute_within(locations, x, y)
+            assert list(index.indices_within_threshold(x, y)) == expected
+            assert found == (expected[0] if expected else -1)
+            assert index.within_threshold(x, y) == (locations[expected[0]] if expected else None)
+            nearest = min(locations, key=lambda location: math.hypot(location.x - x, location.y - y))
+            assert index.nearest(x, y) == nearest
+
+
+def test_threshold_is_strict():
+    index = SpatialIndex([LocationRecord("home", "ntnu2.map", 0.0, 0.0, 0, 0, 0, 0, 2.0, False, 0)])
+    assert index.within_threshold(1.999, 0.0) is not None
+    assert index.within_threshold(2.0, 0.0) is None
+    assert list(index.batch_indices_within_threshold([0.0, 2.0, -1.0], [0.0, 0.0, -1.0])) == [0, -1, 0]
+
+
+def test_batches_are_split():
+    rng = random.Random(5)
+    locations = random_locations(rng, 100)
+    index = SpatialIndex(locations)
+    xs = [rng.uniform(-50.0, 50.0) for n in range(1000)]
+    ys = [rng.uniform(-50.0, 50.0) for n in range(1000)]
+    whole = list(index.batch_indices_within_threshold(xs, ys))
+    index.batch_size = 7
+    assert list(index.batch_indices_within_threshold(xs, ys)) == whole
+
+
+def test_empty_index():
+    index = SpatialIndex([])
+    assert index.within_threshold(0.0, 0.0) is None
+    assert index.nearest(0.0, 0.0) is None
+    assert list(index.batch_indices_within_threshold([0.0], [0.0])) == [-1]
@@ -0,0 +1,64 @@
+"""Created by Thomas Rostrup Andersen on 11/11/2016.
+Copyright (C) 2016 Thomas Rostrup Andersen. All rights reserved."""
+
+import math
+import random
+from traveltimes import QuantileEstimator, TravelStatistics, TravelTimes
+
+
+# The reference: the nearest rank quantile of all the values
+def exact_quantile(values, fraction):
+    values = sorted(values)
+    return values[max(int(math.ceil(fraction * len(values))) - 1, 0)]
+
+
+def test_first_five_values_are_exact():
+    rng = random.Random(23)
+    for fraction in [0.05, 0.5, 0.95]:
+        estimator = QuantileEstimator(fraction)
+        assert estimator.value() is None
+        values = []
+        for n in range(5):
+            values.append(rng.uniform(0.0, 100.0))
+            estimator.add(values[-1])
+            assert estimator.value() == exact_quantile(values, fraction)
+
+
+def test_estimate_is_close_to_the_exact_quantile():
+    rng = random.Random(29)
+    for distribution in [lambda: rng.uniform(10.0, 20.0), lambda: rng.expovariate(1 / 30.0), lambda: rng.lognormvariate(3.0, 0.5)]:
+        values = [distribution() for n in range(5000)]
+        for fraction in [0.5, 0.95]:
+            estimator = QuantileEstimator(fraction)
+            for value in values:
+                estimator.add(value)
+            # Compared by rank, the estimate must sit within two percentiles of the asked one
+            rank = sum(1 for value in values if value <= estimator.value()) / float(len(values))
+            assert abs(rank - fraction) < 0.02
+
+
+def test_statistics_match_brute_force():
+    rng = random.Random(31)
+    values = [rng.uniform(5.0, 60.0) for n in range(200)]
+    statistics = TravelStatistics()
+    for value in values:
+        statistics.add(value)
+    mean = sum(values) / len(values)
+    assert abs(statistics.mean - mean) < 1e-9
+    assert abs(statistics.deviation() - math.sqrt(sum((value - mean) ** 2 for value in values) / (len(values) - 1))) < 1e-9
+
+
+def test_pairs_fall_back_on_destination_then_distance():
+    times = TravelTimes()
+    assert times.expected("a", "b", 10.0) == 10.0 / TravelTimes.nominal_speed
+    assert times.timeout("a", "b", 10.0, 1000.0) == 10.0 / TravelTimes.minimum_speed + TravelTimes.timeout_margin
+    for duration in [30.0, 40.0]:
+        times.add("a", "b", duration)
+    times.add("c", "b", 50.0)
+    assert times.statistics("a", "b").count == 3 # Too few from a, the three moves to b from anywhere
+    assert times.expected("a", "b", 10.0) == 40.0
+    times.add("a", "b", 60.0)
+    assert times.statistics("a", "b").count == 3
+    assert times.expected("a", "b", 10.0) == (30.0 + 40.0 + 60.0) / 3
+    assert times.timeout("a", "b", 10.0, 10.0) == 10.0
+    assert sorted(times.summary().keys()) == ["* -> b", "a -> b", "c -> b"]